@@ -1 +1,6 @@
 name = "crystallography"
+
+from os import environ as _environ
+if _environ.get("CRYSTALLOGRAPHY_PROFILE"):
+    from crystallography import profiling
+    profiling.enable_from_environment()
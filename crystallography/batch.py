@@ -0,0 +1,252 @@
+"""
+Module for generating large batches of crystals with the same space group and
+composition. generate_batch yields a crystal_record (see crystal.py) for each
+successful structure, and passes it to any number of streaming writers (see
+writers.py). Expensive setup is shared between the structures of a batch: for
+molecular crystals, the valid orientations are computed once and reused.
+Duplicate structures can be skipped with a duplicate_index (see
+fingerprint.py).
+
+run_sweep generates structures for many tasks (space groups and
+compositions) in seeded chunks, and records each completed chunk in a
+progress_ledger (see ledger.py), so an interrupted sweep can be restarted
+and continues exactly where it stopped.
+
+Example:
+
+    from crystallography.batch import write_batch
+    write_batch("Li.xyz", 206, ['Li'], [16], 2.0, 1000)
+"""
+import os
+import random
+from crystallography.crystal import *
+from crystallography.cif import formula
+from crystallography.stats import generation_stats
+from crystallography.writers import open_writer, rewind_output
+from crystallography.ledger import progress_ledger, task_key, stream_seed
+
+def generate_batch(sg, species, numIons, factor, number, writers=[], molecular=False, accept=None, dedup=None, max_attempts=None, seconds=None, stats=None, cache=None, cache_budget=False, **kwargs):
+    """
+    Generates structures one at a time, and yields the record of each one
+
+    Args:
+        sg: the space group number
+        species: a list of atomic symbols, or molecules if molecular is True
+        numIons: the number of atoms (or molecules) of each specie in the
+            primitive cell
+        factor: the volume factor
+        number: the number of structures to yield
+        writers: a list of structure_writer objects (see writers.py). Each
+            accepted record is added to every writer, and the writers are
+            flushed (but not closed) at the end
+        molecular: if True, generates molecular crystals
+        accept: an optional function accept(record) which returns False for
+            structures which should be skipped. It is called before the
+            pymatgen structure is built, so cheap filters save time
+        dedup: an optional duplicate_index (see fingerprint.py). Structures
+            which duplicate an earlier structure in the index are skipped
+        max_attempts: the largest number of generation attempts. Defaults to
+            10 times number
+        seconds: an optional time budget (see crystal.budget) for each
+            generation attempt
+        stats: an optional generation_stats object (see stats.py), shared by
+            every generation attempt
+        cache: an optional yield_cache (see yield_cache.py). Nothing is
+            generated if the cache marks the task as hopeless. The attempts
+            of this batch are added to the cache when it ends
+        cache_budget: if True and seconds is None, the time budget suggested
+            by the cache is used. The results then depend on timing, so a
+            seed no longer gives the same structures
+        kwargs: passed on to random_crystal or molecular_crystal
+
+    Yields:
+        a crystal_record for each accepted structure
+    """
+    if molecular:
+        from crystallography.molecular_crystal import molecular_crystal
+    if max_attempts is None:
+        max_attempts = 10*number
+    if cache is not None:
+        from crystallography.yield_cache import cache_key
+        key = cache_key(sg, species, numIons, factor, molecular)
+        if cache.hopeless(key):
+            print("Skipping " + key + ": the yield cache marks it as hopeless.")
+            return
+        if cache_budget and seconds is None:
+            seconds = cache.budget(key)
+    orientations = None
+    count = 0
+    #Totals for the yield cache
+    attempts, successes, spent, incompatible = 0, 0, 0.0, False
+    try:
+        for attempt in range(max_attempts):
+            if count >= number:
+                break
+            limit = None if seconds is None else budget(seconds=seconds)
+            start = time()
+            if molecular:
+                rand_crystal = molecular_crystal(sg, species, numIons, factor, orientations=orientations,
+                    budget=limit, stats=stats, **kwargs)
+                #Reuse the orientations, which are the same for every structure
+                if orientations is None and rand_crystal.stop_reason != "incompatible":
+                    orientations = rand_crystal.valid_orientations
+            else:
+                rand_crystal = random_crystal(sg, species, numIons, factor, budget=limit, stats=stats, **kwargs)
+            spent += time() - start
+            attempts += 1
+            if rand_crystal.stop_reason == "incompatible":
+                incompatible = True
+                if stats is not None:
+                    stats.count("incompatible")
+                break
+            if not rand_crystal.valid:
+                continue
+            successes += 1
+            record = rand_crystal.record
+            if accept is not None and not accept(record):
+                continue
+            if dedup is not None and not dedup.accept(record):
+                continue
+            count += 1
+            for writer in writers:
+                writer.add(record)
+            yield record
+        for writer in writers:
+            writer.flush()
+    finally:
+        if cache is not None and attempts > 0:
+            cache.record(key, attempts, successes, spent, incompatible)
+
+def write_batch(filename, sg, species, numIons, factor, number, format=None, chunk=None, **kwargs):
+    """
+    Generates a batch of structures, and writes them to a single file (or
+    binary dataset) as they are generated
+
+    Args:
+        filename: the output file. The format is chosen by open_writer
+        format: "cif", "xyz", or "bin". Defaults to the extension of filename
+        chunk: the number of structures to buffer before writing
+        kwargs: passed on to generate_batch
+
+    Returns:
+        the number of structures written
+    """
+    writer = open_writer(filename, format, chunk)
+    if writer is None:
+        return 0
+    count = 0
+    with writer:
+        for record in generate_batch(sg, species, numIons, factor, number, writers=[writer], **kwargs):
+            count += 1
+    return count
+
+def generate_chunk(task):
+    """
+    Generates a few structures from a fixed seed. Used as the unit of work
+    for worker processes
+
+    Args:
+        task: a tuple (seed, number, sg, species, numIons, factor,
+            molecular, kwargs). kwargs are passed on to generate_batch
+
+    Returns:
+        a list of crystal_record objects (possibly fewer than number), and
+        the generation statistics as a dictionary
+    """
+    seed, number, sg, species, numIons, factor, molecular, kwargs = task
+    #Both random number generators are used during generation
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+    stats = generation_stats()
+    records = list(generate_batch(sg, species, numIons, factor, number, molecular=molecular, stats=stats, **kwargs))
+    return records, stats.to_dict()
+
+def run_sweep(tasks, directory, number, seed=0, chunk=10, format="bin", processes=1, molecular=False, max_failures=3,
+              proceed=None, **kwargs):
+    """
+    Generates structures for a list of tasks, one output per task, and
+    records the progress in directory/ledger.jsonl. If the ledger exists,
+    finished tasks are skipped, and unfinished tasks continue from their
+    last recorded chunk: any output written after it is discarded, and the
+    following chunks use the same seeds as an uninterrupted run
+
+    Args:
+        tasks: a list of (sg, species, numIons, factor) tuples
+        directory: the directory for the outputs and the ledger
+        number: the number of structures to write for each task
+        seed: the base seed. Each chunk gets a seed from the base seed, the
+            task, and the chunk index (see ledger.stream_seed)
+        chunk: the number of structures per chunk
+        format: the output format (see writers.writer_formats)
+        processes: the number of worker processes. Chunks are still written
+            and recorded in order
+        molecular: if True, generates molecular crystals
+        max_failures: a task is abandoned after this many consecutive
+            chunks without a structure
+        proceed: an optional function, called without arguments before each
+            chunk is written. If it returns False, the sweep stops without
+            writing the chunk (e.g., when a work queue lease was lost)
+        kwargs: passed on to generate_batch
+
+    Returns:
+        a dictionary with the number of structures written for each task
+        (including earlier runs), or None if the ledger does not match or
+        proceed returned False
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    ledger = progress_ledger(os.path.join(directory, "ledger.jsonl"))
+    if not ledger.start(seed=seed, number=number, chunk=chunk, format=format, molecular=molecular):
+        return None
+    extension = "" if format in ["bin", "cifs"] else "." + format
+    pool = None
+    if processes > 1:
+        from multiprocessing import Pool
+        pool = Pool(processes)
+    results = {}
+    try:
+        for sg, species, numIons, factor in tasks:
+            key = task_key(sg, species, numIons, factor, molecular)
+            output = os.path.join(directory, key + extension)
+            state = ledger.state(key)
+            if ledger.finished(key):
+                results[key] = state["written"]
+                continue
+            index, written, failures = 0, 0, 0
+            if state is not None:
+                index, written = state["next"], state["written"]
+                rewind_output(output, format, state["position"])
+            elif os.path.exists(output):
+                #Output from a run which stopped before its first chunk
+                rewind_output(output, format, {"structures": 0, "atoms": 0} if format == "bin" else 0)
+            writer = open_writer(output, format)
+            if writer is None:
+                return None
+            with writer:
+                while written < number and failures < max_failures:
+                    #Submit one chunk per process, and write them in order
+                    chunks = []
+                    for i in range(max(1, processes)):
+                        chunks.append((stream_seed(seed, key, index+i), chunk, sg, species, numIons, factor, molecular, kwargs))
+                    outputs = map(generate_chunk, chunks) if pool is None else pool.imap(generate_chunk, chunks)
+                    for records, stats in outputs:
+                        if written >= number or failures >= max_failures:
+                            break
+                        if proceed is not None and not proceed():
+                            return None
+                        records = records[:number-written]
+                        for record in records:
+                            written += 1
+                            writer.add(record, formula(record) + "_" + str(written))
+                        writer.flush()
+                        failures = 0 if records != [] else failures + 1
+                        index += 1
+                        ledger.append({"type": "chunk", "task": key, "next": index, "written": written,
+                                       "position": writer.position(), "runs": stats["counters"]["runs"]})
+            ledger.append({"type": "done", "task": key, "written": written})
+            results[key] = written
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return results
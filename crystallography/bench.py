@@ -0,0 +1,300 @@
+"""
+Benchmark for the atomic crystal generator. Times random_crystal across a
+matrix of space groups (triclinic through cubic, with P, I, R, and F
+centering), species counts, and atom counts, and reports structures per
+second, success rate, p50/p95 latency, and peak memory for each case. Results
+can be saved as a baseline JSON file, and later runs compared against it.
+Run with python -m crystallography.bench. Options (preceded by two dashes):
+
+    number (-n): the number of structures to generate for each case. Defaults to 10
+
+    cases (-c): a comma-separated list of case labels to run. Defaults to all
+
+    baseline (-b): a JSON file with results from a previous run to compare against. Defaults to bench_baseline.json in the package directory. Use "none" to skip the comparison
+
+    save (-s): a JSON file to save the results to
+
+    tolerance (-t): the largest allowed relative drop in structures per second before a case counts as a regression. Defaults to 0.25
+
+    memory (-m): if set, also measures peak memory with tracemalloc, in a separate untimed run
+
+    random seed (-r): the seed for the random number generators. Defaults to 0
+
+The exit code is 1 if any case regressed against the baseline.
+
+Saved results include the settings of the run and a description of the
+machine. Timings are only comparable on similar machines, so a note is
+printed when they differ from the baseline's. Before a release, regenerate
+the reference baseline on the reference machine with the default settings:
+
+    python -m crystallography.bench -b none -s crystallography/bench_baseline.json
+"""
+import os
+import sys
+import json
+import random
+import platform
+from datetime import date
+import tracemalloc
+from time import perf_counter
+from optparse import OptionParser
+import numpy as np
+
+#The baseline compared against by default
+default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+#label, space group, species, number of atoms, volume factor
+benchmark_cases = [
+    ("P1-C4", 1, ['C'], [4], 1.0),
+    ("P-1-SiO2", 2, ['Si', 'O'], [2, 4], 1.0),
+    ("P21/c-MgSiO3", 14, ['Mg', 'Si', 'O'], [4, 4, 12], 1.0),
+    ("Pnma-MgSiO3", 62, ['Mg', 'Si', 'O'], [4, 4, 12], 1.0),
+    ("I4/mmm-C8", 139, ['C'], [8], 1.0),
+    ("R-3m-Bi2Te3", 166, ['Bi', 'Te'], [2, 3], 1.0),
+    ("P63/mmc-C4", 194, ['C'], [4], 1.0),
+    ("Pm-3m-BaTiO3", 221, ['Ba', 'Ti', 'O'], [1, 1, 3], 1.5),
+    ("Fm-3m-NaCl", 225, ['Na', 'Cl'], [1, 1], 1.0),
+    ("Fd-3m-C8", 227, ['C'], [8], 1.0),
+    ("Ia-3-C16", 206, ['C'], [16], 1.0),
+    ("Ia-3-Li24", 206, ['Li'], [24], 2.0),
+    ]
+
+def seed(value):
+    """
+    Seeds both random number generators used for generation
+    """
+    random.seed(value)
+    np.random.seed(value)
+
+def percentile(values, q):
+    if len(values) == 0:
+        return 0.0
+    return float(np.percentile(values, q))
+
+def peak_rss():
+    """
+    Returns the peak resident memory of the process in MB, or None if the
+    resource module is unavailable
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #Linux reports kilobytes, macOS reports bytes
+    if sys.platform == "darwin":
+        return rss/1024.0**2
+    return rss/1024.0
+
+def time_calls(function, number, memory=False, warmup=1):
+    """
+    Calls function() number times, and measures the latency of each call.
+    A few untimed calls are made first, so that cached tables are loaded.
+    Memory is measured in a separate call, since tracemalloc slows down
+    the timed calls
+
+    Returns:
+        a dict with the latencies (in seconds), the number of calls which
+        returned a true value, and the peak traced memory in MB (or None)
+    """
+    for i in range(warmup):
+        function()
+    latencies = []
+    successes = 0
+    for i in range(number):
+        t0 = perf_counter()
+        result = function()
+        latencies.append(perf_counter() - t0)
+        if result:
+            successes += 1
+    peak = None
+    if memory:
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]/1024.0**2
+        tracemalloc.stop()
+    return {"latencies": latencies, "successes": successes, "peak_memory": peak}
+
+def summarize(timing, number):
+    """
+    Converts the output of time_calls into a dict of summary statistics
+    """
+    latencies = timing["latencies"]
+    total = sum(latencies)
+    return {"number": number,
+            "structures_per_second": number/total if total > 0 else 0.0,
+            "success_rate": timing["successes"]/float(number),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "peak_memory": timing["peak_memory"]}
+
+def run_case(case, number=10, memory=False):
+    """
+    Generates number structures for a single benchmark case
+
+    Args:
+        case: a tuple (label, sg, species, numIons, factor)
+        number: the number of structures to generate
+        memory: whether to measure the peak memory with tracemalloc
+
+    Returns:
+        a dict of summary statistics (see summarize)
+    """
+    from crystallography.crystal import random_crystal
+    label, sg, species, numIons, factor = case
+    def generate():
+        return random_crystal(sg, species, numIons, factor).valid
+    return summarize(time_calls(generate, number, memory), number)
+
+def run_benchmark(cases=None, number=10, memory=False, random_seed=0):
+    """
+    Runs each benchmark case, and returns a dict of results keyed by label
+    """
+    if cases is None:
+        cases = benchmark_cases
+    seed(random_seed)
+    results = {}
+    for case in cases:
+        results[case[0]] = run_case(case, number, memory)
+    return results
+
+def compare(results, baseline, tolerance=0.25, key="structures_per_second"):
+    """
+    Compares results against a baseline.
+
+    Args:
+        results: a dict of results keyed by case label
+        baseline: a dict of results from a previous run
+        tolerance: the largest allowed relative drop in the value of key
+        key: the (higher is better) quantity to compare
+
+    Returns:
+        a list of (label, baseline value, new value) for each regressed case
+    """
+    regressions = []
+    for label in results:
+        if label not in baseline:
+            continue
+        old = baseline[label][key]
+        new = results[label][key]
+        if old > 0 and new < old*(1.0-tolerance):
+            regressions.append((label, old, new))
+        #A success rate dropping by more than 0.2 is also a regression
+        if "success_rate" in results[label] and "success_rate" in baseline[label]:
+            if results[label]["success_rate"] < baseline[label]["success_rate"] - 0.2:
+                regressions.append((label+" (success rate)", baseline[label]["success_rate"], results[label]["success_rate"]))
+    return regressions
+
+def load_results(filename):
+    with open(filename, "r") as f:
+        return json.load(f)
+
+def save_results(results, filename, settings=None):
+    """
+    Saves results as JSON. The settings, if given, are stored under the
+    key "_settings", which is not a case label
+    """
+    data = dict(results)
+    if settings is not None:
+        data["_settings"] = settings
+    with open(filename, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+def run_settings(options):
+    """
+    Returns the settings of a run and a description of the machine, for
+    storing with saved results
+    """
+    return {"number": options.number, "seed": options.seed, "date": date.today().isoformat(),
+            "machine": platform.machine(), "processor": platform.processor(), "platform": platform.platform(),
+            "python": platform.python_version(), "numpy": np.__version__, "cpus": os.cpu_count()}
+
+def check_settings(baseline, settings):
+    """
+    Prints a note for each setting which differs from the baseline's
+    """
+    if baseline is None:
+        print("Note: the baseline does not record its settings.")
+        return
+    for key in ["number", "seed", "machine", "processor", "python", "numpy", "cpus"]:
+        if baseline.get(key) != settings.get(key):
+            print("Note: the baseline was run with {:s} = {:s} (now {:s}).".format(
+                key, str(baseline.get(key)), str(settings.get(key))))
+
+def print_results(results, key="structures_per_second", unit="structures/s"):
+    width = max([24] + [len(label) for label in results])
+    print("{:{w}s} {:>14s} {:>8s} {:>10s} {:>10s} {:>10s}".format(
+        "case", unit, "success", "p50 (s)", "p95 (s)", "peak (MB)", w=width))
+    for label in results:
+        r = results[label]
+        peak = "-" if r.get("peak_memory") is None else "{:.2f}".format(r["peak_memory"])
+        print("{:{w}s} {:>14.2f} {:>8.2f} {:>10.5f} {:>10.5f} {:>10s}".format(
+            label, r[key], r.get("success_rate", 1.0), r["p50"], r["p95"], peak, w=width))
+
+def print_regressions(regressions, tolerance):
+    if regressions == []:
+        print("No regressions (tolerance "+str(tolerance)+")")
+        return
+    print("Regressions (tolerance "+str(tolerance)+"):")
+    for label, old, new in regressions:
+        print("  {:24s} {:.4g} -> {:.4g}".format(label, old, new))
+
+def option_parser():
+    """
+    Returns the command line options shared by the benchmark modules
+    """
+    parser = OptionParser()
+    parser.add_option("-n", "--number", dest="number", default=10, type=int,
+            help="number of runs for each case", metavar="number")
+    parser.add_option("-c", "--cases", dest="cases", default=None,
+            help="comma-separated case labels to run", metavar="cases")
+    parser.add_option("-b", "--baseline", dest="baseline", default=None,
+            help="baseline JSON file to compare against", metavar="baseline")
+    parser.add_option("-s", "--save", dest="save", default=None,
+            help="JSON file to save the results to", metavar="save")
+    parser.add_option("-t", "--tolerance", dest="tolerance", default=0.25, type=float,
+            help="allowed relative slowdown", metavar="tolerance")
+    parser.add_option("-m", "--memory", dest="memory", action="store_true", default=False,
+            help="measure peak memory with tracemalloc")
+    parser.add_option("-r", "--seed", dest="seed", default=0, type=int,
+            help="random seed", metavar="seed")
+    return parser
+
+def select_cases(cases, labels):
+    if labels is None:
+        return cases
+    labels = [x.strip() for x in labels.split(',')]
+    return [case for case in cases if case[0] in labels]
+
+def finish(results, options, key="structures_per_second"):
+    """
+    Saves the results and compares against the baseline, depending on the
+    command line options. Returns the exit code
+    """
+    settings = run_settings(options)
+    if options.save is not None:
+        save_results(results, options.save, settings)
+        print("Results saved to "+options.save)
+    if options.baseline is not None and options.baseline != "none":
+        if not os.path.exists(options.baseline):
+            print("Error: the baseline " + options.baseline + " does not exist.")
+            return 1
+        baseline = load_results(options.baseline)
+        check_settings(baseline.get("_settings"), settings)
+        regressions = compare(results, baseline, options.tolerance, key)
+        print_regressions(regressions, options.tolerance)
+        if regressions != []:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    parser = option_parser()
+    parser.set_defaults(baseline=default_baseline)
+    (options, args) = parser.parse_args()
+    cases = select_cases(benchmark_cases, options.cases)
+    results = run_benchmark(cases, options.number, options.memory, options.seed)
+    print_results(results)
+    rss = peak_rss()
+    if rss is not None:
+        print("Peak resident memory: {:.1f} MB".format(rss))
+    sys.exit(finish(results, options))
@@ -0,0 +1,156 @@
+"""
+Micro-benchmarks for the symmetry primitives which are called most often during
+generation: are_equal, site_symm, OperationAnalyzer, matrix2aa, aa2matrix,
+para2matrix, matrix2para, distance, and create_matrix. Inputs are drawn from
+the Wyckoff database (general position operations, special Wyckoff positions,
+and lattices generated for a set of space groups), so that each kernel sees the
+same kind of data as in a real run. Each timed call runs a kernel over its
+whole input set, and the results are reported per kernel call. Run with
+python -m crystallography.bench_kernels.
+
+Accepts the same options as crystallography.bench. With a baseline (-b), the
+exit code is 1 if any kernel is slower than the baseline by more than the
+tolerance (-t), so that optimizations of these kernels are not lost.
+"""
+import sys
+from crystallography.bench import *
+
+#Space groups from which the inputs are drawn (one or more per crystal system)
+kernel_groups = [2, 14, 62, 99, 139, 148, 166, 187, 194, 205, 221, 225, 227, 230]
+
+#label, the inputs (from kernel_inputs) over which the kernel is called
+kernel_cases = [
+    ("are_equal", "pairs"),
+    ("site_symm", "points"),
+    ("OperationAnalyzer", "ops"),
+    ("matrix2aa", "rotations"),
+    ("aa2matrix", "axes"),
+    ("para2matrix", "paras"),
+    ("matrix2para", "matrices"),
+    ("distance", "displacements"),
+    ("create_matrix", "PBCs"),
+    ]
+
+def kernel_inputs(groups=None, points=4):
+    """
+    Draws realistic inputs for the kernels from the Wyckoff database
+
+    Args:
+        groups: a list of space group numbers. Defaults to kernel_groups
+        points: the number of random points, lattices, and displacements
+            drawn for each space group
+
+    Returns:
+        a dict with lists of general position operations, pairs of
+        operations, (point, gen_pos) pairs for special Wyckoff positions,
+        proper orthogonal rotation matrices, axis-angle pairs, cell
+        parameters, lattice matrices, (displacement, lattice) pairs, and
+        boundary conditions
+    """
+    from crystallography.crystal import get_wyckoffs, generate_lattice, para2matrix
+    from crystallography.operations import is_orthogonal, matrix2aa
+    if groups is None:
+        groups = kernel_groups
+    inputs = {"ops": [], "points": [], "rotations": [], "axes": [],
+              "paras": [], "matrices": [], "displacements": []}
+    for sg in groups:
+        wyckoffs = get_wyckoffs(sg)
+        gen_pos = wyckoffs[0]
+        inputs["ops"] += gen_pos
+        for i in range(points):
+            #A point in a random Wyckoff position, as checked by site_symm
+            wp = wyckoffs[np.random.randint(len(wyckoffs))]
+            inputs["points"].append((wp[0].operate(np.random.random(3)), gen_pos))
+            para = generate_lattice(sg, 100.0)
+            if para is None:
+                continue
+            matrix = para2matrix(para)
+            inputs["paras"].append(para)
+            inputs["matrices"].append(matrix)
+            #Displacements between two atoms in the same orbit
+            for j in range(4):
+                op1, op2 = [gen_pos[k] for k in np.random.randint(len(gen_pos), size=2)]
+                xyz = np.random.random(3)
+                inputs["displacements"].append((op1.operate(xyz) - op2.operate(xyz), matrix))
+        #Proper rotations (det = 1) in an orthonormal setting
+        for op in gen_pos:
+            m = op.rotation_matrix
+            if np.linalg.det(m) < 0:
+                m = -m
+            if is_orthogonal(m) and not np.allclose(m, np.identity(3)):
+                inputs["rotations"].append(m)
+    for m in inputs["rotations"]:
+        inputs["axes"].append(matrix2aa(m))
+    #Compare each operation with its neighbor, as in the site symmetry checks
+    ops = inputs["ops"]
+    inputs["pairs"] = list(zip(ops, ops[1:] + ops[:1]))
+    #The boundary conditions used for crystals, 2D crystals, and clusters
+    inputs["PBCs"] = [None, 3, [1, 2, 3]]*20
+    return inputs
+
+def kernel_function(case, inputs):
+    """
+    Returns a function which calls a kernel once for each of its inputs, and
+    the number of kernel calls it makes
+    """
+    from crystallography.crystal import site_symm, para2matrix, matrix2para, distance, create_matrix
+    from crystallography.operations import are_equal, OperationAnalyzer, matrix2aa, aa2matrix
+    kernels = {
+        "are_equal": lambda x: are_equal(x[0], x[1]),
+        "site_symm": lambda x: site_symm(x[0], x[1]),
+        "OperationAnalyzer": OperationAnalyzer,
+        "matrix2aa": matrix2aa,
+        "aa2matrix": lambda x: aa2matrix(x[0], x[1]),
+        "para2matrix": para2matrix,
+        "matrix2para": matrix2para,
+        "distance": lambda x: distance(x[0], x[1]),
+        "create_matrix": create_matrix,
+        }
+    label, key = case
+    kernel = kernels[label]
+    values = inputs[key]
+    return (lambda: [kernel(x) for x in values]), len(values)
+
+def run_case(case, inputs, number=10, memory=False):
+    """
+    Times a single kernel over its inputs
+
+    Args:
+        case: a tuple (label, input key)
+        inputs: the output of kernel_inputs
+        number: the number of sweeps over the inputs
+        memory: whether to measure the peak memory with tracemalloc
+
+    Returns:
+        a dict of summary statistics (see summarize), with latencies and
+        rates given per kernel call
+    """
+    function, calls = kernel_function(case, inputs)
+    timing = time_calls(function, number, memory)
+    timing["latencies"] = [t/calls for t in timing["latencies"]]
+    timing["successes"] = number
+    result = summarize(timing, number)
+    result.pop("structures_per_second")
+    result["calls"] = calls
+    result["calls_per_second"] = 1.0/result["p50"] if result["p50"] > 0 else 0.0
+    return result
+
+def run_benchmark(cases=None, number=10, memory=False, random_seed=0):
+    """
+    Runs each kernel case, and returns a dict of results keyed by label
+    """
+    if cases is None:
+        cases = kernel_cases
+    seed(random_seed)
+    inputs = kernel_inputs()
+    results = {}
+    for case in cases:
+        results[case[0]] = run_case(case, inputs, number, memory)
+    return results
+
+if __name__ == "__main__":
+    (options, args) = option_parser().parse_args()
+    cases = select_cases(kernel_cases, options.cases)
+    results = run_benchmark(cases, options.number, options.memory, options.seed)
+    print_results(results, key="calls_per_second", unit="calls/s")
+    sys.exit(finish(results, options, key="calls_per_second"))
@@ -0,0 +1,124 @@
+"""
+Benchmark for molecular crystal generation. For a fixed set of molecules from
+ASE (H2O, CH4, NH3, C6H6, and C60), times each stage separately:
+reoriented_molecule, get_symmetry, orientation_in_wyckoff_position (for every
+Wyckoff position of the space group), get_sg_orientations, and full
+molecular_crystal generation with and without check_atomic_distances.
+Generation reuses the precomputed orientations, and is further split into
+lattice, placement, and finalization time using a generation_stats object.
+Each generation is limited by a time budget, so that hopeless cases do not
+stall the benchmark. The reason each generation stopped is counted, so
+failed cases (which run until the budget is spent) are reported separately
+from slow ones. Run with python -m crystallography.bench_molecular.
+
+Accepts the same options as crystallography.bench, plus:
+
+    limit (-l): the time budget, in seconds, for each molecular_crystal generation. Defaults to 10
+"""
+import sys
+from crystallography.bench import *
+
+#label, molecule name, space group, number of molecules, volume factor, and
+#volume factor without the atomic check. The factors are large for C6H6 and
+#C60, since estimate_volume_molecular underestimates the volume of flat and
+#hollow molecules. Without the atomic check, molecules are treated as
+#spheres, which need more space unless the molecule is nearly spherical
+molecule_cases = [
+    ("H2O", "H2O", 36, [4], 1.0, 3.0),
+    ("CH4", "CH4", 36, [4], 2.0, 2.0),
+    ("NH3", "NH3", 19, [4], 2.0, 2.0),
+    ("C6H6", "C6H6", 61, [4], 4.0, 12.0),
+    ("C60", "C60", 2, [1], 20.0, 20.0),
+    ]
+
+def run_case(case, number=3, memory=False, limit=10.0):
+    """
+    Times each stage for a single molecule
+
+    Args:
+        case: a tuple (label, molecule name, sg, numMols, factor, factor
+            without the atomic check)
+        number: the number of calls for each stage
+        memory: whether to measure the peak memory with tracemalloc
+        limit: the time budget in seconds for each generation
+
+    Returns:
+        a dict of results keyed by "label/stage". Generation stages also
+        include the time spent per phase, from generation_stats, the number
+        of generations for each stop reason, and the seconds per successful
+        structure (None if none succeeded)
+    """
+    from crystallography.crystal import get_wyckoffs, budget
+    from crystallography.molecule import get_ase_mol, reoriented_molecule, get_symmetry, orientation_in_wyckoff_position
+    from crystallography.molecular_crystal import molecular_crystal, get_sg_orientations
+    from crystallography.stats import generation_stats
+    label, name, sg, numMols, factor, sphere_factor = case
+    mol = get_ase_mol(name)
+    indices = range(len(get_wyckoffs(sg)))
+    results = {}
+    def add(stage, function):
+        timing = time_calls(function, number, memory, warmup=0)
+        result = summarize(timing, number)
+        result["calls_per_second"] = result.pop("structures_per_second")
+        results[label+"/"+stage] = result
+        return result
+
+    add("reoriented_molecule", lambda: reoriented_molecule(mol) is not None)
+    add("get_symmetry", lambda: get_symmetry(mol) is not None)
+    add("orientation_in_wyckoff_position", lambda: [orientation_in_wyckoff_position(mol, sg, i) for i in indices] is not None)
+    add("get_sg_orientations", lambda: get_sg_orientations(mol, sg) is not None)
+    #Compute the orientations once, and reuse them for each generation
+    orientations = molecular_crystal(sg, [mol], numMols, factor, budget=budget(seconds=limit)).valid_orientations
+    for check, f, stage in [(True, factor, "generation (atomic check)"),
+                            (False, sphere_factor, "generation (no atomic check)")]:
+        stats = generation_stats(label+"/"+stage)
+        stops = {}
+        def generate():
+            rand_crystal = molecular_crystal(sg, [mol], numMols, f, orientations=orientations,
+                check_atomic_distances=check, budget=budget(seconds=limit), stats=stats)
+            stops[rand_crystal.stop_reason] = stops.get(rand_crystal.stop_reason, 0) + 1
+            return rand_crystal.valid
+        result = add(stage, generate)
+        for phase in ["lattice", "placement", "finalize"]:
+            result["time "+phase] = stats.times[phase]/number
+        result["stops"] = stops
+        successes = stops.get("success", 0)
+        result["seconds_per_success"] = number/result["calls_per_second"]/successes if successes > 0 else None
+    return results
+
+def run_benchmark(cases=None, number=3, memory=False, random_seed=0, limit=10.0):
+    """
+    Runs each molecule case, and returns a dict of results keyed by
+    "label/stage"
+    """
+    if cases is None:
+        cases = molecule_cases
+    seed(random_seed)
+    results = {}
+    for case in cases:
+        results.update(run_case(case, number, memory, limit))
+    return results
+
+def print_phases(results):
+    print("Generation time per phase (s), and the reasons generation stopped:")
+    print("{:44s} {:>10s} {:>10s} {:>10s} {:>12s}  {:s}".format(
+        "case", "lattice", "placement", "finalize", "s/success", "stops"))
+    for label in results:
+        if "time placement" in results[label]:
+            r = results[label]
+            per_success = "failed" if r["seconds_per_success"] is None else "{:.4f}".format(r["seconds_per_success"])
+            stops = ", ".join("{:s}: {:d}".format(reason, count) for reason, count in sorted(r["stops"].items()))
+            print("{:44s} {:>10.4f} {:>10.4f} {:>10.4f} {:>12s}  {:s}".format(
+                label, r["time lattice"], r["time placement"], r["time finalize"], per_success, stops))
+
+if __name__ == "__main__":
+    parser = option_parser()
+    parser.set_defaults(number=3)
+    parser.add_option("-l", "--limit", dest="limit", default=10.0, type=float,
+            help="time budget in seconds for each generation", metavar="limit")
+    (options, args) = parser.parse_args()
+    cases = select_cases(molecule_cases, options.cases)
+    results = run_benchmark(cases, options.number, options.memory, options.seed, options.limit)
+    print_results(results, key="calls_per_second", unit="calls/s")
+    print_phases(results)
+    sys.exit(finish(results, options, key="calls_per_second"))
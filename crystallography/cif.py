@@ -0,0 +1,152 @@
+"""
+Module for writing symmetrized CIF files directly from a crystal_record (see
+crystal.py). The space group, the symmetry operations, and the Wyckoff position
+of each orbit are already known from generation, so no symmetry search is
+needed: the general position of the space group is written as the list of
+symmetry operations, and one representative site per orbit is written as the
+asymmetric unit, with its multiplicity and Wyckoff letter. This is much faster
+than pymatgen's CifWriter with symprec, which re-analyzes the structure.
+
+Only atomic crystals in 3D are supported. Molecular and 2D crystals should
+still be written with CifWriter.
+
+Example:
+
+    from crystallography.cif import write_cif
+    rand_crystal = random_crystal(225, ['Na', 'Cl'], [1, 1], 1.0)
+    write_cif(rand_crystal.record, "NaCl.cif")
+"""
+from crystallography.crystal import *
+
+symmetry_cache = {} #Symmetry information for each space group, keyed by number
+
+def space_group_symbol(sg):
+    """
+    Returns the Hermann-Mauguin symbol for a space group. Rhombohedral groups
+    use the hexagonal setting, as in the Wyckoff database
+    """
+    symbol = sg_symbol_from_int_number(sg)
+    if symbol.endswith("H"):
+        symbol = symbol[:-1]
+    return symbol
+
+def get_symmetry_info(sg):
+    """
+    Returns the parts of a CIF block which only depend on the space group.
+    Parsing the Wyckoff database and formatting the operations is the
+    slowest part of writing, so the result is cached
+
+    Returns:
+        the space group symbol, a list of the CIF lines for the symmetry
+        operations, and lists of the multiplicity and letter of each Wyckoff
+        position (in the order of get_wyckoffs)
+    """
+    if sg not in symmetry_cache:
+        wyckoffs = get_wyckoffs(sg)
+        op_lines = ["  {:d}  '{:s}'".format(i+1, op.as_xyz_str()) for i, op in enumerate(wyckoffs[0])]
+        multiplicities = [len(wp) for wp in wyckoffs]
+        letters = [letter_from_index(i, sg) for i in range(len(wyckoffs))]
+        symmetry_cache[sg] = (space_group_symbol(sg), op_lines, multiplicities, letters)
+    return symmetry_cache[sg]
+
+def formula(record):
+    """
+    Returns the chemical formula of a record, with the species in the order
+    in which they were generated. Ex: "Na4Cl4"
+    """
+    counts = np.bincount(record.numbers, minlength=len(record.species))
+    return "".join(specie+str(count) for specie, count in zip(record.species, counts) if count > 0)
+
+def asymmetric_unit(record):
+    """
+    Splits the atoms of a record into orbits, and returns one representative
+    site per orbit
+
+    Returns:
+        a list of (specie, multiplicity, Wyckoff letter, fractional
+        coordinate) tuples, or None if the record does not describe an atomic
+        3D crystal (one atom per point of each Wyckoff position)
+    """
+    if record.wyckoffs is None or record.dim != 3:
+        return None
+    symbol, op_lines, multiplicities, letters = get_symmetry_info(record.sg)
+    sites = []
+    start = 0
+    for wp_index in record.wyckoffs:
+        multiplicity = multiplicities[wp_index]
+        if start + multiplicity > len(record):
+            return None
+        specie = record.species[record.numbers[start]]
+        sites.append((specie, multiplicity, letters[wp_index], record.coordinates[start]))
+        start += multiplicity
+    if start != len(record):
+        return None
+    return sites
+
+def cif_block(record, name=None):
+    """
+    Returns a single data block of a symmetrized CIF file as a string
+
+    Args:
+        record: a crystal_record of an atomic 3D crystal
+        name: the name of the data block. Defaults to the formula
+
+    Returns:
+        a string, or None if the record cannot be written with symmetry
+    """
+    sites = asymmetric_unit(record)
+    if sites is None:
+        print("Error: cif_block requires an atomic crystal with Wyckoff information.")
+        return None
+    if name is None:
+        name = formula(record)
+    symbol, op_lines, multiplicities, letters = get_symmetry_info(record.sg)
+    a, b, c, alpha, beta, gamma = matrix2para(record.lattice, radians=False)
+    lines = ["data_"+str(name).replace(" ", "_"),
+             "_symmetry_space_group_name_H-M   '"+symbol+"'",
+             "_symmetry_Int_Tables_number   "+str(record.sg),
+             "_chemical_formula_sum   '"+formula(record)+"'",
+             "_cell_length_a   {:.6f}".format(a),
+             "_cell_length_b   {:.6f}".format(b),
+             "_cell_length_c   {:.6f}".format(c),
+             "_cell_angle_alpha   {:.6f}".format(alpha),
+             "_cell_angle_beta   {:.6f}".format(beta),
+             "_cell_angle_gamma   {:.6f}".format(gamma),
+             "_cell_volume   {:.6f}".format(abs(np.linalg.det(record.lattice))),
+             "loop_",
+             " _symmetry_equiv_pos_site_id",
+             " _symmetry_equiv_pos_as_xyz"]
+    lines += op_lines
+    lines += ["loop_",
+              " _atom_site_label",
+              " _atom_site_type_symbol",
+              " _atom_site_symmetry_multiplicity",
+              " _atom_site_Wyckoff_symbol",
+              " _atom_site_fract_x",
+              " _atom_site_fract_y",
+              " _atom_site_fract_z",
+              " _atom_site_occupancy"]
+    labels = {}
+    for specie, multiplicity, letter, coord in sites:
+        labels[specie] = labels.get(specie, 0) + 1
+        lines.append("  {:s}{:d}  {:s}  {:d}  {:s}  {:.6f}  {:.6f}  {:.6f}  1".format(
+            specie, labels[specie], specie, multiplicity, letter, coord[0], coord[1], coord[2]))
+    return "\n".join(lines) + "\n"
+
+def write_cif(record, filename=None, name=None):
+    """
+    Writes a symmetrized CIF file for a crystal_record
+
+    Args:
+        record: a crystal_record of an atomic 3D crystal
+        filename: the file to write to. If None, nothing is written
+        name: the name of the data block. Defaults to the formula
+
+    Returns:
+        the CIF file as a string, or None if the record cannot be written
+    """
+    text = cif_block(record, name)
+    if text is not None and filename is not None:
+        with open(filename, "w") as f:
+            f.write(text)
+    return text
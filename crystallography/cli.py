@@ -0,0 +1,231 @@
+"""
+Command line entry point for generating many crystals, installed as the
+crystallography command (see setup.py). Structures are generated in a pool of
+worker processes (-j), each seeded from a single base seed, and streamed to
+one of the writers in writers.py as they arrive. A progress line shows the
+throughput while generating, and a summary is printed at the end. With
+--resume, generation continues into an existing output from the last task
+recorded in its ledger (output.ledger.jsonl, see ledger.py), with the same
+seeds as an uninterrupted run.
+
+Example:
+
+    crystallography -s 206 -e Li -n 16 -N 1000 -j 4 -o Li.xyz
+    crystallography -s 36 -m -e H2O -n 4 -N 100 -o ice --resume
+"""
+import os
+import sys
+import random
+from time import time
+from optparse import OptionParser
+from multiprocessing import Pool
+from crystallography.batch import generate_chunk
+from crystallography.cif import formula
+from crystallography.stats import generation_stats
+from crystallography.writers import open_writer, writer_format, read_metadata, rewind_output
+from crystallography.ledger import progress_ledger, stream_seed
+from crystallography.verify import symmetry_verifier
+
+def count_existing(filename, format):
+    """
+    Returns the number of structures already written to an output
+
+    Args:
+        filename: the output file or directory
+        format: the output format (see writers.writer_formats)
+    """
+    if not os.path.exists(filename):
+        return 0
+    if format == "bin":
+        return read_metadata(filename)["structures"]
+    if format == "cifs":
+        return len([name for name in os.listdir(filename) if name.endswith(".cif")])
+    #Count the data blocks of a CIF file, or the frames of an XYZ file
+    marker = "data_" if format == "cif" else "Properties="
+    count = 0
+    with open(filename, "r") as f:
+        for line in f:
+            if (format == "cif" and line.startswith(marker)) or (format != "cif" and marker in line):
+                count += 1
+    return count
+
+def print_progress(done, total, start, quiet=False, end=False):
+    """
+    Prints the number of structures written and the throughput on one line
+    of standard error
+    """
+    if quiet:
+        return
+    elapsed = time() - start
+    rate = done/elapsed if elapsed > 0 else 0.0
+    sys.stderr.write("\r{:d}/{:d} structures, {:.2f} structures/s, {:.1f} s".format(done, total, rate, elapsed))
+    if end:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+def main(argv=None):
+    """
+    Runs the command line interface
+
+    Returns:
+        0 if all requested structures were written, and 1 otherwise
+    """
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-s", "--spacegroup", dest="sg", default=206, type=int,
+            help="desired space group number: 1-230, e.g., 206", metavar="sg")
+    parser.add_option("-e", "--element", dest="element", default="Li",
+            help="desired elements (or molecules with -m): e.g., Li or Si,O", metavar="element")
+    parser.add_option("-n", "--numIons", dest="numIons", default="16",
+            help="desired numbers of atoms (or molecules) of each specie: e.g., 16 or 8,16", metavar="numIons")
+    parser.add_option("-f", "--factor", dest="factor", default=3.0, type=float,
+            help="volume factor: default 3.0", metavar="factor")
+    parser.add_option("-m", "--molecular", dest="molecular", default=False, action="store_true",
+            help="generate molecular crystals; -e gives molecule names, e.g., H2O")
+    parser.add_option("-N", "--number", dest="number", default=10, type=int,
+            help="number of structures to write: default 10", metavar="number")
+    parser.add_option("-o", "--output", dest="output", default="out", type=str,
+            help="output file or directory: default 'out'", metavar="output")
+    parser.add_option("-F", "--format", dest="format", default=None, type=str,
+            help="output format: cif, cifs (one CIF file per structure), xyz, or bin. Default: from the extension of the output, or cifs", metavar="format")
+    parser.add_option("-j", "--processes", dest="processes", default=1, type=int,
+            help="number of worker processes: default 1", metavar="processes")
+    parser.add_option("--seed", dest="seed", default=None, type=int,
+            help="base random seed: default random", metavar="seed")
+    parser.add_option("-t", "--timeout", dest="timeout", default=None, type=float,
+            help="time limit in seconds for each generation attempt: default none", metavar="timeout")
+    parser.add_option("-r", "--resume", dest="resume", default=False, action="store_true",
+            help="add to an existing output until it holds the requested number of structures")
+    parser.add_option("-k", "--check", dest="check", default=0.0, type=float,
+            help="fraction of structures whose symmetry is checked by spglib in the background: default 0", metavar="check")
+    parser.add_option("--report", dest="report", default=None, type=str,
+            help="file for listing symmetry mismatches: default none", metavar="report")
+    parser.add_option("--stats", dest="stats", default=None, type=str,
+            help="file for the generation statistics, as JSON: default none", metavar="stats")
+    parser.add_option("--no-atom-check", dest="checkatoms", default=True, action="store_false",
+            help="for molecular crystals, do not check inter-atomic distances at each step")
+    parser.add_option("--allow-inversion", dest="allowinversion", default=False, action="store_true",
+            help="for molecular crystals, allow inversion of chiral molecules")
+    parser.add_option("-q", "--quiet", dest="quiet", default=False, action="store_true",
+            help="do not print progress")
+    (options, args) = parser.parse_args(argv)
+
+    species = options.element.split(",")
+    numIons = [int(x) for x in options.numIons.split(",")]
+    if len(species) != len(numIons):
+        print("Error: the number of species and the number of counts differ.")
+        return 1
+    format = options.format
+    if format is None:
+        format = writer_format(options.output, default="cifs")
+    existing = count_existing(options.output, format)
+    if existing > 0 and not options.resume:
+        print("Error: " + options.output + " already contains " + str(existing) + " structures. Use --resume to add to it.")
+        return 1
+    #The ledger records the next task and the output position after each
+    #task, so a resumed run continues the same seeds without duplicates
+    ledger_file = options.output.rstrip(os.sep) + ".ledger.jsonl"
+    if not options.resume and os.path.exists(ledger_file):
+        os.remove(ledger_file)
+    ledger = progress_ledger(ledger_file)
+    if existing > 0 and ledger.header is None:
+        print("Error: no ledger " + ledger_file + " was found, so " + options.output + " cannot be resumed.")
+        return 1
+    header = ledger.header if ledger.header is not None else {}
+    seed = options.seed
+    if seed is None:
+        seed = header.get("seed", random.SystemRandom().randint(0, 2**31))
+    #Small tasks keep the progress display and the workers' loads even. The
+    #size depends only on the requested number (or the ledger), and results
+    #are written in task order, so a seed gives the same output for any -j
+    task_size = header.get("task_size", max(1, min(10, options.number//16)))
+    if not ledger.start(seed=seed, task_size=task_size, sg=options.sg, species=species, numIons=numIons,
+                        factor=options.factor, molecular=options.molecular, format=format):
+        return 1
+    state = ledger.state("cli")
+    index, existing = 0, 0
+    if state is not None:
+        index, existing = state["next"], state["written"]
+        rewind_output(options.output, format, state["position"])
+    elif os.path.exists(options.output):
+        #Output from a run which stopped before its first task
+        rewind_output(options.output, format, {"structures": 0, "atoms": 0} if format == "bin" else 0)
+    remaining = options.number - existing
+    if remaining <= 0:
+        print(options.output + " already contains " + str(existing) + " structures.")
+        return 0
+    writer = open_writer(options.output, format)
+    if writer is None:
+        return 1
+
+    kwargs = {}
+    if options.timeout is not None:
+        kwargs["seconds"] = options.timeout
+    if options.molecular:
+        kwargs["check_atomic_distances"] = options.checkatoms
+        kwargs["allow_inversion"] = options.allowinversion
+    pool = Pool(options.processes) if options.processes > 1 else None
+    verifier = None
+    if options.check > 0:
+        verifier = symmetry_verifier(report=options.report, fraction=options.check, processes=0 if pool is None else None)
+    stats = generation_stats(options.sg)
+    start = time()
+    written = 0
+    try:
+        with writer:
+            while written < remaining:
+                tasks = []
+                for n in range(0, remaining - written, task_size):
+                    tasks.append((stream_seed(seed, "cli", index + len(tasks)), min(task_size, remaining - written - n),
+                                  options.sg, species, numIons, options.factor, options.molecular, kwargs))
+                #Results come back in task order
+                results = map(generate_chunk, tasks) if pool is None else pool.imap(generate_chunk, tasks)
+                found = 0
+                for records, task_stats in results:
+                    stats.merge(generation_stats.from_dict(task_stats))
+                    for record in records:
+                        if written >= remaining:
+                            break
+                        name = formula(record) + "_" + str(existing + written + 1)
+                        writer.add(record, name)
+                        if verifier is not None:
+                            verifier.add(record, name)
+                        written += 1
+                        found += 1
+                    writer.flush()
+                    index += 1
+                    ledger.append({"type": "chunk", "task": "cli", "next": index, "written": existing + written,
+                                   "position": writer.position()})
+                    print_progress(existing + written, options.number, start, options.quiet)
+                    if written >= remaining:
+                        break
+                #Stop if a whole round failed (e.g., an incompatible composition)
+                if found == 0:
+                    break
+    except KeyboardInterrupt:
+        print_progress(existing + written, options.number, start, options.quiet, end=True)
+        print("Interrupted. Use --resume to continue.")
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    print_progress(existing + written, options.number, start, options.quiet, end=True)
+
+    elapsed = time() - start
+    print("Wrote {:d} structures to {:s} in {:.2f} s ({:.2f} structures/s)".format(
+        written, options.output, elapsed, written/elapsed if elapsed > 0 else 0.0))
+    print("Success rate: {:.1f}% of {:d} generation attempts".format(
+        100*stats.success_rate(), stats.counters["runs"]))
+    if options.stats is not None:
+        stats.to_json(options.stats)
+    if verifier is not None:
+        verifier.close()
+        for name, requested, detected, error in verifier.mismatches:
+            print("Symmetry mismatch in " + name + ": requested " + str(requested) + ", generated " + str(detected) + " " + error)
+        print(verifier.summary())
+    if existing + written < options.number:
+        print("Error: only " + str(existing + written) + " of " + str(options.number) + " structures were generated.")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+"""
+Module for generation of random atomic clusters with point group symmetry constraints. A pymatgen Molecule object is created, which can be saved to a .xyz file. The Wyckoff positions of the 32 crystallographic point groups are stored in database/wyckoff_list_pg.csv, and the same merge and distance routines as for atomic crystals are used, but without periodic images. Options (preceded by two dashes) are provided for command-line usage of the module:
+
+    pointgroup (-p): the point group number (1-32) or Hermann-Mauguin symbol to be generated. Defaults to 32 (m-3m)
+
+    element (-e): the chemical symbol of the atom(s) to use. For multiple atom types, separate entries with commas. Ex: "C", "H, O, N". Defaults to C
+
+    numIons (-n): the number of atoms in the cluster. For multiple atom types, separate entries with commas. Ex: "8", "1, 4, 12". Defaults to 13
+
+    factor (-f): the relative volume factor used to generate the bounding box. Larger values result in atoms spaced further apart. Defaults to 3.0
+
+    verbosity (-v): the amount of information which should be printed for each generated cluster. For 0, only prints the requested point group. For 1, also prints the contents of the generated pymatgen Molecule. Defaults to 0
+
+    attempts (-a): the number of clusters to generate. Note: if any of the attempts fail, the number of generated clusters will be less than this value. Clusters will be output to separate xyz files. Defaults to 1
+
+    outdir (-o): the file directory where xyz files will be output to. Defaults to "out"
+"""
+from crystallography.crystal import *
+from crystallography.database.pointgroup import Pointgroup
+from pymatgen.core.structure import Molecule
+from time import time
+
+max2 = 30 #Attempts for a given bounding box
+max3 = 30 #Attempts for a given Wyckoff position
+
+wyckoff_pg_df = read_csv(resource_filename("crystallography", "database/wyckoff_list_pg.csv"))
+
+#Clusters have no periodic images along any axis
+PBC_cluster = [1,2,3]
+
+def get_wyckoffs_pg(pg, organized=False):
+    """
+    Returns a list of Wyckoff positions for a given point group.
+    1st index: index of WP in pg (0 is the WP with largest multiplicity)
+    2nd index: a SymmOp object in the WP
+
+    Args:
+        pg: the point group number (between 1 and 32)
+        organized: whether or not to organize the positions by multiplicity,
+            as in get_wyckoffs
+    """
+    wyckoff_strings = eval(wyckoff_pg_df["0"][pg])
+    wyckoffs = []
+    for x in wyckoff_strings:
+        wyckoffs.append([])
+        for y in x:
+            wyckoffs[-1].append(SymmOp.from_xyz_string(y))
+    if organized:
+        wyckoffs_organized = [[]] #2D Array of WP's organized by multiplicity
+        old = len(wyckoffs[0])
+        for wp in wyckoffs:
+            mult = len(wp)
+            if mult != old:
+                wyckoffs_organized.append([])
+                old = mult
+            wyckoffs_organized[-1].append(wp)
+        return wyckoffs_organized
+    else:
+        return wyckoffs
+
+def cluster_box(sg, volume):
+    """
+    Returns a fixed bounding box for a cluster. The box has the metric of the
+    point group's crystal family, so that the point group operations (given in
+    crystal coordinates) act as isometries on the box.
+
+    Args:
+        sg: the international number of the point group's symmorphic space group
+        volume: the volume of the box
+
+    Returns:
+        a 3x3 matrix representing the box vectors
+    """
+    if sg >= 143 and sg <= 194:
+        #Trigonal and hexagonal point groups need a hexagonal metric
+        a = np.cbrt(volume/(sqrt(3.)/2.))
+        return para2matrix([a, a, a, pi/2, pi/2, pi/3*2])
+    else:
+        a = np.cbrt(volume)
+        return para2matrix([a, a, a, pi/2, pi/2, pi/2])
+
+class random_cluster():
+    """
+    Class for storing and generating atomic clusters with point group symmetry.
+    Based on the crystal.random_crystal class for atomic crystals. Given a
+    point group, list of atomic species, stoichiometry, and volume factor,
+    generates a cluster consistent with the given constraints. The cluster is
+    stored as a pymatgen Molecule via self.molecule
+
+    Args:
+        pg: the point group number (between 1 and 32) or Hermann-Mauguin symbol
+        species: a list of atomic symbols for each ion type
+        numIons: a list of the number of each type of atom within the cluster
+        factor: a volume factor used to generate a larger or smaller
+            bounding box. Increasing this gives extra space between atoms
+        budget: an optional budget object from crystal.py, limiting the time
+            or number of operations spent by generate_cluster
+    """
+    def __init__(self, pg, species, numIons, factor, budget=None):
+
+        self.pgp = Pointgroup(pg)
+        self.pg = self.pgp.pg
+        self.sg = self.pgp.sgnumber
+        numIons = np.array(numIons) #must convert it to np.array
+        self.factor = factor
+        self.numIons0 = numIons
+        self.species = species
+        self.Msgs()
+        #Point groups have no centering
+        self.numIons = numIons
+        self.volume = estimate_volume(self.numIons, self.species, self.factor)
+        self.wyckoffs = get_wyckoffs_pg(self.pg, organized=True) #2D Array of Wyckoff positions organized by multiplicity
+        self.generate_cluster(budget=budget)
+
+    def Msgs(self):
+        self.Msg1 = 'Error: the number is incompatible with the wyckoff sites choice'
+        self.Msg2 = 'Error: failed in the cycle of generating structures'
+        self.Msg3 = 'Warning: failed in the cycle of adding species'
+        self.Msg4 = 'Warning: failed in the cycle of choosing wyckoff sites'
+        self.Msg5 = 'Finishing: added the specie'
+        self.Msg6 = 'Finishing: added the whole structure'
+
+    def check_compatible(self):
+        """
+        check if the number of atoms is compatible with the wyckoff positions.
+        Enumerates (and caches) the combinations of Wyckoff positions for
+        each specie, stored in self.combinations
+
+        Returns:
+            False if incompatible, 0 if no combination has degrees of freedom,
+            True otherwise
+        """
+        self.combinations = [get_wyckoff_combinations(self.wyckoffs, int(n), key=('pg', self.pg)) for n in self.numIons]
+        return check_combinations(self.combinations)
+
+    def generate_cluster(self, max2=max2, max3=max3, max_backtrack=max_backtrack, undo="orbit", budget=None):
+        """
+        The main code to generate a random cluster. If successful, stores a
+        pymatgen Molecule in self.molecule and sets self.valid to True. If
+        unsuccessful, sets self.valid to False. The reason for stopping
+        ("success", "incompatible", "attempts", "time", or "operations") is
+        stored in self.stop_reason
+
+        Args:
+            max2: the number of placement attempts for the bounding box
+            max3: the number of attempts for each Wyckoff position before
+                backtracking. May also be a list with one value per specie
+            max_backtrack: the largest number of backtracking steps within
+                a single placement attempt
+            undo: "orbit" or "specie"; what to remove when backtracking
+            budget: an optional budget object. If given, max2 is ignored, and
+                placements are attempted until the budget is used up
+        """
+        self.budget = budget
+        if budget is not None:
+            budget.start()
+            #The bounding box is fixed, so it receives the whole budget
+            budget.share = 1.0
+        self.stop_reason = "attempts"
+        degrees = self.check_compatible()
+        if degrees is False:
+            print(self.Msg1)
+            self.molecule = None
+            self.valid = False
+            self.stop_reason = "incompatible"
+            return
+        if degrees == 0:
+            #Only the origin is available; at most one atom can be placed
+            max2 = 1
+            max3 = 1
+        cell_matrix = cluster_box(self.sg, self.volume)
+        tols = [max(0.5*Element(specie).covalent_radius, tol_m) for specie in self.species]
+        wyckoffs_all = [wp for x in self.wyckoffs for wp in x]
+
+        def add_orbit(index, remaining, orbits):
+            #Make a single attempt at adding a Wyckoff position of specie index
+            specie = self.species[index]
+            #Use the next Wyckoff position from the planned combination
+            k = len([orbit for orbit in orbits if orbit[0] == index])
+            ops = wyckoffs_all[plan[index][k]]
+            #Generate a list of coords from ops, centered on the origin
+            point = np.random.random(3) - 0.5
+            coords_toadd = np.array([op.operate(point) for op in ops])
+            if not check_orbit_distance(coords_toadd, cell_matrix, tols[index], PBC_cluster):
+                return None
+            coordinates_tmp = [orbit[2] for orbit in orbits]
+            sites_tmp = [self.species[orbit[0]] for orbit in orbits]
+            if check_distance(coordinates_tmp, coords_toadd, sites_tmp, specie, cell_matrix, PBC_cluster):
+                return len(coords_toadd), coords_toadd
+            return None
+
+        #Add specie by specie, backtracking on failure
+        orbits = None
+        for cycle2 in lattice_attempts(max2, budget):
+            plan = choose_wyckoff_combination(self.combinations)
+            orbits = place_orbits(self.numIons, add_orbit, max3, max_backtrack, undo, budget)
+            if orbits is not None:
+                break
+
+        if orbits is not None:
+            final_coor = []
+            final_site = []
+            for index, number, coor in orbits:
+                for x in coor:
+                    final_coor.append(x)
+                    final_site.append(self.species[index])
+            self.lattice = cell_matrix
+            #Cartesian coordinates, with the origin at the cluster's center
+            self.coordinates = np.dot(np.array(final_coor), cell_matrix)
+            self.sites = final_site
+            self.molecule = Molecule(final_site, self.coordinates)
+            self.valid = True
+            self.stop_reason = "success"
+            if budget is not None:
+                budget.stop_reason = "success"
+            return
+        if budget is not None and budget.stop_reason is not None:
+            self.stop_reason = budget.stop_reason
+        if degrees == 0: print("Wyckoff positions have no degrees of freedom.")
+        self.molecule = self.Msg2
+        self.valid = False
+        return self.Msg2
+
+if __name__ == "__main__":
+    #-------------------------------- Options -------------------------
+    from os import mkdir
+
+    parser = OptionParser()
+    parser.add_option("-p", "--pointgroup", dest="pg", metavar='pg', default='32', type=str,
+            help="desired point group number (1-32) or symbol, e.g., m-3m")
+    parser.add_option("-e", "--element", dest="element", default='C',
+            help="desired elements: e.g., C", metavar="element")
+    parser.add_option("-n", "--numIons", dest="numIons", default='13',
+            help="desired numbers of atoms: 13", metavar="numIons")
+    parser.add_option("-f", "--factor", dest="factor", default=3.0, type=float,
+            help="volume factor: default 3.0", metavar="factor")
+    parser.add_option("-v", "--verbosity", dest="verbosity", default=0, type=int, help="verbosity: default 0; higher values print more information", metavar="verbosity")
+    parser.add_option("-a", "--attempts", dest="attempts", default=1, type=int,
+            help="number of clusters to generate: default 1", metavar="attempts")
+    parser.add_option("-o", "--outdir", dest="outdir", default="out", type=str,
+            help="Directory for storing output xyz files: default 'out'", metavar="outdir")
+
+    (options, args) = parser.parse_args()
+    element = options.element
+    number = options.numIons
+    numIons = []
+    verbosity = options.verbosity
+    outdir = options.outdir
+
+    if element.find(',') > 0:
+        system = element.split(',')
+        for x in number.split(','):
+            numIons.append(int(x))
+    else:
+        system = [element]
+        numIons = [int(number)]
+    for i in range(options.attempts):
+        start = time()
+        rand_cluster = random_cluster(options.pg, system, numIons, options.factor)
+        timespent = np.around((time() - start), decimals=2)
+
+        if rand_cluster.valid:
+            #Output an xyz file
+            written = False
+            try:
+                mkdir(outdir)
+            except FileExistsError: pass
+            try:
+                comp = str(rand_cluster.molecule.composition)
+                comp = comp.replace(" ", "")
+                xyzpath = outdir + '/' + comp + "_" + str(i+1) + '.xyz'
+                rand_cluster.molecule.to(fmt="xyz", filename=xyzpath)
+                written = True
+            except OSError: pass
+
+            print('Point group requested: ', rand_cluster.pgp.symbol)
+            if written is True:
+                print("    Output to "+xyzpath)
+            else:
+                print("    Could not write xyz file.")
+
+            if verbosity > 0:
+                print("Time required for generation: " + str(timespent) + "s")
+                print(rand_cluster.molecule)
+
+        #If generation fails
+        else:
+            print('something is wrong')
+            print('Time spent during generation attempt: ' + str(timespent) + "s")
@@ -7,7 +7,7 @@ Module for generation of random atomic crystals with symmetry constraints. A pym
 
     numIons (-n): the number of atoms in the PRIMITIVE unit cell (For P-type spacegroups, this is the same as the number of molecules in the conventional unit cell. For A, B, C, and I-centered spacegroups, this is half the number of the conventional cell. For F-centered unit cells, this is one fourth the number of the conventional cell.). For multiple atom types, separate entries with commas. Ex: "8", "1, 4, 12". Defaults to 16  
 
-    factor (-f): the relative volume factor used to generate the unit cell. Larger values result in larger cells, with atoms spaced further apart. If generation fails after max attempts, consider increasing this value. Defaults to 2.0  
+    factor (-f): the relative volume factor used to generate the unit cell. Larger values result in larger cells, with atoms spaced further apart. If generation fails after max attempts, consider increasing this value, or passing an adaptive_factor object to random_crystal. Defaults to 2.0  
 
     verbosity (-v): the amount of information which should be printed for each generated structure. For 0, only prints the requested and generated spacegroups. For 1, also prints the contents of the generated pymatgen structure. Defaults to 0  
 
@@ -32,8 +32,9 @@ import numpy as np
 from random import uniform as rand
 from random import choice as choose
 from random import randint
-from math import sqrt, pi, sin, cos, acos, fabs
+from math import sqrt, pi, sin, cos, acos, fabs, factorial
 from copy import deepcopy
+from time import time
 from pandas import read_csv
 
 from crystallography.database.element import Element
@@ -57,6 +58,8 @@ tol_m = 1.0 #seperation tolerance in Angstroms
 max1 = 30 #Attempts for generating lattices
 max2 = 30 #Attempts for a given lattice
 max3 = 30 #Attempts for a given Wyckoff position
+max_backtrack = 10 #Orbits which may be removed before restarting a placement
+lattice_share = 0.25 #Initial fraction of a budget given to a single lattice
 minvec = 2.0 #minimum vector length
 ang_min = 30
 ang_max = 150
@@ -376,12 +379,26 @@ def ss_string_from_ops(ops, sg, complete=True):
         print("Error: invalid spacegroup number")
         return
 
+def nonperiodic_axes(PBC=None):
+    """
+    Returns the list of axes (1, 2, or 3) without periodic boundary conditions
+
+    Args:
+        PBC: None, a single axis, or a list of axes. Ex: PBC=3 returns [3]
+    """
+    if PBC is None:
+        return []
+    elif type(PBC) in [list, tuple]:
+        return list(PBC)
+    else:
+        return [PBC]
+
 def create_matrix(PBC=None):
     """
     Used for calculating distances in lattices with periodic boundary conditions. When multiplied with a set of points, generates additional points in cells adjacent to and diagonal to the original cell
 
     Args:
-        PBC: an axis which does not have periodic boundary condition. Ex: PBC=1 cancels periodic boundary conditions along the x axis
+        PBC: an axis which does not have periodic boundary condition. Ex: PBC=1 cancels periodic boundary conditions along the x axis. A list of axes may also be given. Ex: PBC=[1,2,3] cancels periodic boundary conditions along all axes, as needed for clusters
 
     Returns:
         A numpy array of matrices which can be multiplied by a set of coordinates
@@ -390,11 +407,12 @@ def create_matrix(PBC=None):
     i_list = [-1, 0, 1]
     j_list = [-1, 0, 1]
     k_list = [-1, 0, 1]
-    if PBC == 1:
+    axes = nonperiodic_axes(PBC)
+    if 1 in axes:
         i_list = [0]
-    elif PBC == 2:
+    if 2 in axes:
         j_list = [0]
-    elif PBC == 3:
+    if 3 in axes:
         k_list = [0]
     for i in i_list:
         for j in j_list:
@@ -404,13 +422,17 @@ def create_matrix(PBC=None):
 
 #Euclidean distance
 def distance(xyz, lattice, PBC=None): 
-    xyz = xyz - np.round(xyz)
+    shift = np.round(xyz)
+    #Do not wrap along axes without periodic boundary conditions
+    for axis in nonperiodic_axes(PBC):
+        shift[axis-1] = 0
+    xyz = xyz - shift
     matrix = create_matrix(PBC)
     matrix += xyz
     matrix = np.dot(matrix, lattice)
     return np.min(cdist(matrix,[[0,0,0]]))       
 
-def check_distance(coord1, coord2, specie1, specie2, lattice, PBC=None, d_factor=1.0):
+def check_distance(coord1, coord2, specie1, specie2, lattice, PBC=None, d_factor=1.0, stats=None):
     """
     Check the distances between two set of molecules. The first set is generally
     larger than the second. Distances between coordinates within the first set are
@@ -425,6 +447,8 @@ def check_distance(coord1, coord2, specie1, specie2, lattice, PBC=None, d_factor
         lattice: matrix describing the unit cell vectors
         PBC: value to be passed to create_matrix
         d_factor: the tolerance is multiplied by this amount. Larger values mean atoms must be farther apart
+        stats: an optional generation_stats object. If given, a rejection is
+            recorded for the first pair of species which is too close
 
     Returns:
         a bool for whether or not the atoms are sufficiently far enough apart
@@ -445,6 +469,8 @@ def check_distance(coord1, coord2, specie1, specie2, lattice, PBC=None, d_factor
             tol = d_factor*0.5*(Element(element).covalent_radius + Element(specie2).covalent_radius)
             #print(d_min, tol)
             if d_min < tol:
+                if stats is not None:
+                    stats.reject_pair(element, specie2)
                 return False
         return True
     else:
@@ -476,7 +502,7 @@ def get_center(xyzs, lattice, PBC=None):
                 matrix_min = matrix0[np.argmin(dists)]
         xyzs[atom1] += matrix_min
     center = xyzs.mean(0)
-    if abs(center[PBC-1])<1e-4:
+    if PBC is not None and abs(center[PBC-1])<1e-4:
         center[PBC-1] = 0.5
     return center
 
@@ -602,10 +628,11 @@ def cellsize(sg):
     	return 4
     else: return "Error: Could not determine lattice type"
 
-def find_short_dist(coor, lattice, tol):
+def find_short_dist(coor, lattice, tol, PBC=None):
     """
     here we find the atomic pairs with shortest distance
     and then build the connectivity map
+    PBC: value to be passed to distance
     """
     pairs=[]
     graph=[]
@@ -614,7 +641,7 @@ def find_short_dist(coor, lattice, tol):
 
     for i1 in range(len(coor)-1):
         for i2 in range(i1+1,len(coor)):
-            dist = distance(coor[i1]-coor[i2], lattice)
+            dist = distance(coor[i1]-coor[i2], lattice, PBC)
             if dist <= tol:
                 #dists.append(dist)
                 pairs.append([i1,i2,dist])
@@ -622,7 +649,7 @@ def find_short_dist(coor, lattice, tol):
     if len(pairs) > 0:
         #print('--------', dists <= (min(dists) + 0.1))
         d_min = min(pairs[:,-1]) + 1e-3
-        sequence = [pairs[:,-1] <= d_min]
+        sequence = pairs[:,-1] <= d_min
         #print(sequence)
         pairs = pairs[sequence]
         #print(pairs)
@@ -674,6 +701,18 @@ def connected_components(graph):
     return sets
 
 def merge_coordinate(coor, lattice, wyckoff, sg, tol, PBC=None):
+    """
+    Merges the points of an orbit which are closer than tol, and checks that
+    the merged points form a Wyckoff position. The atomic generators no
+    longer call this: they place orbits from a planned Wyckoff combination,
+    so overlapping points are rejected with check_orbit_distance instead. It
+    is kept as a public helper, and molecular_crystal uses the variant
+    merge_coordinate_molecular.
+
+    Returns:
+        the (possibly merged) coordinates, and the index of the Wyckoff
+        position, or False if merging fails
+    """
     while True:
         pairs, graph = find_short_dist(coor, lattice, tol)
         index = None
@@ -1101,6 +1140,7 @@ def check_wyckoff_position(points, sg, wyckoffs=None, exact_translation=False):
     else:
         #Check that points are generated from generators
         for i in possible:
+            generators = get_wyckoff_generators(sg)[i]
             p = find_generating_point(points, generators)
             if p is not None:
                 return i
@@ -1120,11 +1160,630 @@ def verify_distances(coordinates, species, lattice, factor=1.0):
                     return False
     return True
 
+def wyckoff_degrees(wp):
+    """
+    Returns the number of degrees of freedom (free parameters) of a Wyckoff
+    position, given as a list of SymmOps. Ex: 3 for 'x,y,z', 1 for 'x,0,0'
+    """
+    return int(np.linalg.matrix_rank(wp[0].rotation_matrix))
+
+def multichoose(n, k):
+    """
+    Returns the number of ways to choose k items from n with repetition
+    """
+    if n == 0:
+        return int(k == 0)
+    return factorial(n+k-1)//(factorial(k)*factorial(n-1))
+
+class wyckoff_combinations():
+    """
+    Class for enumerating the ways to fill a given number of atoms into the
+    Wyckoff positions of a group. Positions without degrees of freedom can be
+    used at most once, while positions with freedom can be used any number of
+    times. Positions with freedom and equal multiplicity are interchangeable,
+    so each combination is stored as a set of fixed positions plus the number
+    of free positions used for each multiplicity. This keeps the enumeration
+    small even when the number of Wyckoff multisets is very large.
+
+    Args:
+        multiplicities: the multiplicity of each Wyckoff position, in the order
+            of the flattened organized list from get_wyckoffs
+        degrees: the number of degrees of freedom of each Wyckoff position
+        number: the number of atoms to place
+    """
+    def __init__(self, multiplicities, degrees, number):
+        self.multiplicities = list(multiplicities)
+        self.degrees = list(degrees)
+        self.number = number
+        #indices of the positions without degrees of freedom
+        self.fixed = [i for i, d in enumerate(self.degrees) if d == 0]
+        #multiplicities of the positions with freedom, from largest to smallest
+        self.free_multiplicities = sorted(set(m for m, d in zip(self.multiplicities, self.degrees) if d > 0), reverse=True)
+        #indices of the positions with freedom, grouped by multiplicity
+        self.free = []
+        for mult in self.free_multiplicities:
+            self.free.append([i for i, (m, d) in enumerate(zip(self.multiplicities, self.degrees)) if d > 0 and m == mult])
+        self.partition_cache = {}
+        self.combinations = {}
+        """A dict mapping each tuple of used fixed positions to a list of
+        tuples, giving how many free positions of each multiplicity
+        (in self.free_multiplicities) are used"""
+        self.add_fixed(0, [], 0)
+
+    def add_fixed(self, j, used, total):
+        #Recursively choose subsets of the fixed positions
+        if j == len(self.fixed):
+            partitions = self.partitions(self.number - total)
+            if partitions != []:
+                self.combinations[tuple(used)] = partitions
+            return
+        i = self.fixed[j]
+        self.add_fixed(j+1, used, total)
+        if total + self.multiplicities[i] <= self.number:
+            self.add_fixed(j+1, used+[i], total+self.multiplicities[i])
+
+    def partitions(self, remaining, j=0):
+        """
+        Returns all ways to write remaining as a sum of free multiplicities,
+        starting from the j-th multiplicity, as tuples of counts
+        """
+        if (remaining, j) in self.partition_cache:
+            return self.partition_cache[(remaining, j)]
+        if j == len(self.free_multiplicities):
+            result = [()] if remaining == 0 else []
+        else:
+            m = self.free_multiplicities[j]
+            result = []
+            for count in range(remaining//m, -1, -1):
+                for rest in self.partitions(remaining - count*m, j+1):
+                    result.append((count,) + rest)
+        self.partition_cache[(remaining, j)] = result
+        return result
+
+    def has_freedom(self, fixed):
+        """
+        Returns whether the combinations using the fixed positions in fixed
+        contain at least one position with degrees of freedom
+        """
+        return sum(self.multiplicities[i] for i in fixed) < self.number
+
+    def count(self, fixed=None):
+        """
+        Returns the number of distinct multisets of Wyckoff positions. If fixed
+        is given, only combinations using exactly those fixed positions count
+        """
+        if fixed is None:
+            return sum(self.count(f) for f in self.combinations)
+        total = 0
+        for partition in self.combinations[fixed]:
+            n = 1
+            for indices, k in zip(self.free, partition):
+                n *= multichoose(len(indices), k)
+            total += n
+        return total
+
+    def sample(self, fixed):
+        """
+        Returns a random combination using the fixed positions in fixed, as a
+        list of Wyckoff position indices sorted from largest to smallest
+        multiplicity
+        """
+        partition = choose(self.combinations[fixed])
+        wps = list(fixed)
+        for indices, k in zip(self.free, partition):
+            for n in range(k):
+                wps.append(choose(indices))
+        return sorted(wps, key=lambda i: -self.multiplicities[i])
+
+combination_cache = {} #Wyckoff combinations, keyed by (group key, number)
+
+def get_wyckoff_combinations(wyckoffs, number, key=None):
+    """
+    Returns a wyckoff_combinations object for a single specie. Results are
+    cached when a key is given.
+
+    Args:
+        wyckoffs: an organized list of Wyckoff positions from get_wyckoffs
+        number: the number of atoms of the specie
+        key: a hashable key identifying the list of Wyckoff positions,
+            e.g. the space group number. If None, results are not cached
+    """
+    if key is not None and (key, number) in combination_cache:
+        return combination_cache[(key, number)]
+    wyckoffs_all = [wp for x in wyckoffs for wp in x]
+    multiplicities = [len(wp) for wp in wyckoffs_all]
+    degrees = [wyckoff_degrees(wp) for wp in wyckoffs_all]
+    combinations = wyckoff_combinations(multiplicities, degrees, number)
+    if key is not None:
+        combination_cache[(key, number)] = combinations
+    return combinations
+
+def check_combinations(combinations):
+    """
+    Checks whether several species can be placed at once, given a
+    wyckoff_combinations object for each. No fixed position may be shared
+    between species.
+
+    Returns:
+        False if no combination exists, 0 if every combination has no degrees
+        of freedom, and True otherwise
+    """
+    seen = {}
+    def search(s, used):
+        #2: possible with freedom, 1: possible without freedom, 0: impossible
+        if s == len(combinations):
+            return 1
+        if (s, used) in seen:
+            return seen[(s, used)]
+        best = 0
+        for fixed in combinations[s].combinations:
+            if used.isdisjoint(fixed):
+                result = search(s+1, used.union(fixed))
+                if result > 0 and combinations[s].has_freedom(fixed):
+                    result = 2
+                best = max(best, result)
+                if best == 2:
+                    break
+        seen[(s, used)] = best
+        return best
+    result = search(0, frozenset())
+    if result == 0:
+        return False
+    elif result == 1:
+        return 0
+    return True
+
+def choose_wyckoff_combination(combinations):
+    """
+    Samples a feasible set of Wyckoff positions for several species at once,
+    so that no fixed position is shared between species.
+
+    Args:
+        combinations: a list of wyckoff_combinations objects, one per specie
+
+    Returns:
+        a list with one list of Wyckoff position indices per specie, or None
+        if no feasible combination exists
+    """
+    failed = set()
+    def search(s, used):
+        if s == len(combinations):
+            return []
+        if (s, used) in failed:
+            return None
+        options = list(combinations[s].combinations)
+        np.random.shuffle(options)
+        for fixed in options:
+            if used.isdisjoint(fixed):
+                rest = search(s+1, used.union(fixed))
+                if rest is not None:
+                    return [fixed] + rest
+        failed.add((s, used))
+        return None
+    chosen = search(0, frozenset())
+    if chosen is None:
+        return None
+    return [c.sample(fixed) for c, fixed in zip(combinations, chosen)]
+
+def check_orbit_distance(coords, lattice, tol, PBC=None):
+    """
+    Checks that the points of a single orbit are at least tol apart,
+    including periodic images. Vectorized replacement for find_short_dist
+    when no merging is needed.
+
+    Returns:
+        a bool for whether or not the points are sufficiently far apart
+    """
+    if len(coords) < 2:
+        return True
+    coords = np.array(coords)
+    i, j = np.triu_indices(len(coords), 1)
+    diffs = coords[i] - coords[j]
+    shift = np.round(diffs)
+    for axis in nonperiodic_axes(PBC):
+        shift[:,axis-1] = 0
+    diffs -= shift
+    images = diffs[:,None,:] + create_matrix(PBC)[None,:,:]
+    dists = np.linalg.norm(np.dot(images, lattice), axis=-1)
+    return np.min(dists) >= tol
+
+class budget():
+    """
+    Class for limiting the effort spent by a single call to generate_crystal
+    (or generate_cluster). Instead of the fixed numbers of attempts max1 and
+    max2, lattices and placements are tried until the wall-clock time or the
+    number of operations runs out. One operation is either a lattice
+    generation or a single attempt at placing a Wyckoff position.
+
+    Each lattice receives a share of the remaining budget. The share shrinks
+    when placements on a lattice make little progress (so that more lattices
+    are tried), and grows when they come close to finishing.
+
+    Args:
+        seconds: the largest wall-clock time, in seconds. None for no limit
+        operations: the largest number of operations. None for no limit
+        share: the initial fraction of the remaining budget for each lattice
+
+    At least one of seconds and operations must be given, otherwise the
+    budget would never run out.
+    """
+    def __init__(self, seconds=None, operations=None, share=lattice_share):
+        if seconds is None and operations is None:
+            raise ValueError("budget requires a time limit or an operation limit")
+        self.seconds = seconds
+        self.operations = operations
+        self.initial_share = share
+        self.start()
+
+    def start(self):
+        """
+        Resets the clock and counters. Called at the start of generate_crystal
+        """
+        self.t0 = time()
+        self.used = 0
+        self.lattices = 0
+        self.share = self.initial_share
+        self.limit = 1.0
+        """The fraction of the budget at which the current lattice stops"""
+        self.progress = 0.0
+        """The largest fraction of atoms placed on the current lattice"""
+        self.stop_reason = None
+
+    def spend(self, n=1):
+        self.used += n
+
+    def elapsed(self):
+        return time() - self.t0
+
+    def fraction(self):
+        """
+        Returns the fraction of the budget which has been used
+        """
+        f = 0.0
+        if self.seconds is not None:
+            f = max(f, self.elapsed()/self.seconds)
+        if self.operations is not None:
+            f = max(f, self.used/self.operations)
+        return f
+
+    def exhausted(self, limit=1.0):
+        """
+        Checks whether the fraction limit of the budget has been used. If the
+        whole budget is used, stores the reason ("time" or "operations") in
+        self.stop_reason
+        """
+        if self.fraction() < limit:
+            return False
+        if self.fraction() >= 1.0 and self.stop_reason is None:
+            if self.seconds is not None and self.elapsed() >= self.seconds:
+                self.stop_reason = "time"
+            else:
+                self.stop_reason = "operations"
+        return True
+
+    def report(self):
+        """
+        Returns a dict describing the budget's usage. stop_reason is "success",
+        "time", "operations", or None if generation stopped for another reason
+        (see stop_reason of the generating object)
+        """
+        return {"stop_reason": self.stop_reason, "seconds": self.elapsed(),
+                "operations": self.used, "lattices": self.lattices}
+
+def attempts(max_attempts, budget=None):
+    """
+    Yields lattice attempts: max_attempts times if no budget is given,
+    otherwise until the budget is used up
+    """
+    if budget is None:
+        for i in range(max_attempts):
+            yield i
+    else:
+        i = 0
+        while not budget.exhausted():
+            budget.lattices += 1
+            budget.progress = 0.0
+            yield i
+            i += 1
+
+def lattice_attempts(max_attempts, budget=None):
+    """
+    Yields placement attempts for a single lattice: max_attempts times if no
+    budget is given, otherwise until the lattice's share of the remaining
+    budget is used up. The share is then adjusted according to how many atoms
+    could be placed on the lattice
+    """
+    if budget is None:
+        for i in range(max_attempts):
+            yield i
+    else:
+        f = budget.fraction()
+        budget.limit = min(1.0, f + budget.share*(1.0-f))
+        i = 0
+        while not budget.exhausted(budget.limit):
+            yield i
+            i += 1
+        if budget.progress < 0.5:
+            budget.share = max(budget.share/2, 0.01)
+        else:
+            budget.share = min(budget.share*2, 0.5)
+        budget.limit = 1.0
+
+class adaptive_factor():
+    """
+    Class for adjusting the volume factor while generating crystals. Rejected
+    placements are recorded by cause: "distance" (an orbit is too close to a
+    previously placed orbit), "merge" (the points of a single orbit overlap,
+    or could not be merged), and "lattice" (no lattice could be generated for
+    the volume). When every placement on a lattice fails, the factor grows,
+    and the next lattice is generated with the larger volume. Lattice failures
+    grow the factor twice as fast, since the cell cannot even be built. After
+    a success, the factor shrinks slightly, so that when the same object is
+    passed to many generators, the factor settles near the densest value which
+    still succeeds.
+
+    Args:
+        factor: the initial volume factor
+        min_factor: the smallest allowed volume factor
+        max_factor: the largest allowed volume factor
+        grow: the multiplier applied after a failed lattice
+        shrink: the multiplier applied after a successful generation
+    """
+    def __init__(self, factor=1.0, min_factor=0.5, max_factor=5.0, grow=1.1, shrink=0.98):
+        self.factor = factor
+        self.min_factor = min_factor
+        self.max_factor = max_factor
+        self.grow = grow
+        self.shrink = shrink
+        self.rejections = {"distance": 0, "merge": 0, "lattice": 0}
+        """Rejections on the current lattice, by cause"""
+        self.total_rejections = {"distance": 0, "merge": 0, "lattice": 0}
+        """Rejections since the object was created, by cause"""
+        self.successes = 0
+        self.failures = 0
+
+    def reject(self, cause):
+        """
+        Records a rejection with cause "distance", "merge", or "lattice"
+        """
+        self.rejections[cause] += 1
+        self.total_rejections[cause] += 1
+
+    def fail(self):
+        """
+        Called when every placement on a lattice failed. Grows the factor
+        according to the recorded rejections
+
+        Returns:
+            the new volume factor
+        """
+        self.failures += 1
+        if self.rejections["lattice"] > 0:
+            step = self.grow**2
+        elif self.rejections["distance"] + self.rejections["merge"] > 0:
+            step = self.grow
+        else:
+            #Failures were not caused by a lack of space
+            step = 1.0
+        self.factor = min(self.max_factor, self.factor*step)
+        self.reset()
+        return self.factor
+
+    def succeed(self):
+        """
+        Called after a successful generation. Shrinks the factor slightly
+
+        Returns:
+            the new volume factor
+        """
+        self.successes += 1
+        self.factor = max(min(self.factor, self.min_factor), self.factor*self.shrink)
+        self.reset()
+        return self.factor
+
+    def reset(self):
+        for cause in self.rejections:
+            self.rejections[cause] = 0
+
+def place_orbits(numIons, add_orbit, max_trials=max3, max_backtrack=max_backtrack, undo="orbit", budget=None):
+    """
+    Place the atoms (or molecules) of each specie orbit by orbit. When no new
+    orbit can be added within the trial budget, only the most recent orbit (or
+    the most recent specie) is removed, and placement continues from there
+    instead of restarting from the first specie.
+
+    Args:
+        numIons: a list with the number of atoms (or molecules) of each specie
+        add_orbit: a function add_orbit(index, remaining, orbits) which makes a
+            single attempt at adding an orbit of specie number index with at
+            most remaining points. orbits is the list of already placed orbits,
+            each stored as [index, number, data]. Returns None if the attempt
+            failed, or a pair (number, data) with the number of added points
+            and any data needed to build the structure later
+        max_trials: the number of attempts for each orbit before backtracking.
+            May also be a list with one value per specie
+        max_backtrack: the largest number of backtracking steps
+        undo: "orbit" to remove only the last orbit when backtracking, or
+            "specie" to remove every orbit of the last specie
+        budget: an optional budget object. Each call to add_orbit spends one
+            operation, and placement stops once budget.limit is reached
+
+    Returns:
+        the list of placed orbits as [index, number, data] lists, or None if
+        placement failed
+    """
+    total = float(sum(numIons))
+    if isinstance(max_trials, (int, np.integer)):
+        max_trials = [max_trials]*len(numIons)
+    orbits = []
+    #The number of attempts used at each depth (number of placed orbits)
+    trials = [0]
+    backtracks = 0
+    index, added = 0, 0
+    while True:
+        #Move on to the next specie once the current one is complete
+        while index < len(numIons) and added == numIons[index]:
+            index += 1
+            added = 0
+        if index == len(numIons):
+            return orbits
+        if budget is not None and budget.exhausted(budget.limit):
+            return None
+        if trials[-1] < max_trials[index]:
+            trials[-1] += 1
+            new = add_orbit(index, numIons[index]-added, orbits)
+            if budget is not None:
+                budget.spend()
+            if new is not None:
+                orbits.append([index, new[0], new[1]])
+                added += new[0]
+                trials.append(0)
+                if budget is not None:
+                    placed = sum(orbit[1] for orbit in orbits)
+                    budget.progress = max(budget.progress, placed/total)
+            continue
+        #The budget for this depth is spent; undo the last orbit or specie
+        if orbits == [] or backtracks >= max_backtrack:
+            return None
+        backtracks += 1
+        last = orbits[-1][0]
+        while orbits != []:
+            orbits.pop()
+            trials.pop()
+            if undo != "specie" or orbits == [] or orbits[-1][0] != last:
+                break
+        if orbits == []:
+            index, added = 0, 0
+        else:
+            index = orbits[-1][0]
+            added = sum(orbit[1] for orbit in orbits if orbit[0] == index)
+
+class crystal_record():
+    """
+    Compact storage for a generated crystal. Only numpy arrays are kept; the
+    pymatgen Structure and the spglib tuple are built the first time they are
+    accessed, so structures which are discarded after a cheap filter never
+    pay for them.
+
+    Args:
+        sg: the space group number
+        lattice: a 3x3 array of lattice vectors
+        coordinates: an Nx3 array of fractional coordinates
+        numbers: an array with the index (within species) of each atom's specie
+        species: a list of specie names
+        wyckoffs: the index of the Wyckoff position (within get_wyckoffs(sg))
+            of each orbit. Optional
+        orbit_species: the specie index of each orbit. Optional
+        points: an array with the generating point (the free parameters) of
+            each orbit. Optional
+        orientations: for molecular crystals, an array with the rotation
+            matrix applied to the molecule of each orbit. Optional
+        dim: 3 for crystals, or 2 for 2D crystals (which are permuted and
+            padded with vacuum, so that sg only describes the layer group)
+    """
+    __slots__ = ["sg", "lattice", "coordinates", "numbers", "species", "wyckoffs",
+                 "orbit_species", "points", "orientations", "dim", "_struct", "_spg_struct"]
+
+    def __init__(self, sg, lattice, coordinates, numbers, species, wyckoffs=None, orbit_species=None, points=None, orientations=None, dim=3):
+        self.sg = sg
+        self.dim = dim
+        self.lattice = np.asarray(lattice, dtype=float)
+        self.coordinates = np.asarray(coordinates, dtype=float)
+        self.numbers = np.asarray(numbers, dtype=np.int32)
+        self.species = list(species)
+        self.wyckoffs = None if wyckoffs is None else np.asarray(wyckoffs, dtype=np.int32)
+        self.orbit_species = None if orbit_species is None else np.asarray(orbit_species, dtype=np.int32)
+        self.points = None if points is None else np.asarray(points, dtype=float)
+        self.orientations = None if orientations is None else np.asarray(orientations, dtype=float)
+        self._struct = None
+        self._spg_struct = None
+
+    @classmethod
+    def from_orbits(cls, sg, lattice, species, orbits):
+        """
+        Builds a record from a list of (specie index, Wyckoff index,
+        generating point, coordinates) tuples, one per orbit
+        """
+        numbers = np.concatenate([[index]*len(coords) for index, wp, point, coords in orbits])
+        coordinates = np.concatenate([coords for index, wp, point, coords in orbits])
+        return cls(sg, lattice, coordinates, numbers, species,
+                   wyckoffs=[orbit[1] for orbit in orbits],
+                   orbit_species=[orbit[0] for orbit in orbits],
+                   points=[orbit[2] for orbit in orbits])
+
+    @classmethod
+    def from_sites(cls, sg, lattice, coordinates, sites, **kwargs):
+        """
+        Builds a record from a list of specie names, one per atom
+        """
+        species = []
+        for site in sites:
+            if site not in species:
+                species.append(site)
+        numbers = [species.index(site) for site in sites]
+        return cls(sg, lattice, coordinates, numbers, species, **kwargs)
+
+    def __len__(self):
+        return len(self.numbers)
+
+    @property
+    def sites(self):
+        """
+        A list with the specie name of each atom
+        """
+        return [self.species[i] for i in self.numbers]
+
+    @property
+    def atomic_numbers(self):
+        #Look up each specie once, instead of once per atom
+        z = np.array([Element(specie).z for specie in self.species], dtype=np.int32)
+        return z[self.numbers]
+
+    @property
+    def struct(self):
+        """
+        The pymatgen Structure, built on first access
+        """
+        if self._struct is None:
+            self._struct = Structure(self.lattice, self.sites, self.coordinates)
+        return self._struct
+
+    @property
+    def spg_struct(self):
+        """
+        The (lattice, coordinates, numbers) tuple used by spglib, built on
+        first access
+        """
+        if self._spg_struct is None:
+            self._spg_struct = (self.lattice, self.coordinates, self.atomic_numbers)
+        return self._spg_struct
+
+def record_attribute(name):
+    """
+    Returns a property which reads name from self.record if a structure was
+    generated. Otherwise, the value set on the generator (such as an error
+    message for struct) is returned
+    """
+    def get(self):
+        if getattr(self, "record", None) is not None:
+            return getattr(self.record, name)
+        return self.__dict__.get("_"+name)
+    def set(self, value):
+        self.__dict__["_"+name] = value
+    return property(get, set, doc="Read from self.record (see crystal_record)")
+
 class random_crystal():
-    def __init__(self, sg, species, numIons, factor):
+    #The generated structure is stored compactly in self.record
+    struct = record_attribute("struct")
+    spg_struct = record_attribute("spg_struct")
+    sites = record_attribute("sites")
+
+    def __init__(self, sg, species, numIons, factor, budget=None, adaptive=None, stats=None):
         
         #Necessary input
         numIons = np.array(numIons) #must convert it to np.array
+        if adaptive is not None:
+            factor = adaptive.factor
         self.factor = factor
         self.numIons0 = numIons
         self.sg = sg
@@ -1133,7 +1792,7 @@ class random_crystal():
         self.numIons = numIons * cellsize(self.sg)
         self.volume = estimate_volume(self.numIons, self.species, self.factor)
         self.wyckoffs = get_wyckoffs(self.sg, organized=True) #2D Array of Wyckoff positions organized by multiplicity
-        self.generate_crystal()
+        self.generate_crystal(budget=budget, adaptive=adaptive, stats=stats)
 
 
     def Msgs(self):
@@ -1146,65 +1805,117 @@ class random_crystal():
 
     def check_compatible(self):
         """
-        check if the number of atoms is compatible with the wyckoff positions
-        needs to improve later
+        check if the number of atoms is compatible with the wyckoff positions.
+        Enumerates (and caches) the combinations of Wyckoff positions for
+        each specie, stored in self.combinations
+
+        Returns:
+            False if incompatible, 0 if no combination has degrees of freedom,
+            True otherwise
         """
-        N_site = [len(x[0]) for x in self.wyckoffs]
-        has_freedom = False
-        #remove WP's with no freedom once they are filled
-        removed_wyckoffs = []
-        for numIon in self.numIons:
-            #Check that the number of ions is a multiple of the smallest Wyckoff position
-            if numIon % N_site[-1] > 0:
-                return False
-            else:
-                #Check if smallest WP has at least one degree of freedom
-                op = self.wyckoffs[-1][-1][0]
-                if op.rotation_matrix.all() != 0.0:
-                    has_freedom = True
-                else:
-                    #Subtract from the number of ions beginning with the smallest Wyckoff positions
-                    remaining = numIon
-                    for x in self.wyckoffs:
-                        for wp in x:
-                            removed = False
-                            while remaining >= len(wp) and wp not in removed_wyckoffs:
-                                #Check if WP has at least one degree of freedom
-                                op = wp[0]
-                                remaining -= len(wp)
-                                if np.allclose(op.rotation_matrix, np.zeros([3,3])):
-                                    removed_wyckoffs.append(wp)
-                                    removed = True
-                                else:
-                                    has_freedom = True
-                    if remaining != 0:
-                        return False
-        if has_freedom:
-            return True
-        else:
-            #print("Warning: Wyckoff Positions have no degrees of freedom.")
-            return 0
+        self.combinations = [get_wyckoff_combinations(self.wyckoffs, int(n), key=self.sg) for n in self.numIons]
+        return check_combinations(self.combinations)
 
-    def generate_crystal(self, max1=max1, max2=max2, max3=max3):
-        """the main code to generate random crystal"""
+    def generate_crystal(self, max1=max1, max2=max2, max3=max3, max_backtrack=max_backtrack, undo="orbit", budget=None, adaptive=None, stats=None):
+        """
+        the main code to generate random crystal. The reason for stopping
+        ("success", "incompatible", "lattice", "attempts", "time", or
+        "operations") is stored in self.stop_reason
+
+        Args:
+            max1: the number of attempts for generating a lattice
+            max2: the number of placement attempts for a given lattice
+            max3: the number of attempts for each Wyckoff position before
+                backtracking. May also be a list with one value per specie
+            max_backtrack: the largest number of backtracking steps within
+                a single placement attempt
+            undo: "orbit" or "specie"; what to remove when backtracking
+            budget: an optional budget object. If given, max1 and max2 are
+                ignored, and lattices and placements are attempted until the
+                budget is used up
+            adaptive: an optional adaptive_factor object. If given, the volume
+                factor grows after each lattice on which placement failed
+            stats: an optional generation_stats object (see stats.py) for
+                recording counters and timers
+        """
+        self.record = None
+        self.budget = budget
+        if budget is not None:
+            budget.start()
+        self.stats = stats
+        if stats is not None:
+            stats.count("runs")
+            t0 = time()
+        self.stop_reason = "attempts"
         #Check the minimum number of degrees of freedom within the Wyckoff positions
         degrees = self.check_compatible()
+        if stats is not None:
+            stats.add_time("compatibility", time()-t0)
         if degrees is False:
             print(self.Msg1)
             self.struct = None
             self.valid = False
+            self.stop_reason = "incompatible"
             return
         else:
-            if degrees is 0:
+            if degrees == 0:
                 max1 = 5
                 max2 = 5
                 max3 = 5
             #Calculate a minimum vector length for generating a lattice
             minvector = max(max(2.0*Element(specie).covalent_radius for specie in self.species), tol_m)
-            for cycle1 in range(max1):
+            tols = [max(0.5*Element(specie).covalent_radius, tol_m) for specie in self.species]
+            wyckoffs_all = [wp for x in self.wyckoffs for wp in x]
+
+            def add_orbit(index, remaining, orbits):
+                #Make a single attempt at adding a Wyckoff position of specie index
+                specie = self.species[index]
+                #Use the next Wyckoff position from the planned combination
+                k = len([orbit for orbit in orbits if orbit[0] == index])
+                ops = wyckoffs_all[plan[index][k]]
+                #Generate a list of coords from ops
+                point = np.random.random(3)
+                coords_toadd = np.array([op.operate(point) for op in ops])
+                coords_toadd -= np.floor(coords_toadd) #scale the coordinates to [0,1], very important!
+                if stats is not None:
+                    stats.count("wyckoff_choices")
+                    stats.count("overlap_checks")
+                if not check_orbit_distance(coords_toadd, cell_matrix, tols[index]):
+                    if adaptive is not None:
+                        adaptive.reject("merge")
+                    return None
+                if stats is not None:
+                    stats.count("overlap_passes")
+                coordinates_tmp = [orbit[2][0] for orbit in orbits]
+                sites_tmp = [self.species[orbit[0]] for orbit in orbits]
+                if check_distance(coordinates_tmp, coords_toadd, sites_tmp, specie, cell_matrix, stats=stats):
+                    return len(coords_toadd), (coords_toadd, plan[index][k], point)
+                if stats is not None:
+                    stats.count("distance_rejections")
+                if adaptive is not None:
+                    adaptive.reject("distance")
+                return None
+
+            for cycle1 in attempts(max1, budget):
                 #1, Generate a lattice
+                if stats is not None:
+                    t0 = time()
                 cell_para = generate_lattice(self.sg, self.volume, minvec=minvector)
+                if stats is not None:
+                    stats.add_time("lattice", time()-t0)
+                    stats.count("lattice_attempts")
+                    if cell_para is None:
+                        stats.count("lattice_failures")
+                if budget is not None:
+                    budget.spend()
                 if cell_para is None:
+                    if adaptive is not None:
+                        #Retry with a larger volume
+                        adaptive.reject("lattice")
+                        self.factor = adaptive.fail()
+                        self.volume = estimate_volume(self.numIons, self.species, self.factor)
+                        continue
+                    self.stop_reason = "lattice"
                     break
                 else:
                     cell_matrix = para2matrix(cell_para)
@@ -1213,82 +1924,62 @@ class random_crystal():
                         print('cell_para:  ', cell_para)
                         sys.exit(0)
 
-                    coordinates_total = [] #to store the added coordinates
-                    sites_total = []      #to store the corresponding specie
-                    good_structure = False
-
-                    for cycle2 in range(max2):
-                        coordinates_tmp = deepcopy(coordinates_total)
-                        sites_tmp = deepcopy(sites_total)
-                        
-            	        #Add specie by specie
-                        for numIon, specie in zip(self.numIons, self.species):
-                            numIon_added = 0
-                            tol = max(0.5*Element(specie).covalent_radius, tol_m)
-
-                            #Now we start to add the specie to the wyckoff position
-                            for cycle3 in range(max3):
-                                #Choose a random Wyckoff position for given multiplicity: 2a, 2b, 2c
-                                ops = choose_wyckoff(self.wyckoffs, numIon-numIon_added) 
-                                if ops is not False:
-            	        	    #Generate a list of coords from ops
-                                    point = np.random.random(3)
-                                    #print('generating new points:', point)
-                                    coords = np.array([op.operate(point) for op in ops])
-                                    #merge_coordinate if the atoms are close
-                                    coords_toadd, good_merge = merge_coordinate(coords, cell_matrix, self.wyckoffs, self.sg, tol)
-                                    if good_merge is not False:
-                                        coords_toadd -= np.floor(coords_toadd) #scale the coordinates to [0,1], very important!
-                                        #print('existing: ', coordinates_tmp)
-                                        if check_distance(coordinates_tmp, coords_toadd, sites_tmp, specie, cell_matrix):
-                                            coordinates_tmp.append(coords_toadd)
-                                            sites_tmp.append(specie)
-                                            numIon_added += len(coords_toadd)
-                                        if numIon_added == numIon:
-                                            coordinates_total = deepcopy(coordinates_tmp)
-                                            sites_total = deepcopy(sites_tmp)
-                                            break
-
-                            if numIon_added != numIon:
-                                break  #need to repeat from the 1st species
-
-                        if numIon_added == numIon:
-                            #print(self.Msg6)
-                            good_structure = True
+                    #2, Add specie by specie, backtracking on failure
+                    orbits = None
+                    if stats is not None:
+                        t0 = time()
+                    for cycle2 in lattice_attempts(max2, budget):
+                        plan = choose_wyckoff_combination(self.combinations)
+                        if stats is not None:
+                            stats.count("placement_attempts")
+                        orbits = place_orbits(self.numIons, add_orbit, max3, max_backtrack, undo, budget)
+                        if orbits is not None:
                             break
-                        else: #reset the coordinates and sites
-                            coordinates_total = []
-                            sites_total = []
-
-                    if good_structure:
-                        final_coor = []
-                        final_site = []
-                        final_number = []
-                        final_lattice = cell_matrix
-                        for coor, ele in zip(coordinates_total, sites_total):
-                            for x in coor:
-                                final_coor.append(x)
-                                final_site.append(ele)
-                                final_number.append(Element(ele).z)
-
-                        self.lattice = final_lattice                    
-                        self.coordinates = np.array(final_coor)
-                        self.sites = final_site                    
-                        self.struct = Structure(final_lattice, final_site, np.array(final_coor))
-                        self.spg_struct = (final_lattice, np.array(final_coor), final_number)
+                    if stats is not None:
+                        stats.add_time("placement", time()-t0)
+
+                    if orbits is None and adaptive is not None:
+                        #Use a larger volume for the next lattice
+                        self.factor = adaptive.fail()
+                        self.volume = estimate_volume(self.numIons, self.species, self.factor)
+
+                    if orbits is not None:
+                        if stats is not None:
+                            t0 = time()
+                        self.record = crystal_record.from_orbits(self.sg, cell_matrix, self.species,
+                            [(index, wp, point, coor) for index, number, (coor, wp, point) in orbits])
+                        self.lattice = self.record.lattice
+                        self.coordinates = self.record.coordinates
                         self.valid = True
+                        self.stop_reason = "success"
+                        if stats is not None:
+                            stats.count("successes")
+                            stats.add_time("finalize", time()-t0)
+                        if budget is not None:
+                            budget.stop_reason = "success"
+                        if adaptive is not None:
+                            adaptive.succeed()
                         return
+        if budget is not None and budget.stop_reason is not None:
+            self.stop_reason = budget.stop_reason
         if degrees == 0: print("Wyckoff positions have no degrees of freedom.")
         self.struct = self.Msg2
         self.valid = False
         return self.Msg2
 
 class random_crystal_2D():
-    def __init__(self, number, species, numIons, thickness, factor):
+    #The generated structure is stored compactly in self.record
+    struct = record_attribute("struct")
+    spg_struct = record_attribute("spg_struct")
+    sites = record_attribute("sites")
+
+    def __init__(self, number, species, numIons, thickness, factor, budget=None, adaptive=None, stats=None):
 
         self.lgp = Layergroup(number)
         self.sg = self.lgp.sgnumber
         numIons = np.array(numIons) #must convert it to np.array
+        if adaptive is not None:
+            factor = adaptive.factor
         self.factor = factor
         self.thickness = thickness
         self.numIons0 = numIons
@@ -1300,7 +1991,7 @@ class random_crystal_2D():
         self.numIons = numIons * cellsize(self.sg)
         self.volume = estimate_volume(self.numIons, self.species, self.factor)
         self.wyckoffs = deepcopy(get_wyckoffs(self.sg, organized=True, PB=self.PB)) 
-        self.generate_crystal()
+        self.generate_crystal(budget=budget, adaptive=adaptive, stats=stats)
 
 
     def Msgs(self):
@@ -1313,142 +2004,164 @@ class random_crystal_2D():
 
     def check_compatible(self):
         """
-        check if the number of atoms is compatible with the wyckoff positions
-        needs to improve later
+        check if the number of atoms is compatible with the wyckoff positions.
+        Enumerates (and caches) the combinations of Wyckoff positions for
+        each specie, stored in self.combinations
+
+        Returns:
+            False if incompatible, 0 if no combination has degrees of freedom,
+            True otherwise
         """
-        N_site = [len(x[0]) for x in self.wyckoffs]
-        has_freedom = False
-        #remove WP's with no freedom once they are filled
-        removed_wyckoffs = []
-        for numIon in self.numIons:
-            #Check that the number of ions is a multiple of the smallest Wyckoff position
-            if numIon % N_site[-1] > 0:
-                return False
-            else:
-                #Check if smallest WP has at least one degree of freedom
-                op = self.wyckoffs[-1][-1][0]
-                if op.rotation_matrix.all() != 0.0:
-                    has_freedom = True
-                else:
-                    #Subtract from the number of ions beginning with the smallest Wyckoff positions
-                    remaining = numIon
-                    for x in self.wyckoffs:
-                        for wp in x:
-                            removed = False
-                            while remaining >= len(wp) and wp not in removed_wyckoffs:
-                                #Check if WP has at least one degree of freedom
-                                op = wp[0]
-                                remaining -= len(wp)
-                                if np.allclose(op.rotation_matrix, np.zeros([3,3])):
-                                    removed_wyckoffs.append(wp)
-                                    removed = True
-                                else:
-                                    has_freedom = True
-                    if remaining != 0:
-                        return False
-        if has_freedom:
-            return True
-        else:
-            #print("Warning: Wyckoff Positions have no degrees of freedom.")
-            return 0
+        self.combinations = [get_wyckoff_combinations(self.wyckoffs, int(n), key=('lg', self.lgp.lg)) for n in self.numIons]
+        return check_combinations(self.combinations)
 
-    def generate_crystal(self, max1=max1, max2=max2, max3=max3):
-        """the main code to generate random crystal """
+    def generate_crystal(self, max1=max1, max2=max2, max3=max3, max_backtrack=max_backtrack, undo="orbit", budget=None, adaptive=None, stats=None):
+        """
+        the main code to generate random crystal. The reason for stopping
+        ("success", "incompatible", "lattice", "attempts", "time", or
+        "operations") is stored in self.stop_reason
+
+        Args:
+            max1: the number of attempts for generating a lattice
+            max2: the number of placement attempts for a given lattice
+            max3: the number of attempts for each Wyckoff position before
+                backtracking. May also be a list with one value per specie
+            max_backtrack: the largest number of backtracking steps within
+                a single placement attempt
+            undo: "orbit" or "specie"; what to remove when backtracking
+            budget: an optional budget object. If given, max1 and max2 are
+                ignored, and lattices and placements are attempted until the
+                budget is used up
+            adaptive: an optional adaptive_factor object. If given, the volume
+                factor grows after each lattice on which placement failed
+            stats: an optional generation_stats object (see stats.py) for
+                recording counters and timers
+        """
+        self.record = None
+        self.budget = budget
+        if budget is not None:
+            budget.start()
+        self.stats = stats
+        if stats is not None:
+            stats.count("runs")
+            t0 = time()
+        self.stop_reason = "attempts"
         #Check the minimum number of degrees of freedom within the Wyckoff positions
         degrees = self.check_compatible()
-        if degrees is 0:
+        if stats is not None:
+            stats.add_time("compatibility", time()-t0)
+        if degrees == 0:
             print("Generation cancelled: Wyckoff positions have no degrees of freedom.")
             self.struct = None
             self.valid = False
+            self.stop_reason = "incompatible"
             return
         elif degrees is False:
             print(self.Msg1)
             self.struct = None
             self.valid = False
+            self.stop_reason = "incompatible"
             return
         else:
             #Calculate a minimum vector length for generating a lattice
             minvector = max(max(2.0*Element(specie).covalent_radius for specie in self.species), tol_m)
-            for cycle1 in range(max1):
+            tols = [max(0.5*Element(specie).covalent_radius, tol_m) for specie in self.species]
+            wyckoffs_all = [wp for x in self.wyckoffs for wp in x]
+
+            def add_orbit(index, remaining, orbits):
+                #Make a single attempt at adding a Wyckoff position of specie index
+                specie = self.species[index]
+                #Use the next Wyckoff position from the planned combination
+                k = len([orbit for orbit in orbits if orbit[0] == index])
+                ops = wyckoffs_all[plan[index][k]]
+                #Generate a list of coords from ops
+                point = np.random.random(3)
+                coords_toadd = np.array([op.operate(point) for op in ops])
+                coords_toadd -= np.floor(coords_toadd) #scale the coordinates to [0,1], very important!
+                if stats is not None:
+                    stats.count("wyckoff_choices")
+                    stats.count("overlap_checks")
+                if not check_orbit_distance(coords_toadd, cell_matrix, tols[index], self.PBC):
+                    if adaptive is not None:
+                        adaptive.reject("merge")
+                    return None
+                if stats is not None:
+                    stats.count("overlap_passes")
+                coordinates_tmp = [orbit[2][0] for orbit in orbits]
+                sites_tmp = [self.species[orbit[0]] for orbit in orbits]
+                if check_distance(coordinates_tmp, coords_toadd, sites_tmp, specie, cell_matrix, self.PBC, stats=stats):
+                    return len(coords_toadd), (coords_toadd, plan[index][k], point)
+                if stats is not None:
+                    stats.count("distance_rejections")
+                if adaptive is not None:
+                    adaptive.reject("distance")
+                return None
+
+            for cycle1 in attempts(max1, budget):
                 #1, Generate a lattice
+                if stats is not None:
+                    t0 = time()
                 cell_para = generate_lattice_2d(self.sg, self.volume, self.thickness, self.P, minvec=minvector)
+                if stats is not None:
+                    stats.add_time("lattice", time()-t0)
+                    stats.count("lattice_attempts")
+                if budget is not None:
+                    budget.spend()
                 cell_matrix = para2matrix(cell_para)
-                coordinates_total = [] #to store the added coordinates
-                sites_total = []      #to store the corresponding specie
-                good_structure = False
-
-                for cycle2 in range(max2):
-                    coordinates_tmp = deepcopy(coordinates_total)
-                    sites_tmp = deepcopy(sites_total)
-                    
-            	    #Add specie by specie
-                    for numIon, specie in zip(self.numIons, self.species):
-                        numIon_added = 0
-                        tol = max(0.5*Element(specie).covalent_radius, tol_m)
-
-                        #Now we start to add the specie to the wyckoff position
-                        for cycle3 in range(max3):
-                            #Choose a random Wyckoff position for given multiplicity: 2a, 2b, 2c
-                            ops = choose_wyckoff(self.wyckoffs, numIon-numIon_added) 
-                            if ops is not False:
-            	    	    #Generate a list of coords from ops
-                                point = np.random.random(3)
-                                #print('generating new points:', point)
-                                coords = np.array([op.operate(point) for op in ops])
-                                coords_toadd, good_merge = merge_coordinate(coords, cell_matrix, self.wyckoffs, self.sg, tol, self.PBC)
-                                if good_merge:
-                                    coords_toadd -= np.floor(coords_toadd) #scale the coordinates to [0,1], very important!
-                                    #print('Adding: ', coords_toadd)
-                                    if check_distance(coordinates_tmp, coords_toadd, sites_tmp, specie, cell_matrix, self.PBC):
-                                        coordinates_tmp.append(coords_toadd)
-                                        sites_tmp.append(specie)
-                                        numIon_added += len(coords_toadd)
-                                    if numIon_added == numIon:
-                                        coordinates_total = deepcopy(coordinates_tmp)
-                                        sites_total = deepcopy(sites_tmp)
-                                        break
-                        if numIon_added != numIon:
-                            break  #need to repeat from the 1st species
-
-                    if numIon_added == numIon:
-                        #print(self.Msg6)
-                        good_structure = True
+
+                #2, Add specie by specie, backtracking on failure
+                orbits = None
+                if stats is not None:
+                    t0 = time()
+                for cycle2 in lattice_attempts(max2, budget):
+                    plan = choose_wyckoff_combination(self.combinations)
+                    if stats is not None:
+                        stats.count("placement_attempts")
+                    orbits = place_orbits(self.numIons, add_orbit, max3, max_backtrack, undo, budget)
+                    if orbits is not None:
                         break
-                    else: #reset the coordinates and sites
-                        coordinates_total = []
-                        sites_total = []
-
-                if good_structure:
-                    final_coor = []
-                    final_site = []
-                    final_number = []
-                    final_lattice = cell_matrix
-                    for coor, ele in zip(coordinates_total, sites_total):
-                        for x in coor:
-                            final_coor.append(x)
-                            final_site.append(ele)
-                            final_number.append(Element(ele).z)
-                    final_coor = np.array(final_coor)
-                    final_lattice, final_coor = Permutation(final_lattice, final_coor, self.PB)
-                    #print('before:  ', final_coor)
+                if stats is not None:
+                    stats.add_time("placement", time()-t0)
+
+                if orbits is None and adaptive is not None:
+                    #Use a larger volume for the next lattice
+                    self.factor = adaptive.fail()
+                    self.volume = estimate_volume(self.numIons, self.species, self.factor)
+
+                if orbits is not None:
+                    if stats is not None:
+                        t0 = time()
+                    record = crystal_record.from_orbits(self.sg, cell_matrix, self.species,
+                        [(index, wp, point, coor) for index, number, (coor, wp, point) in orbits])
+                    final_lattice, final_coor = Permutation(record.lattice, record.coordinates, self.PB)
                     final_lattice, final_coor = Add_vacuum(final_lattice, final_coor)
-                    #print('cell:  ', matrix2para(final_lattice))
-                    #print(final_lattice)
-                    #print(self.PB)
-                    #print('length: ',len(self.wyckoffs)) 
-                    self.lattice = final_lattice                    
+                    #The Wyckoff indices and points are in the unpermuted setting of
+                    #self.wyckoffs, so they are not kept with the final atoms
+                    record = crystal_record(self.sg, final_lattice, final_coor, record.numbers, self.species, dim=2)
+                    self.record = record
+                    self.lattice = final_lattice
                     self.coordinates = final_coor
-                    self.sites = final_site                    
-                    self.struct = Structure(final_lattice, final_site, np.array(final_coor))
-                    self.spg_struct = (final_lattice, np.array(final_coor), final_number)
                     self.valid = True
+                    self.stop_reason = "success"
+                    if stats is not None:
+                        stats.count("successes")
+                        stats.add_time("finalize", time()-t0)
+                    if budget is not None:
+                        budget.stop_reason = "success"
+                    if adaptive is not None:
+                        adaptive.succeed()
                     return
+        if budget is not None and budget.stop_reason is not None:
+            self.stop_reason = budget.stop_reason
         if degrees == 0: print("Wyckoff positions have no degrees of freedom.")
         self.struct = self.Msg2
         self.valid = False
         return self.Msg2
 
 if __name__ == "__main__":
+    from os import mkdir
+    from crystallography.cif import write_cif, formula
+    from crystallography.verify import symmetry_verifier
     #-------------------------------- Options -------------------------
     parser = OptionParser()
     parser.add_option("-s", "--spacegroup", dest="sg", metavar='sg', default=206, type=int,
@@ -1466,8 +2179,10 @@ if __name__ == "__main__":
             help="number of crystals to generate: default 1", metavar="attempts")
     parser.add_option("-o", "--outdir", dest="outdir", default="out", type=str, 
             help="Directory for storing output cif files: default 'out'", metavar="outdir")
-
-
+    parser.add_option("-c", "--check", dest="check", default=1.0, type=float,
+            help="fraction of structures whose symmetry is checked by spglib in the background: default 1.0", metavar="check")
+    parser.add_option("-r", "--report", dest="report", default=None, type=str,
+            help="file for listing symmetry mismatches: default none", metavar="report")
 
 
     (options, args) = parser.parse_args()    
@@ -1475,7 +2190,6 @@ if __name__ == "__main__":
     number = options.numIons
     numIons = []
     verbosity = options.verbosity
-    attempts = options.attempts
     outdir = options.outdir
 
     if element.find(',') > 0:
@@ -1485,30 +2199,37 @@ if __name__ == "__main__":
     else:
         system = [element]
         numIons = [int(number)]
-    for i in range(attempts):
+    verifier = None
+    if options.check > 0:
+        verifier = symmetry_verifier(report=options.report, fraction=options.check, chunk=10)
+    for i in range(options.attempts):
         numIons0 = np.array(numIons)
         sg = options.sg
+        start = time()
         rand_crystal = random_crystal(options.sg, system, numIons0, options.factor)
+        timespent = np.around((time() - start), decimals=2)
 
         if rand_crystal.valid:
             #Output a cif file
             written = False
             try:
                 mkdir(outdir)
-            except: pass
+            except FileExistsError: pass
+            comp = formula(rand_crystal.record)
+            cifpath = outdir + '/' + comp + "_" + str(i+1) + '.cif'
             try:
-                comp = str(rand_crystal.struct.composition)
-                comp = comp.replace(" ", "")
-                cifpath = outdir + '/' + comp + "_" + str(i+1) + '.cif'
-                CifWriter(rand_crystal.struct, symprec=0.1).write_file(filename = cifpath)
+                #The symmetry is known, so write the cif without re-analysis
+                write_cif(rand_crystal.record, cifpath)
                 written = True
-            except: pass
+            except OSError as e:
+                print("Error: " + str(e))
             #POSCAR output
             #rand_crystal.struct.to(fmt="poscar", filename = '1.vasp')
 
-            #spglib style structure called cell
-            ans = get_symmetry_dataset(rand_crystal.spg_struct, symprec=1e-1)['number']
-            print('Space group  requested: ', sg, 'generated', ans)
+            #Check the symmetry in the background
+            if verifier is not None:
+                verifier.add(rand_crystal.record, comp + "_" + str(i+1))
+            print('Space group  requested: ', sg)
             if written is True:
                 print("    Output to "+cifpath)
             else:
@@ -1524,3 +2245,8 @@ if __name__ == "__main__":
         else: 
             print('something is wrong')
             print('Time spent during generation attempt: ' + str(timespent) + "s")
+    if verifier is not None:
+        verifier.close()
+        for name, requested, detected, error in verifier.mismatches:
+            print("Symmetry mismatch in " + name + ": requested " + str(requested) + ", generated " + str(detected) + " " + error)
+        print(verifier.summary())
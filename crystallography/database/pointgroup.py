@@ -0,0 +1,85 @@
+from optparse import OptionParser
+
+class Pointgroup:
+    '''
+    Class for storing the 32 crystallographic point groups. Used for the
+    generation of atomic clusters. Each point group is the point group of a
+    symmorphic P-type space group, with the origin at the point of highest
+    symmetry. Thus, we can access the symmetry information using code for
+    standard space groups by keeping only the Wyckoff positions which pass
+    through the origin.
+
+    Args:
+        input_value: The point group number or Hermann-Mauguin symbol
+    '''
+    def __init__(self, input_value):
+
+        # list of point group number, symbol, and symmorphic space group number
+        self.group_list = [
+            (1,     '1',        1),
+            (2,     '-1',       2),
+            (3,     '2',        3),
+            (4,     'm',        6),
+            (5,     '2/m',      10),
+            (6,     '222',      16),
+            (7,     'mm2',      25),
+            (8,     'mmm',      47),
+            (9,     '4',        75),
+            (10,    '-4',       81),
+            (11,    '4/m',      83),
+            (12,    '422',      89),
+            (13,    '4mm',      99),
+            (14,    '-42m',     111),
+            (15,    '4/mmm',    123),
+            (16,    '3',        143),
+            (17,    '-3',       147),
+            (18,    '32',       150),
+            (19,    '3m',       156),
+            (20,    '-3m',      164),
+            (21,    '6',        168),
+            (22,    '-6',       174),
+            (23,    '6/m',      175),
+            (24,    '622',      177),
+            (25,    '6mm',      183),
+            (26,    '-6m2',     187),
+            (27,    '6/mmm',    191),
+            (28,    '23',       195),
+            (29,    'm-3',      200),
+            (30,    '432',      207),
+            (31,    '-43m',     215),
+            (32,    'm-3m',     221),
+            ]
+
+        self.input = str(input_value)
+        self.error = False
+        self.pg = None
+        if self.input.isdigit():
+            self.pg = int(self.input)
+            '''The point group number (between 1 and 32)'''
+        else:
+            for i, e1 in enumerate(self.group_list):
+                if e1[1] == self.input:
+                    self.pg = e1[0]
+                    break
+        if (self.pg is not None) and (0<self.pg<33):
+            self.symbol=self.group_list[self.pg-1][1]
+            '''The Hermann-Mauguin symbol of the point group'''
+            self.sgnumber = self.group_list[self.pg-1][2]
+            '''The international number of the symmorphic space group'''
+        else:
+            self.error = True
+            print('Error:   unable to find the point group, check your input: ', self.input)
+
+    def print_all(self):
+        if self.error is False:
+            print('Point group number: ', self.pg)
+            print('Point group symbol: ', self.symbol)
+            print('Space group number: ', self.sgnumber)
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-i", "--input", dest="input", metavar='pg',
+            help="input number or symbol")
+
+    (options, args) = parser.parse_args()
+    Pointgroup(options.input).print_all()
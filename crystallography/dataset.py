@@ -0,0 +1,112 @@
+"""
+Module for reading binary datasets written by writers.binary_writer. The
+column files are memory-mapped, so opening a dataset reads only its metadata,
+and memory use stays flat no matter how many structures it holds. Each
+structure is available as numpy views into the mapped files (no copies), and
+can be converted to a pymatgen Structure or an ASE Atoms object on demand.
+
+Example:
+
+    from crystallography.dataset import structure_dataset
+    dataset = structure_dataset("out")
+    lattice, coordinates, numbers, sg = dataset[12345]
+    struct = dataset.to_structure(12345)
+"""
+import os
+import numpy as np
+from crystallography.writers import binary_columns, per_atom_columns, read_metadata
+
+class structure_dataset():
+    """
+    Random access to the structures of a binary dataset.
+
+    Args:
+        directory: the directory written by binary_writer
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.refresh()
+
+    def refresh(self):
+        """
+        Re-reads the metadata and maps the column files. Structures appended
+        since the dataset was opened become visible
+        """
+        self.metadata = read_metadata(self.directory)
+        self.columns = {}
+        for name in binary_columns:
+            dtype, shape = binary_columns[name]
+            rows = self.metadata["atoms"] if name in per_atom_columns else self.metadata["structures"]
+            path = os.path.join(self.directory, name+".bin")
+            if rows == 0:
+                self.columns[name] = np.zeros((0,)+shape, dtype=dtype)
+            else:
+                #Only map the rows covered by the metadata
+                self.columns[name] = np.memmap(path, dtype=dtype, mode="r", shape=(rows,)+shape)
+        self.lattices = self.columns["lattices"]
+        self.index = self.columns["index"]
+        self.coordinates = self.columns["coordinates"]
+        self.numbers = self.columns["numbers"]
+
+    def __len__(self):
+        return self.metadata["structures"]
+
+    def __getitem__(self, i):
+        """
+        Returns views of the lattice (3x3), the fractional coordinates (Nx3),
+        the atomic numbers (N), and the space group number of structure i
+        """
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("structure index out of range")
+        start, size, sg = self.index[i]
+        return (self.lattices[i], self.coordinates[start:start+size],
+                self.numbers[start:start+size], int(sg))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def sizes(self):
+        """
+        Returns the number of atoms in each structure
+        """
+        return self.index[:,1]
+
+    def space_groups(self):
+        """
+        Returns the space group number of each structure
+        """
+        return self.index[:,2]
+
+    def to_structure(self, i):
+        """
+        Returns structure i as a pymatgen Structure
+        """
+        from pymatgen.core.structure import Structure
+        lattice, coordinates, numbers, sg = self[i]
+        return Structure(np.array(lattice), [int(z) for z in numbers], np.array(coordinates))
+
+    def to_atoms(self, i):
+        """
+        Returns structure i as an ASE Atoms object
+        """
+        from ase import Atoms
+        lattice, coordinates, numbers, sg = self[i]
+        atoms = Atoms(numbers=np.array(numbers, dtype=int), cell=np.array(lattice),
+                      scaled_positions=np.array(coordinates), pbc=True)
+        atoms.info["spacegroup"] = sg
+        return atoms
+
+    def to_record(self, i):
+        """
+        Returns structure i as a crystal_record (see crystal.py), with one
+        specie per distinct atomic number
+        """
+        from crystallography.crystal import crystal_record
+        from crystallography.database.element import Element
+        lattice, coordinates, numbers, sg = self[i]
+        species_z, indices = np.unique(numbers, return_inverse=True)
+        species = [Element(int(z)).short_name for z in species_z]
+        return crystal_record(sg, lattice, coordinates, indices, species)
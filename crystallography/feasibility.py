@@ -0,0 +1,159 @@
+"""
+Module for quickly checking which space groups, layer groups, or point groups
+can host a given stoichiometry. Instead of instantiating random_crystal for
+each group, the Wyckoff multiplicities and degrees of freedom are read from
+precomputed tables (database/wyckoff_table.csv, wyckoff_table_lg.csv, and
+wyckoff_table_pg.csv), and the number of feasible Wyckoff decompositions is
+counted for every group at once. Options (preceded by two dashes) are provided
+for command-line usage of the module:
+
+    numIons (-n): the number of atoms of each specie in the formula unit. For multiple atom types, separate entries with commas. Ex: "1", "1, 1, 3". Defaults to 1
+
+    dimension (-d): 3 for space groups, 2 for layer groups, or 0 for point groups. Defaults to 3
+
+    Z (-z): the number of formula units per primitive cell. Defaults to 1
+
+    freedom (-f): if set, only lists groups with at least one decomposition containing degrees of freedom
+"""
+from crystallography.crystal import *
+
+wyckoff_table_df = read_csv(resource_filename("crystallography", "database/wyckoff_table.csv"))
+wyckoff_table_lg_df = read_csv(resource_filename("crystallography", "database/wyckoff_table_lg.csv"))
+wyckoff_table_pg_df = read_csv(resource_filename("crystallography", "database/wyckoff_table_pg.csv"))
+
+#The number of groups, the table, and the combination cache key for each dimension
+group_tables = {3: (230, wyckoff_table_df, lambda n: n),
+                2: (80, wyckoff_table_lg_df, lambda n: ('lg', n)),
+                0: (32, wyckoff_table_pg_df, lambda n: ('pg', n))}
+
+table_cache = {} #Parsed tables, keyed by (dim, number)
+
+def get_wyckoff_table(number, dim=3):
+    """
+    Returns the multiplicities and degrees of freedom of the Wyckoff positions
+    of a group, in the same order as get_wyckoffs (or get_wyckoffs_pg)
+
+    Args:
+        number: the space group, layer group, or point group number
+        dim: 3 for space groups, 2 for layer groups, 0 for point groups
+
+    Returns:
+        a list of multiplicities and a list of degrees of freedom
+    """
+    if (dim, number) not in table_cache:
+        table = eval(group_tables[dim][1]["0"][number])
+        table_cache[(dim, number)] = ([x[0] for x in table], [x[1] for x in table])
+    return table_cache[(dim, number)]
+
+def group_cellsize(number, dim=3):
+    """
+    Returns the number of duplications in the conventional cell of a group.
+    Point groups have no centering
+    """
+    if dim == 3:
+        return cellsize(number)
+    elif dim == 2:
+        return cellsize(Layergroup(number).sgnumber)
+    return 1
+
+def get_table_combinations(number, N, dim=3):
+    """
+    Returns a wyckoff_combinations object for N atoms in a group, built from
+    the precomputed tables. Shares crystal.combination_cache, so the result is
+    reused by random_crystal, random_crystal_2D, and random_cluster
+    """
+    key = group_tables[dim][2](number)
+    if (key, N) not in combination_cache:
+        multiplicities, degrees = get_wyckoff_table(number, dim)
+        combination_cache[(key, N)] = wyckoff_combinations(multiplicities, degrees, N)
+    return combination_cache[(key, N)]
+
+def count_decompositions(combinations):
+    """
+    Counts the joint Wyckoff decompositions for several species, where no
+    position without degrees of freedom is shared between species
+
+    Args:
+        combinations: a list of wyckoff_combinations objects, one per specie
+
+    Returns:
+        the number of distinct decompositions (as multisets of Wyckoff
+        positions for each specie)
+    """
+    seen = {}
+    def search(s, used):
+        if s == len(combinations):
+            return 1
+        if (s, used) not in seen:
+            total = 0
+            for fixed in combinations[s].combinations:
+                if used.isdisjoint(fixed):
+                    total += combinations[s].count(fixed) * search(s+1, used.union(fixed))
+            seen[(s, used)] = total
+        return seen[(s, used)]
+    return search(0, frozenset())
+
+def check_feasibility(numIons, number, dim=3, Z=1):
+    """
+    Checks whether a stoichiometry fits into the Wyckoff positions of a group
+
+    Args:
+        numIons: a list of the number of atoms of each specie per formula unit
+        number: the space group, layer group, or point group number
+        dim: 3 for space groups, 2 for layer groups, 0 for point groups
+        Z: the number of formula units per primitive cell
+
+    Returns:
+        a pair (degrees, count). degrees is False if no decomposition exists,
+        0 if no decomposition has degrees of freedom, and True otherwise (the
+        same values as check_compatible). count is the number of
+        decompositions
+    """
+    size = group_cellsize(number, dim)
+    combinations = [get_table_combinations(number, int(n*Z*size), dim) for n in numIons]
+    degrees = check_combinations(combinations)
+    if degrees is False:
+        return False, 0
+    return degrees, count_decompositions(combinations)
+
+def feasible_groups(numIons, dim=3, Z=1, freedom=False):
+    """
+    Checks a stoichiometry against every group of a given dimension
+
+    Args:
+        numIons: a list of the number of atoms of each specie per formula unit
+        dim: 3 for space groups, 2 for layer groups, 0 for point groups
+        Z: the number of formula units per primitive cell
+        freedom: if True, exclude groups where no decomposition has degrees
+            of freedom
+
+    Returns:
+        a dict mapping each feasible group number to its number of
+        Wyckoff decompositions
+    """
+    result = {}
+    for number in range(1, group_tables[dim][0]+1):
+        degrees, count = check_feasibility(numIons, number, dim, Z)
+        if degrees is False or (freedom and degrees == 0):
+            continue
+        result[number] = count
+    return result
+
+if __name__ == "__main__":
+    #-------------------------------- Options -------------------------
+    parser = OptionParser()
+    parser.add_option("-n", "--numIons", dest="numIons", default='1',
+            help="desired numbers of atoms: 1, 1, 3", metavar="numIons")
+    parser.add_option("-d", "--dimension", dest="dimension", default=3, type=int,
+            help="3 for space groups, 2 for layer groups, 0 for point groups", metavar="dimension")
+    parser.add_option("-z", "--Z", dest="Z", default=1, type=int,
+            help="number of formula units per primitive cell", metavar="Z")
+    parser.add_option("-f", "--freedom", dest="freedom", action="store_true", default=False,
+            help="only list groups with degrees of freedom")
+    (options, args) = parser.parse_args()
+    numIons = [int(x) for x in options.numIons.split(',')]
+
+    groups = feasible_groups(numIons, options.dimension, options.Z, options.freedom)
+    print("Feasible groups: "+str(len(groups)))
+    for number in groups:
+        print("{:4d} {:>20d}".format(number, groups[number]))
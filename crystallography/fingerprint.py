@@ -0,0 +1,208 @@
+"""
+Module for detecting duplicate structures in a batch. Each structure is
+summarized by a cheap fingerprint which does not depend on the choice of
+origin, setting, or atom order: for every pair of species (sorted by name),
+a histogram of the interatomic distances up to a cutoff, counted per atom.
+Distances are split linearly between the two nearest bins, so small
+displacements change the histogram smoothly.
+
+A duplicate_index stores the fingerprints of all structures seen so far in
+buckets keyed by the composition and a few coarse features. A new structure
+is only compared against the structures in neighboring buckets, so each
+check takes roughly constant time, no matter how many structures have been
+added. Pass a duplicate_index to batch.generate_batch (dedup keyword) to skip
+duplicates during generation.
+
+Example:
+
+    from crystallography.fingerprint import duplicate_index
+    index = duplicate_index()
+    for record in records:
+        if index.add(record) is None:
+            print("new structure")
+"""
+import numpy as np
+from itertools import product
+
+def pair_distances(lattice, coordinates, cutoff):
+    """
+    Returns all interatomic distances up to cutoff, including periodic images
+
+    Args:
+        lattice: a 3x3 array of lattice vectors
+        coordinates: an Nx3 array of fractional coordinates
+        cutoff: the largest distance to include
+
+    Returns:
+        arrays i, j, and d, where d[k] is a distance from atom i[k] to an
+        image of atom j[k]. Each pair is included in both orders
+    """
+    lattice = np.asarray(lattice, dtype=float)
+    coordinates = np.asarray(coordinates, dtype=float)
+    #The number of cells needed along each axis, from the plane spacings
+    reciprocal = np.linalg.inv(lattice).T
+    n = np.ceil(cutoff*np.linalg.norm(reciprocal, axis=1)).astype(int)
+    shifts = np.array(list(product(*[range(-x, x+1) for x in n])), dtype=float)
+    diff = coordinates[None,:,:] - coordinates[:,None,:]
+    diff -= np.round(diff)
+    #Cartesian vectors for every (i, j, shift)
+    vectors = np.dot(diff, lattice)[:,:,None,:] + np.dot(shifts, lattice)[None,None,:,:]
+    d = np.sqrt(np.sum(vectors**2, axis=-1))
+    mask = (d <= cutoff) & (d > 1e-6)
+    i, j, k = np.nonzero(mask)
+    return i, j, d[mask]
+
+def fingerprint(record, cutoff=6.0, bin_width=0.1, normalize=False):
+    """
+    Computes the species-resolved distance histogram of a structure
+
+    Args:
+        record: a crystal_record (see crystal.py)
+        cutoff: the largest distance included, in Angstroms
+        bin_width: the width of each histogram bin, in Angstroms
+        normalize: if True, distances are divided by (V/N)**(1/3), so that
+            structures which only differ by a uniform scaling have the same
+            fingerprint (cutoff and bin_width are then in these units)
+
+    Returns:
+        a 1D array with one histogram per species pair, in sorted order,
+        counted per atom
+    """
+    lattice = np.asarray(record.lattice)
+    scale = 1.0
+    if normalize:
+        scale = (abs(np.linalg.det(lattice))/len(record))**(1.0/3)
+    #Relabel the species in sorted order, so the fingerprint does not depend
+    #on the order in which species were given
+    order = np.argsort(record.species)
+    rank = np.empty(len(order), dtype=int)
+    rank[order] = np.arange(len(order))
+    numbers = rank[np.asarray(record.numbers)]
+    n_species = len(record.species)
+    i, j, d = pair_distances(lattice, record.coordinates, cutoff*scale)
+    a = np.minimum(numbers[i], numbers[j])
+    b = np.maximum(numbers[i], numbers[j])
+    pair = a*n_species - a*(a-1)//2 + (b - a)
+    n_pairs = n_species*(n_species+1)//2
+    n_bins = int(np.ceil(cutoff/bin_width)) + 1
+    #Split each distance between the two nearest bins
+    x = d/scale/bin_width
+    low = np.floor(x).astype(int)
+    weight = x - low
+    hist = np.bincount(pair*n_bins + low, weights=1.0-weight, minlength=n_pairs*n_bins)
+    hist += np.bincount(pair*n_bins + np.minimum(low+1, n_bins-1), weights=weight, minlength=n_pairs*n_bins)
+    return hist[:n_pairs*n_bins]/len(record)
+
+def fingerprint_distance(fp1, fp2):
+    """
+    Returns the relative L1 distance between two fingerprints, between 0
+    (identical) and 1
+    """
+    total = max(np.sum(fp1), np.sum(fp2))
+    if total == 0:
+        return 0.0
+    return float(np.sum(np.abs(fp1 - fp2))/(2*total))
+
+def composition_key(record):
+    """
+    Returns a hashable composition, independent of the order of species
+    """
+    counts = np.bincount(record.numbers, minlength=len(record.species))
+    return tuple(sorted(zip(record.species, counts.tolist())))
+
+class duplicate_index():
+    """
+    Index of fingerprints for online duplicate detection.
+
+    Args:
+        tolerance: the largest fingerprint_distance at which two structures
+            count as duplicates
+        cutoff: the distance cutoff for the fingerprints
+        bin_width: the histogram bin width
+        normalize: whether to normalize distances by the volume per atom
+    """
+    def __init__(self, tolerance=0.05, cutoff=6.0, bin_width=0.1, normalize=False):
+        self.tolerance = tolerance
+        self.cutoff = cutoff
+        self.bin_width = bin_width
+        self.normalize = normalize
+        #Within the tolerance, both coarse features change by less than
+        #about 2.2*tolerance, so duplicates are always in neighboring buckets
+        self.step = 3*tolerance
+        self.buckets = {}
+        """Lists of (id, fingerprint), keyed by composition and coarse features"""
+        self.count = 0
+        """The number of structures added to the index"""
+        self.duplicates = 0
+        """The number of structures found to be duplicates"""
+
+    def features(self, fp):
+        """
+        Returns two coarse features of a fingerprint, in units of step: the
+        mean distance (relative to the cutoff) and the logarithm of the
+        number of neighbors per atom
+        """
+        total = np.sum(fp)
+        if total == 0:
+            return 0, 0
+        n_bins = int(np.ceil(self.cutoff/self.bin_width)) + 1
+        distances = np.tile(np.arange(n_bins), len(fp)//n_bins)*self.bin_width
+        mean = np.sum(fp*distances)/total/self.cutoff
+        return int(np.floor(mean/self.step)), int(np.floor(np.log(total)/self.step))
+
+    def find(self, record, fp=None):
+        """
+        Looks for a duplicate of record in the index
+
+        Returns:
+            the id of a duplicate structure, or None
+        """
+        if fp is None:
+            fp = fingerprint(record, self.cutoff, self.bin_width, self.normalize)
+        composition = composition_key(record)
+        x, y = self.features(fp)
+        for dx, dy in product([-1, 0, 1], repeat=2):
+            for id, other in self.buckets.get((composition, x+dx, y+dy), []):
+                if fingerprint_distance(fp, other) <= self.tolerance:
+                    return id
+        return None
+
+    def add(self, record):
+        """
+        Adds a structure to the index, unless it duplicates a structure
+        which was already added
+
+        Returns:
+            None if the structure is new, or the id of the structure it
+            duplicates. Ids count the added structures from 0
+        """
+        fp = fingerprint(record, self.cutoff, self.bin_width, self.normalize)
+        duplicate = self.find(record, fp)
+        if duplicate is not None:
+            self.duplicates += 1
+            return duplicate
+        x, y = self.features(fp)
+        self.buckets.setdefault((composition_key(record), x, y), []).append((self.count, fp))
+        self.count += 1
+        return None
+
+    def accept(self, record):
+        """
+        Returns True if the structure is new (and adds it), or False if it is
+        a duplicate. May be used as the accept function of generate_batch
+        """
+        return self.add(record) is None
+
+    def __len__(self):
+        return self.count
+
+def deduplicate(records, **kwargs):
+    """
+    Returns the records which are not duplicates of an earlier record
+
+    Args:
+        records: a list of crystal_record objects
+        kwargs: passed on to duplicate_index
+    """
+    index = duplicate_index(**kwargs)
+    return [record for record in records if index.accept(record)]
@@ -0,0 +1,452 @@
+"""
+Module for storing generated crystals as compact "genomes". A crystal produced
+by random_crystal is fully determined by its space group, its lattice, and,
+for each orbit, the specie, the Wyckoff position, and the free parameters of
+the generating point. Molecular crystals also need the orientation of each
+molecule. A crystal_genome stores only these values, and serializes to a few
+tens of bytes with to_bytes. expand() rebuilds the full crystal_record (see
+crystal.py), with coordinates equal to the generated ones up to floating point
+rounding.
+
+A generated crystal has many equivalent genomes: any operation of the affine
+normalizer of the space group (an origin shift or a change of axes which maps
+the group onto itself) gives a different genome for the same crystal, as does
+the choice of representative atom within each orbit. In polar groups, the
+origin may also be shifted by any amount along the polar axes.
+canonical_genome picks one of them in a fixed way, so exact duplicates can be found by comparing
+genome_hash values instead of calling spglib or StructureMatcher.
+
+Example:
+
+    from crystallography.genome import crystal_genome
+    rand_crystal = random_crystal(62, ['Mg', 'Si', 'O'], [4, 4, 12], 1.0)
+    data = crystal_genome.from_record(rand_crystal.record).to_bytes()
+    record = crystal_genome.from_bytes(data).expand()
+"""
+import struct
+import hashlib
+import numpy as np
+from itertools import product, permutations
+from scipy.spatial.transform import Rotation
+from crystallography.crystal import crystal_record, get_wyckoffs, get_wyckoff_generators, para2matrix, matrix2para
+from crystallography.database.element import Element
+import crystallography.database.hall as hall
+
+genome_version = 1
+header_format = "<BBBHB" #version, flags, space group, number of orbits, number of species
+molecular_flag = 1
+
+#For each space group: the affine matrices of each Wyckoff position, and the
+#axes of the generating point which the Wyckoff position depends on
+wyckoff_cache = {}
+generator_cache = {}
+
+def get_wyckoff_info(sg):
+    """
+    Returns the stacked affine matrices (one array per Wyckoff position) and
+    the free axes of each Wyckoff position of a space group. An axis is free
+    if any operation of the Wyckoff position depends on that coordinate of
+    the generating point; the other coordinates can be set to 0 without
+    changing the orbit
+    """
+    if sg not in wyckoff_cache:
+        matrices = []
+        axes = []
+        for wp in get_wyckoffs(sg):
+            affine = np.array([op.affine_matrix for op in wp])
+            matrices.append(affine)
+            used = np.any(np.abs(affine[:,:3,:3]) > 1e-8, axis=(0,1))
+            axes.append(np.nonzero(used)[0])
+        wyckoff_cache[sg] = (matrices, axes)
+    return wyckoff_cache[sg]
+
+def get_generator_matrices(sg):
+    """
+    Returns the stacked affine matrices of the Wyckoff generators (see
+    get_wyckoff_generators), used to place molecules
+    """
+    if sg not in generator_cache:
+        generator_cache[sg] = [np.array([op.affine_matrix for op in wp]) for wp in get_wyckoff_generators(sg)]
+    return generator_cache[sg]
+
+def lower_lattice(lattice):
+    """
+    Returns the 6 lower triangular entries of a lattice matrix. Lattices from
+    para2matrix are already lower triangular; other lattices are rotated into
+    this form first, which does not change the fractional coordinates
+    """
+    lattice = np.asarray(lattice, dtype=float)
+    if np.any(np.abs(np.triu(lattice, 1)) > 1e-12):
+        lattice = para2matrix(matrix2para(lattice))
+    return lattice[np.tril_indices(3)]
+
+class crystal_genome():
+    """
+    Compact description of a generated crystal.
+
+    Args:
+        sg: the space group number
+        lattice: the 6 lower triangular entries of the lattice matrix
+        species: the atomic number of each specie (empty for molecular
+            crystals, where the species come from the molecules)
+        orbit_species: the specie (or molecule) index of each orbit
+        wyckoffs: the Wyckoff index (within get_wyckoffs(sg)) of each orbit
+        params: the free parameters of all orbits, concatenated. For
+            molecular crystals, the full generating point of each orbit
+        rotations: for molecular crystals, the rotation vector of each
+            molecule. None for atomic crystals
+        inversions: for molecular crystals, 1 for each orbit whose
+            orientation includes an inversion, and 0 otherwise
+    """
+    __slots__ = ["sg", "lattice", "species", "orbit_species", "wyckoffs", "params", "rotations", "inversions"]
+
+    def __init__(self, sg, lattice, species, orbit_species, wyckoffs, params, rotations=None, inversions=None):
+        self.sg = int(sg)
+        self.lattice = np.array(lattice, dtype=float)
+        self.species = np.array(species, dtype=np.uint8)
+        self.orbit_species = np.array(orbit_species, dtype=np.uint8)
+        self.wyckoffs = np.array(wyckoffs, dtype=np.uint8)
+        self.params = np.array(params, dtype=float)
+        self.rotations = None if rotations is None else np.array(rotations, dtype=float).reshape(-1, 3)
+        if inversions is None and rotations is not None:
+            inversions = np.zeros(len(self.wyckoffs))
+        self.inversions = None if inversions is None else np.array(inversions, dtype=np.uint8)
+
+    @property
+    def molecular(self):
+        return self.rotations is not None
+
+    @classmethod
+    def from_record(cls, record):
+        """
+        Builds a genome from a crystal_record with Wyckoff information. Only
+        3D records are supported (2D records are permuted and padded with
+        vacuum after generation)
+
+        Returns:
+            a crystal_genome, or None if the record has no Wyckoff
+            information
+        """
+        if record.dim != 3 or record.wyckoffs is None or record.points is None or record.orbit_species is None:
+            print("Error: crystal_genome requires a 3D record with Wyckoff information.")
+            return None
+        lattice = lower_lattice(record.lattice)
+        if record.orientations is not None:
+            #Store each orientation as a proper rotation and an inversion flag
+            dets = np.linalg.det(record.orientations)
+            inversions = (dets < 0).astype(np.uint8)
+            proper = record.orientations * np.sign(dets)[:,None,None]
+            rotations = Rotation.from_matrix(proper).as_rotvec()
+            return cls(record.sg, lattice, [], record.orbit_species, record.wyckoffs,
+                       record.points.flatten(), rotations, inversions)
+        matrices, axes = get_wyckoff_info(record.sg)
+        params = np.concatenate([point[axes[wp]] for wp, point in zip(record.wyckoffs, record.points)])
+        species = [Element(specie).z for specie in record.species]
+        return cls(record.sg, lattice, species, record.orbit_species, record.wyckoffs, params)
+
+    def lattice_matrix(self):
+        matrix = np.zeros((3,3))
+        matrix[np.tril_indices(3)] = self.lattice
+        return matrix
+
+    def points(self):
+        """
+        Returns the generating point of each orbit, with the coordinates
+        which are not free set to 0
+        """
+        if self.molecular:
+            return self.params.reshape(-1, 3)
+        matrices, axes = get_wyckoff_info(self.sg)
+        points = np.zeros((len(self.wyckoffs), 3))
+        start = 0
+        for i, wp in enumerate(self.wyckoffs):
+            n = len(axes[wp])
+            points[i, axes[wp]] = self.params[start:start+n]
+            start += n
+        return points
+
+    def expand(self, molecules=None):
+        """
+        Rebuilds the full crystal
+
+        Args:
+            molecules: for molecular genomes, the list of (symmetrized)
+                molecules used for generation, as stored in
+                molecular_crystal.molecules
+
+        Returns:
+            a crystal_record
+        """
+        lattice = self.lattice_matrix()
+        points = self.points()
+        if self.molecular:
+            return self.expand_molecular(lattice, points, molecules)
+        matrices, axes = get_wyckoff_info(self.sg)
+        coordinates = []
+        for wp, point in zip(self.wyckoffs, points):
+            affine = matrices[wp]
+            coords = np.dot(affine[:,:3,:3], point) + affine[:,:3,3]
+            coords -= np.floor(coords)
+            coordinates.append(coords)
+        numbers = np.repeat(self.orbit_species, [len(matrices[wp]) for wp in self.wyckoffs])
+        species = [Element(int(z)).short_name for z in self.species]
+        return crystal_record(self.sg, lattice, np.concatenate(coordinates), numbers, species,
+                              wyckoffs=self.wyckoffs, orbit_species=self.orbit_species, points=points)
+
+    def expand_molecular(self, lattice, points, molecules):
+        if molecules is None:
+            print("Error: expanding a molecular genome requires the molecules.")
+            return None
+        generators = get_generator_matrices(self.sg)
+        orientations = Rotation.from_rotvec(self.rotations).as_matrix()
+        orientations[self.inversions == 1] *= -1
+        inverse = np.linalg.inv(lattice)
+        coordinates = []
+        sites = []
+        for i, wp, point, rotation in zip(self.orbit_species, self.wyckoffs, points, orientations):
+            mol = molecules[i]
+            #Rotate the molecule, then convert to relative coordinates
+            relative = np.dot(np.dot(mol.cart_coords, rotation.T), inverse)
+            for op in generators[wp]:
+                center = np.dot(op[:3,:3], point) + op[:3,3]
+                coords = center + np.dot(relative, op[:3,:3].T)
+                coordinates.append(coords - np.floor(coords))
+                sites += [site.specie.name for site in mol]
+        return crystal_record.from_sites(self.sg, lattice, np.concatenate(coordinates), sites,
+            wyckoffs=self.wyckoffs, orbit_species=self.orbit_species, points=points, orientations=orientations)
+
+    def to_bytes(self):
+        """
+        Serializes the genome. Floats are stored with double precision, and
+        indices as single bytes
+        """
+        flags = molecular_flag if self.molecular else 0
+        data = [struct.pack(header_format, genome_version, flags, self.sg, len(self.wyckoffs), len(self.species)),
+                self.lattice.astype("<f8").tobytes(),
+                self.species.tobytes(),
+                self.orbit_species.tobytes(),
+                self.wyckoffs.tobytes()]
+        if self.molecular:
+            data.append(self.inversions.tobytes())
+            data.append(self.rotations.astype("<f8").tobytes())
+        data.append(self.params.astype("<f8").tobytes())
+        return b"".join(data)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Reads a genome written by to_bytes
+        """
+        version, flags, sg, n, n_species = struct.unpack_from(header_format, data)
+        if version != genome_version:
+            print("Error: unsupported genome version "+str(version))
+            return None
+        offset = struct.calcsize(header_format)
+        def read(dtype, count):
+            nonlocal offset
+            array = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += array.nbytes
+            return array
+        lattice = read("<f8", 6)
+        species = read("u1", n_species)
+        orbit_species = read("u1", n)
+        wyckoffs = read("u1", n)
+        if flags & molecular_flag:
+            inversions = read("u1", n)
+            rotations = read("<f8", 3*n)
+            params = read("<f8", 3*n)
+            return cls(sg, lattice, species, orbit_species, wyckoffs, params, rotations, inversions)
+        matrices, axes = get_wyckoff_info(sg)
+        params = read("<f8", sum(len(axes[wp]) for wp in wyckoffs))
+        return cls(sg, lattice, species, orbit_species, wyckoffs, params)
+
+    @property
+    def nbytes(self):
+        """
+        The size of the serialized genome in bytes
+        """
+        return len(self.to_bytes())
+
+normalizer_cache = {} #Normalizer operations, keyed by Hall number
+
+def candidate_axes(sg):
+    """
+    Returns the integer matrices (with determinant 1) which may map the axes
+    of a space group onto themselves: the rotations of the holohedry of the
+    hexagonal lattice for trigonal and hexagonal groups, and the signed
+    permutation matrices otherwise
+    """
+    if 143 <= sg <= 194:
+        matrices = [m[:3,:3] for m in get_wyckoff_info(191)[0][0]]
+    else:
+        matrices = []
+        for perm in permutations(range(3)):
+            for signs in product([1, -1], repeat=3):
+                m = np.zeros((3,3))
+                for i in range(3):
+                    m[i, perm[i]] = signs[i]
+                matrices.append(m)
+    return [np.round(m) for m in matrices if np.linalg.det(m) > 0.5]
+
+def polar_axes(sg):
+    """
+    Returns a list of 3 bools: True for the axes which every rotation of the
+    space group leaves fixed. Any origin shift along these axes maps the
+    group onto itself
+    """
+    rotations = np.round(get_wyckoff_info(sg)[0][0][:,:3,:3])
+    return [all(np.allclose(r[:,i], np.eye(3)[:,i]) for r in rotations) for i in range(3)]
+
+def get_normalizer(sg, grid=4, tol=1e-6):
+    """
+    Returns the operations of the affine normalizer of a space group which
+    are needed to enumerate equivalent genomes, one per coset of the group.
+    Only proper changes of axes are used, so enantiomorphs are not merged.
+    Origin shifts are searched on a grid of 1/grid. The group is taken in the
+    default setting of the Wyckoff database (see database/hall.py). Results
+    are cached.
+
+    Continuous origin shifts along polar axes (for example, any shift in P1)
+    are not enumerated; canonical_genome fixes them by placing an atom at 0
+    along those axes. The infinite families of axis changes of triclinic and
+    monoclinic groups are not enumerated either, so canonical genomes in
+    these groups are only unique up to those operations.
+
+    Returns:
+        a list of (M, t) pairs, acting on fractional coordinates as M.x + t
+    """
+    key = hall.hall_from_hm(sg)
+    if key in normalizer_cache:
+        return normalizer_cache[key]
+    ops = get_wyckoff_info(sg)[0][0]
+    rotations = np.round(ops[:,:3,:3])
+    translations = ops[:,:3,3] % 1.0
+    #The translations allowed for each rotation of the group
+    allowed = {}
+    for r, t in zip(rotations, translations):
+        allowed.setdefault(r.tobytes(), []).append(t)
+    def in_group(r, t):
+        #Check whether (r, t) is an operation of the group, modulo the lattice
+        if r.tobytes() not in allowed:
+            return False
+        d = np.array(allowed[r.tobytes()]) - t
+        return np.any(np.all(np.abs(d - np.round(d)) < tol, axis=1))
+    #Shifts along polar axes are continuous, and are not enumerated
+    polar = polar_axes(sg)
+    ranges = [[0.0] if polar[i] else np.arange(grid)/float(grid) for i in range(3)]
+    shifts = np.array(list(product(*ranges)))
+    result = []
+    for m in candidate_axes(sg):
+        minv = np.round(np.linalg.inv(m))
+        conjugates = [np.dot(np.dot(m, r), minv) for r in rotations]
+        if not all(c.tobytes() in allowed for c in conjugates):
+            continue
+        for t in shifts:
+            good = True
+            for c, r0, t0 in zip(conjugates, rotations, translations):
+                if not in_group(c, np.dot(m, t0) + t - np.dot(c, t)):
+                    good = False
+                    break
+            if not good:
+                continue
+            #Skip operations which differ from a kept one by a group operation
+            duplicate = False
+            for m1, t1 in result:
+                m1inv = np.round(np.linalg.inv(m1))
+                if in_group(np.round(np.dot(m1inv, m)), np.dot(m1inv, t - t1)):
+                    duplicate = True
+                    break
+            if not duplicate:
+                result.append((m, t))
+    normalizer_cache[key] = result
+    return result
+
+def wrap_difference(d):
+    return np.abs(d - np.round(d))
+
+def canonical_genome(genome, decimals=8, tol=1e-6):
+    """
+    Returns the canonical genome of an atomic crystal: among the genomes
+    obtained from every normalizer operation (see get_normalizer) and every
+    choice of representative atom for each orbit, the one with the smallest
+    key (lattice parameters, then the sorted orbits). In polar groups, the
+    origin along the polar axes is also moved onto each atom of the
+    smallest orbits in turn
+
+    Args:
+        genome: an atomic crystal_genome
+        decimals: values are rounded to this many decimals before comparing
+        tol: the tolerance for checking whether an atom lies on the
+            representative point of a Wyckoff position
+
+    Returns:
+        a new crystal_genome, or None for molecular genomes
+    """
+    if genome.molecular:
+        print("Error: canonical_genome only supports atomic crystals.")
+        return None
+    from crystallography.feasibility import get_wyckoff_table
+    sg = genome.sg
+    matrices, axes = get_wyckoff_info(sg)
+    multiplicities, degrees = get_wyckoff_table(sg)
+    record = genome.expand()
+    lattice = record.lattice
+    sizes = [multiplicities[wp] for wp in genome.wyckoffs]
+    starts = np.cumsum([0] + sizes)
+    #The atoms which may be placed at the origin along the polar axes
+    polar = np.array(polar_axes(sg), dtype=float)
+    pins = [None]
+    if polar.any():
+        pins = [i for n in range(len(sizes)) if sizes[n] == min(sizes) for i in range(starts[n], starts[n+1])]
+    best = None
+    for (m, t), pin in product(get_normalizer(sg), pins):
+        coordinates = (np.dot(record.coordinates, m.T) + t) % 1.0
+        if pin is not None:
+            coordinates = (coordinates - polar*coordinates[pin]) % 1.0
+        #Fractional coordinates transform with m, so the lattice transforms
+        #with the inverse transpose of m
+        para = matrix2para(np.dot(np.linalg.inv(m).T, lattice))
+        orbits = []
+        for n, (specie, wp) in enumerate(zip(genome.orbit_species, genome.wyckoffs)):
+            atoms = coordinates[starts[n]:starts[n+1]]
+            options = []
+            for new in range(len(multiplicities)):
+                if multiplicities[new] != multiplicities[wp] or degrees[new] != degrees[wp]:
+                    continue
+                #Atoms on the representative point of the Wyckoff position
+                first = matrices[new][0]
+                points = np.zeros((len(atoms), 3))
+                points[:, axes[new]] = atoms[:, axes[new]]
+                images = np.dot(points, first[:3,:3].T) + first[:3,3]
+                on = np.all(wrap_difference(images - atoms) < tol, axis=1)
+                for point in points[on]:
+                    params = np.round(point[axes[new]] % 1.0, decimals) % 1.0
+                    options.append((new, tuple(params)))
+            if options == []:
+                break
+            orbits.append((int(specie),) + min(options))
+        if len(orbits) != len(genome.wyckoffs):
+            continue
+        orbits.sort()
+        key = (tuple(np.round(para, decimals)), tuple(orbits))
+        if best is None or key < best:
+            best = key
+    if best is None:
+        print("Error: no canonical form found.")
+        return None
+    para, orbits = best
+    params = [p for orbit in orbits for p in orbit[2]]
+    return crystal_genome(sg, lower_lattice(para2matrix(np.array(para))), genome.species,
+                          [orbit[0] for orbit in orbits], [orbit[1] for orbit in orbits], params)
+
+def genome_hash(genome, decimals=6):
+    """
+    Returns a hash of the canonical genome, rounded to the given number of
+    decimals. Exact duplicates have the same hash
+    """
+    canonical = canonical_genome(genome)
+    if canonical is None:
+        return None
+    canonical.lattice = np.round(canonical.lattice, decimals) + 0.0
+    canonical.params = np.round(canonical.params, decimals) % 1.0 + 0.0
+    return hashlib.sha1(canonical.to_bytes()).hexdigest()
@@ -0,0 +1,126 @@
+"""
+Module for recording the progress of long generation runs, so that they can
+be resumed after an interruption. A progress_ledger is an append-only file of
+JSON lines, stored next to the output. Each line is written and synced to
+disk before the next chunk of work starts, so after a crash the ledger lists
+every chunk which was completed, the position in its random stream, and the
+position reached in the output file. A line cut short by the crash is
+discarded when the ledger is reopened.
+
+Entries are dictionaries with a "type" key:
+
+    run: the settings of the run (checked again when resuming)
+
+    chunk: a completed chunk of a task, with the stream index of the next
+    chunk, the number of structures written so far, and the output position
+    (see writers.structure_writer.position)
+
+    done: a finished task
+
+See batch.run_sweep for a driver which uses the ledger.
+"""
+import os
+import json
+import hashlib
+
+class progress_ledger():
+    """
+    Append-only log of completed work.
+
+    Args:
+        filename: the ledger file. It is created if it does not exist, and
+            read back if it does
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.header = None
+        """The settings of the run, from the first run entry"""
+        self.tasks = {}
+        """The latest chunk or done entry of each task"""
+        self.entries = 0
+        """The number of entries in the ledger"""
+        self.load()
+
+    def load(self):
+        """
+        Reads the ledger. An incomplete last line (from a crash during a
+        write) is removed, so new entries start on a fresh line
+        """
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, "rb") as f:
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            with open(self.filename, "r+b") as f:
+                f.truncate(end)
+        for line in data[:end].decode("utf-8").splitlines():
+            if line.strip() == "":
+                continue
+            self.update(json.loads(line))
+
+    def update(self, entry):
+        self.entries += 1
+        if entry["type"] == "run":
+            if self.header is None:
+                self.header = entry
+        else:
+            self.tasks[entry["task"]] = entry
+
+    def append(self, entry):
+        """
+        Writes an entry, and waits until it is on disk
+        """
+        with open(self.filename, "a") as f:
+            f.write(json.dumps(entry, sort_keys=True) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.update(entry)
+
+    def start(self, **settings):
+        """
+        Records the settings of a run. If the ledger already has settings,
+        they must be the same
+
+        Returns:
+            True if the run may continue, and False if the settings differ
+        """
+        settings = json.loads(json.dumps(settings))
+        if self.header is None:
+            self.append(dict(settings, type="run"))
+            return True
+        old = dict((k, v) for k, v in self.header.items() if k != "type")
+        if old != settings:
+            print("Error: the ledger " + self.filename + " was written with different settings.")
+            return False
+        return True
+
+    def state(self, task):
+        """
+        Returns the latest entry for a task, or None if no work was recorded
+        """
+        return self.tasks.get(task)
+
+    def finished(self, task):
+        entry = self.tasks.get(task)
+        return entry is not None and entry["type"] == "done"
+
+    def __len__(self):
+        return self.entries
+
+def task_key(sg, species, numIons, factor, molecular=False):
+    """
+    Returns a name for a generation task, usable as a file name. Ex:
+    "225_Na4Cl4_1.0"
+    """
+    composition = "".join(str(s)+str(n) for s, n in zip(species, numIons))
+    return "{:d}_{:s}_{:s}{:s}".format(int(sg), composition, str(float(factor)), "_mol" if molecular else "")
+
+def stream_seed(seed, task, index):
+    """
+    Returns the random seed for chunk index of a task. Seeds depend only on
+    the base seed, the task, and the index, so a resumed run continues the
+    same random streams as an uninterrupted one
+    """
+    digest = hashlib.sha1("{:d}:{:s}:{:d}".format(int(seed), task, int(index)).encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "little") % 2**31
@@ -343,9 +343,11 @@ class mol_site():
     Class for storing molecular Wyckoff positions and orientations within
     the molecular_crystal class.
     """
-    def __init__(self, mol, position, sg, wp_index, lattice):
+    def __init__(self, mol, position, sg, wp_index, lattice, orientation=None):
         #Pymatgen molecule object
         self.mol = mol
+        #SymmOp used to rotate the molecule from its reference orientation
+        self.orientation = orientation
         #Relative coordinates within the unit cell
         self.position = position
         #Spacegroup number
@@ -383,12 +385,28 @@ class molecular_crystal():
             position is added. This requires slightly more time, but vastly
             improves accuracy. For approximately spherical molecules, or
             for large inter-molecular distances, this may be turned off
+        budget:
+            An optional budget object from crystal.py, limiting the time or
+            number of operations spent by generate_crystal
+        adaptive:
+            An optional adaptive_factor object from crystal.py. If given, it
+            replaces volume_factor, and the factor grows when placement fails
+        stats:
+            An optional generation_stats object (see stats.py) for recording
+            counters and timers
     """
-    def __init__(self, sg, molecules, numMols, volume_factor, allow_inversion=False, orientations=None, check_atomic_distances=True):
+    #The generated structure is stored compactly in self.record
+    struct = record_attribute("struct")
+    spg_struct = record_attribute("spg_struct")
+    sites = record_attribute("sites")
+
+    def __init__(self, sg, molecules, numMols, volume_factor, allow_inversion=False, orientations=None, check_atomic_distances=True, budget=None, adaptive=None, stats=None):
         
         #Necessary input
         self.Msgs()
         numMols = np.array(numMols) #must convert it to np.array
+        if adaptive is not None:
+            volume_factor = adaptive.factor
         self.factor = volume_factor
         self.numMols0 = numMols
         self.sg = sg
@@ -397,7 +415,7 @@ class molecular_crystal():
         #Allow support for generating molecules from text via ASE
         for i, mol in enumerate(molecules):
             if type(mol) == str:
-                mo = get_ase_molecules(mol)
+                mo = get_ase_mol(mol)
                 molecules[i] = mo
         for mol in molecules:
             pga = PointGroupAnalyzer(mol)
@@ -407,13 +425,16 @@ class molecular_crystal():
         self.boxes = []
         #Calculate binding boxes and radii for each molecule
         self.radii = []
+        """The radius of the smallest sphere around each molecule's center
+        which contains the covalent radius of every atom. Molecules whose
+        spheres do not overlap pass the inter-atomic distance check"""
         for mol in self.molecules:
             self.boxes.append(get_box(reoriented_molecule(mol)[0]))
             max_r = 0
             for site in mol:
-                radius = math.sqrt( site.x**2 + site.y**2 + site.z**2 )
+                radius = math.sqrt( site.x**2 + site.y**2 + site.z**2 ) + Element(site.specie.name).covalent_radius
                 if radius > max_r: max_r = radius
-            self.radii.append(max_r+1.0)
+            self.radii.append(max_r)
         self.minlen = []
         self.maxlen = []
         for box in self.boxes:
@@ -431,14 +452,19 @@ class molecular_crystal():
         self.allow_inversion = allow_inversion
         #When generating multiple crystals of the same stoichiometry and sg,
         #allow the user to re-use the allowed orientations, to reduce time cost
+        self.stats = stats
         if orientations is None:
+            if stats is not None:
+                t0 = time()
             self.get_orientations()
+            if stats is not None:
+                stats.add_time("orientations", time()-t0)
         else:
             self.valid_orientations = orientations
             """The valid orientations for each molecule and Wyckoff position.
             May be copied when generating a new molecular_crystal to save a
             small amount of time"""
-        self.generate_crystal()
+        self.generate_crystal(budget=budget, adaptive=adaptive, stats=stats)
 
 
     def Msgs(self):
@@ -479,6 +505,8 @@ class molecular_crystal():
                         self.valid_orientations[-1][-1].append(allowed)
                     else:
                         self.valid_orientations[-1][-1].append([])
+                        if self.stats is not None:
+                            self.stats.count("orientation_rejections")
 
     def check_compatible(self):
         """
@@ -531,23 +559,48 @@ class molecular_crystal():
 
         return True
 
-    def generate_crystal(self, max1=max1, max2=max2, max3=max3):
+    def generate_crystal(self, max1=max1, max2=max2, max3=max3, max_backtrack=max_backtrack, undo="orbit", budget=None, adaptive=None, stats=None):
         """
         The main code to generate a random molecular crystal. If successful, stores
         a pymatgen.core.structure object in self.struct and sets self.valid to True.
         If unsuccessful, sets self.valid to False and outputs an error message.
+        The reason for stopping ("success", "incompatible", "lattice",
+        "attempts", "time", or "operations") is stored in self.stop_reason
 
         Args:
             max1: the number of attempts for generating a lattice
-            max2: the number of attempts for a given lattice
-            max3: the number of attempts for a given Wyckoff position
+            max2: the number of placement attempts for a given lattice
+            max3: the number of attempts for each Wyckoff position before
+                backtracking. May also be a list with one value per molecule
+            max_backtrack: the largest number of backtracking steps within
+                a single placement attempt
+            undo: "orbit" or "specie"; what to remove when backtracking
+            budget: an optional budget object. If given, max1 and max2 are
+                ignored, and lattices and placements are attempted until the
+                budget is used up
+            adaptive: an optional adaptive_factor object. If given, the volume
+                factor grows after each lattice on which placement failed
+            stats: an optional generation_stats object (see stats.py) for
+                recording counters and timers
         """
+        self.record = None
+        self.budget = budget
+        if budget is not None:
+            budget.start()
+        self.stats = stats
+        if stats is not None:
+            stats.count("runs")
+            t0 = time()
+        self.stop_reason = "attempts"
         #Check the minimum number of degrees of freedom within the Wyckoff positions
         degrees = self.check_compatible()
+        if stats is not None:
+            stats.add_time("compatibility", time()-t0)
         if degrees is False:
             print(self.Msg1)
             self.struct = None
             self.valid = False
+            self.stop_reason = "incompatible"
             return
         else:
             if degrees == 0:
@@ -556,11 +609,133 @@ class molecular_crystal():
                 max3 = 10
             #Calculate a minimum vector length for generating a lattice
             minvector = max(radius*2 for radius in self.radii)
-            #print(self.radii, minvector)
-            for cycle1 in range(max1):
+
+            def add_orbit(i, remaining, orbits):
+                #Make a single attempt at adding a Wyckoff position of molecule i
+                #Choose a random Wyckoff position for given multiplicity: 2a, 2b, 2c
+                #NOTE: The molecular version return wyckoff indices, not ops
+                if stats is not None:
+                    stats.count("wyckoff_choices")
+                indices = choose_wyckoff_molecular(self.wyckoffs, remaining, self.valid_orientations[i])
+                if indices is False:
+                    return None
+                j, k = indices
+                #Generate a list of coords from ops
+                ops = self.wyckoffs[j][k]
+                point = np.random.random(3)
+                coords = np.array([op.operate(point) for op in ops])
+                #merge_coordinate if the atoms are close
+                if self.check_atomic_distances is False:
+                    mtol = self.radii[i]*2
+                elif self.check_atomic_distances is True:
+                    mtol = 3.0
+                if stats is not None:
+                    stats.count("overlap_checks")
+                coords_toadd, good_merge = merge_coordinate_molecular(coords, cell_matrix, 
+                        self.wyckoffs, self.sg, mtol, self.valid_orientations[i])
+                if good_merge is False:
+                    if adaptive is not None:
+                        adaptive.reject("merge")
+                    return None
+                if stats is not None:
+                    stats.count("overlap_passes")
+                wp_index = good_merge
+                coords_toadd -= np.floor(coords_toadd) #scale the coordinates to [0,1], very important!
+
+                #Check that coords_toadd are generated by point
+                generators = get_wyckoff_generators(self.sg)[wp_index]
+                point = find_generating_point(coords_toadd, generators)
+                if point is None:
+                    print("Error: Could not generate merged coordinates from Wyckoff generators")
+                    return None
+
+                #Check inter-molecular distances
+                if self.check_atomic_distances is False:
+                    molecular_coordinates_tmp = [orbit[2][0] for orbit in orbits]
+                    molecular_sites_tmp = [orbit[0] for orbit in orbits]
+                    if check_distance_molecular(molecular_coordinates_tmp, coords_toadd, molecular_sites_tmp, i, cell_matrix, self.radii):
+                        return len(coords_toadd), [coords_toadd, wp_index, point]
+                    if stats is not None:
+                        stats.count("distance_rejections")
+                    if adaptive is not None:
+                        adaptive.reject("distance")
+                    return None
+
+                #Check inter-atomic distances
+                #Generate atomic coordinates from molecules
+                mo = deepcopy(self.molecules[i])
+                j, k = jk_from_i(wp_index, self.wyckoffs)
+                op1 = choose(self.valid_orientations[i][j][k]).get_op()
+                mo.apply_operation(op1)
+                ms0 = mol_site(mo, point, self.sg, wp_index, cell_matrix, orientation=op1)
+                wp_atomic_sites = [] #The species for the Wyckoff position
+                wp_atomic_coords = [] #The coords for the Wyckoff position
+                for point_index, op2 in enumerate(generators):
+                    current_atomic_sites = []
+                    current_atomic_coords = []
+                    for site in mo:
+                        #Place molecular coordinates in relative coordinates
+                        relative_coords = np.dot(site.coords, np.linalg.inv(cell_matrix))
+                        center1 = op2.operate(point)
+                        rot = SymmOp.from_rotation_and_translation(op2.rotation_matrix,[0,0,0])
+                        relative_coords = rot.operate(relative_coords)
+                        new_vector = center1 + relative_coords
+                        new_vector -= np.floor(new_vector)
+                        current_atomic_sites.append(site.specie.name)
+                        current_atomic_coords.append(new_vector)
+                    wp_atomic_sites.append(current_atomic_sites)
+                    wp_atomic_coords.append(current_atomic_coords)
+                    #Check distances between molecules in current WP
+                    if point_index == 1:
+                        for a_index, specie2 in enumerate(current_atomic_sites):
+                            if check_distance([wp_atomic_coords[0]], [current_atomic_coords[a_index]], wp_atomic_sites[0], specie2, cell_matrix, d_factor=2.0, stats=stats) is False:
+                                #The orientation places symmetric copies too close together
+                                if stats is not None:
+                                    stats.count("orientation_rejections")
+                                if adaptive is not None:
+                                    adaptive.reject("merge")
+                                return None
+                #Check distances between current and previous molecular atoms
+                a = []
+                for x in wp_atomic_coords:
+                    a += x
+                b = []
+                for x in wp_atomic_sites:
+                    b += x
+                atomic_coordinates_tmp = []
+                atomic_sites_tmp = []
+                for orbit in orbits:
+                    atomic_coordinates_tmp += orbit[2][4]
+                    atomic_sites_tmp += orbit[2][5]
+                for a_index, specie2 in enumerate(b):
+                    if check_distance([atomic_coordinates_tmp], [a[a_index]], atomic_sites_tmp, specie2, cell_matrix, d_factor=2.0, stats=stats) is False:
+                        if stats is not None:
+                            stats.count("distance_rejections")
+                        if adaptive is not None:
+                            adaptive.reject("distance")
+                        return None
+                return len(coords_toadd), [coords_toadd, wp_index, point, ms0, a, b]
+
+            for cycle1 in attempts(max1, budget):
                 #1, Generate a lattice
+                if stats is not None:
+                    t0 = time()
                 cell_para = generate_lattice(self.sg, self.volume, minvec=minvector)
+                if stats is not None:
+                    stats.add_time("lattice", time()-t0)
+                    stats.count("lattice_attempts")
+                    if cell_para is None:
+                        stats.count("lattice_failures")
+                if budget is not None:
+                    budget.spend()
                 if cell_para is None:
+                    if adaptive is not None:
+                        #Retry with a larger volume
+                        adaptive.reject("lattice")
+                        self.factor = adaptive.fail()
+                        self.volume = estimate_volume_molecular(self.numMols, self.boxes, self.factor)
+                        continue
+                    self.stop_reason = "lattice"
                     break
                 else:
                     cell_matrix = para2matrix(cell_para)
@@ -569,184 +744,46 @@ class molecular_crystal():
                         print('cell_para:  ', cell_para)
                         sys.exit(0)
 
-                    molecular_coordinates_total = [] #to store the added molecular coordinates
-                    molecular_sites_total = []      #to store the corresponding molecular specie
-                    atomic_coordinates_total = [] #to store the added atomic coordinates
-                    atomic_sites_total = []      #to store the corresponding atomic specie
-                    wps_total = []      #to store corresponding Wyckoff position indices
-                    points_total = []   #to store the generating x,y,z points
-                    mol_generators_total = []
-                    good_structure = False
-
-                    for cycle2 in range(max2):
-                        molecular_coordinates_tmp = deepcopy(molecular_coordinates_total)
-                        molecular_sites_tmp = deepcopy(molecular_sites_total)
-                        atomic_coordinates_tmp = deepcopy(atomic_coordinates_total)
-                        atomic_sites_tmp = deepcopy(atomic_sites_total)
-                        wps_tmp = deepcopy(wps_total)
-                        points_tmp = deepcopy(points_total)
-                        mol_generators_tmp = []
-                        
-                	    #Add molecules specie by specie
-                        for numMol, mol in zip(self.numMols, self.molecules):
-                            i = self.molecules.index(mol)
-                            numMol_added = 0
-
-                            #Now we start to add the specie to the wyckoff position
-                            for cycle3 in range(max3):
-                                #Choose a random Wyckoff position for given multiplicity: 2a, 2b, 2c
-                                #NOTE: The molecular version return wyckoff indices, not ops
-                                indices = choose_wyckoff_molecular(self.wyckoffs, numMol-numMol_added, self.valid_orientations[i])
-                                if indices is not False:
-                                    j, k = indices
-                                    if self.valid_orientations[i][j][k] == []:
-                                        print("Error: Failed to catch empty set...")
-                                        print(i,j,k)
-                	    	    #Generate a list of coords from ops
-                                    ops = self.wyckoffs[j][k]
-                                    point = np.random.random(3)
-                                    coords = np.array([op.operate(point) for op in ops])
-                                    #merge_coordinate if the atoms are close
-                                    if self.check_atomic_distances is False:
-                                        mtol = self.radii[i]*2
-                                    elif self.check_atomic_distances is True:
-                                        mtol = 3.0
-                                    coords_toadd, good_merge = merge_coordinate_molecular(coords, cell_matrix, 
-                                            self.wyckoffs, self.sg, mtol, self.valid_orientations[i])
-                                    if good_merge is not False:
-                                        wp_index = good_merge
-                                        j, k = jk_from_i(wp_index, self.wyckoffs)
-                                        wyckoffs = self.wyckoffs[j][k]
-                                        coords_toadd -= np.floor(coords_toadd) #scale the coordinates to [0,1], very important!
-
-                                        #Check that coords_toadd are generated by point
-                                        generators = get_wyckoff_generators(sg)[wp_index]
-                                        point = find_generating_point(coords_toadd, generators)
-                                        if point is None:
-                                            print("Error: Could not generate merged coordinates from Wyckoff generators")
-                                            self.valid = False
-                                            return
-
-                                        #Check inter-molecular distances
-                                        if self.check_atomic_distances is False:
-                                            if check_distance_molecular(molecular_coordinates_tmp, coords_toadd, molecular_sites_tmp, i, cell_matrix, self.radii):
-                                                molecular_coordinates_tmp.append(coords_toadd)
-                                                molecular_sites_tmp.append(i)
-                                                wps_tmp.append(wp_index)
-                                                points_tmp.append(point)
-                                                numMol_added += len(coords_toadd)
-                                                if numMol_added == numMol:
-                                                    molecular_coordinates_total = deepcopy(molecular_coordinates_tmp)
-                                                    molecular_sites_total = deepcopy(molecular_sites_tmp)
-                                                    wps_total = deepcopy(wps_tmp)
-                                                    points_total = deepcopy(points_tmp)
-                                                    break
-
-                                        #Check inter-atomic distances
-                                        elif self.check_atomic_distances is True:
-                                            #Generate atomic coordinates from molecules
-                                            mo = deepcopy(self.molecules[i])
-                                            #get j, k from wp_index
-                                            num = 0
-                                            found = False
-                                            j, k = jk_from_i(wp_index, self.wyckoffs)
-                                            op1 = choose(self.valid_orientations[i][j][k]).get_op()
-                                            mo.apply_operation(op1)
-                                            ms0 = mol_site(mo, point, self.sg, wp_index, cell_matrix)
-                                            wp_atomic_sites = [] #The species for the Wyckoff position
-                                            wp_atomic_coords = [] #The coords for the Wyckoff position
-                                            flag1 = True
-                                            for point_index, op2 in enumerate(get_wyckoff_generators(self.sg)[wp_index]):
-                                                current_atomic_sites = []
-                                                current_atomic_coords = []
-                                                for site in mo:
-                                                    #Place molecular coordinates in relative coordinates
-                                                    #relative_coords = np.dot(np.linalg.inv(np.transpose(cell_matrix)), site.coords)
-                                                    #relative_coords = np.dot(np.linalg.inv(cell_matrix), site.coords)
-                                                    relative_coords = np.dot(site.coords, np.linalg.inv(cell_matrix))
-                                                    center1 = op2.operate(point)
-                                                    rot = SymmOp.from_rotation_and_translation(op2.rotation_matrix,[0,0,0])
-                                                    relative_coords = rot.operate(relative_coords)
-                                                    new_vector = center1 + relative_coords
-                                                    new_vector -= np.floor(new_vector)
-                                                    current_atomic_sites.append(site.specie.name)
-                                                    current_atomic_coords.append(new_vector)
-                                                wp_atomic_sites.append(current_atomic_sites)
-                                                wp_atomic_coords.append(current_atomic_coords)
-                                                #Check distances between molecules in current WP
-                                                if point_index == 1:
-                                                    for a_index, specie2 in enumerate(current_atomic_sites):
-                                                        flag1 = check_distance([wp_atomic_coords[0]], [current_atomic_coords[a_index]], wp_atomic_sites[0], specie2, cell_matrix, d_factor=2.0)
-                                                        if flag1 is False:
-                                                            break
-                                                    if flag1 is False:
-                                                        break
-                                            if flag1 is True:
-                                                #Check distances between current and previous molecular atoms
-                                                a = []
-                                                for x in wp_atomic_coords:
-                                                    a += x
-                                                b = []
-                                                for x in wp_atomic_sites:
-                                                    b += x
-                                                flag2 = True
-                                                for a_index, specie2 in enumerate(b):
-                                                    flag2 = check_distance([atomic_coordinates_total], [a[a_index]], atomic_sites_total, specie2, cell_matrix, d_factor=2.0)
-                                                    if flag2 is False: break
-                                                if flag2 is True:
-                                                    mol_generators_tmp.append(ms0)
-                                                    molecular_coordinates_tmp.append(coords_toadd)
-                                                    molecular_sites_tmp.append(i)
-                                                    atomic_coordinates_tmp += a
-                                                    atomic_sites_tmp += b
-                                                    wps_tmp.append(wp_index)
-                                                    points_tmp.append(point)
-                                                    numMol_added += len(coords_toadd)
-                                                    if numMol_added == numMol:
-                                                        mol_generators_total = deepcopy(mol_generators_tmp)
-                                                        molecular_coordinates_total = deepcopy(molecular_coordinates_tmp)
-                                                        atomic_sites_total = deepcopy(atomic_sites_tmp)
-                                                        atomic_coordinates_total = deepcopy(atomic_coordinates_tmp)
-                                                        molecular_sites_total = deepcopy(molecular_sites_tmp)
-                                                        wps_total = deepcopy(wps_tmp)
-                                                        points_total = deepcopy(points_tmp)
-                                                        break
-
-                            if numMol_added != numMol:
-                                break  #need to repeat from the 1st species
-
-                        if numMol_added == numMol:
-                            #print(self.Msg6)
-                            good_structure = True
+                    #2, Add molecules specie by specie, backtracking on failure
+                    orbits = None
+                    if stats is not None:
+                        t0 = time()
+                    for cycle2 in lattice_attempts(max2, budget):
+                        if stats is not None:
+                            stats.count("placement_attempts")
+                        orbits = place_orbits(self.numMols, add_orbit, max3, max_backtrack, undo, budget)
+                        if orbits is not None:
                             break
-                        else: #reset the coordinates and sites
-                            molecular_coordinates_total = []
-                            molecular_sites_total = []
-                            wps_total = []
+                    if stats is not None:
+                        stats.add_time("placement", time()-t0)
+
+                    if orbits is None and adaptive is not None:
+                        #Use a larger volume for the next lattice
+                        self.factor = adaptive.fail()
+                        self.volume = estimate_volume_molecular(self.numMols, self.boxes, self.factor)
+
                     #placing molecules here
-                    if good_structure:
+                    if orbits is not None:
+                        if stats is not None:
+                            t0 = time()
                         final_lattice = cell_matrix 
                         final_coor = []
                         final_site = []
-                        final_number = []
                         self.mol_generators = []
 
                         if self.check_atomic_distances is False:
-                            for center0, i, wp_index in zip(points_total, molecular_sites_total, wps_total):
+                            for i, number, data in orbits:
+                                coords_toadd, wp_index, center0 = data
                                 mo = deepcopy(self.molecules[i])
                                 #get j, k from wp_index
-                                num = 0
-                                found = False
                                 j, k = jk_from_i(wp_index, self.wyckoffs)
                                 op1 = choose(self.valid_orientations[i][j][k]).get_op()
                                 mo.apply_operation(op1)
-                                ms0 = mol_site(mo, center0, self.sg, wp_index, cell_matrix)
+                                ms0 = mol_site(mo, center0, self.sg, wp_index, cell_matrix, orientation=op1)
                                 self.mol_generators.append(ms0)
                                 for index, op2 in enumerate(get_wyckoff_generators(self.sg)[wp_index]):
                                     for site in mo:
                                         #Place molecular coordinates in relative coordinates
-                                        #relative_coords = np.dot(np.linalg.inv(np.transpose(cell_matrix)), site.coords)
-                                        #relative_coords = np.dot(np.linalg.inv(cell_matrix), site.coords)
                                         relative_coords = np.dot(site.coords, np.linalg.inv(cell_matrix))
                                         center1 = op2.operate(center0)
                                         rot = SymmOp.from_rotation_and_translation(op2.rotation_matrix,[0,0,0])
@@ -755,24 +792,36 @@ class molecular_crystal():
                                         new_vector -= np.floor(new_vector)
                                         final_coor.append(new_vector)
                                         final_site.append(site.specie.name)
-                                        final_number.append(site.specie.number)
 
                         elif self.check_atomic_distances is True:
-                            final_coor = deepcopy(atomic_coordinates_total)
-                            final_site = deepcopy(atomic_sites_total)
-                            final_number = list(Element(ele).z for ele in atomic_sites_total)
-                            self.mol_generators = deepcopy(mol_generators_total)
+                            for i, number, data in orbits:
+                                final_coor += data[4]
+                                final_site += data[5]
+                                self.mol_generators.append(data[3])
 
                         final_coor -= np.floor(final_coor)
+                        if stats is not None:
+                            stats.add_time("finalize", time()-t0)
                         if verify_distances(final_coor, final_site, final_lattice, factor=1.0) is True:
-                            self.lattice = final_lattice  
-                            self.coordinates = np.array(final_coor)
-                            self.sites = final_site              
-                            self.struct = Structure(final_lattice, final_site, np.array(final_coor))
-                            self.spg_struct = (final_lattice, np.array(final_coor), final_number)
+                            self.record = crystal_record.from_sites(self.sg, final_lattice, final_coor, final_site,
+                                wyckoffs=[ms.wp_index for ms in self.mol_generators],
+                                orbit_species=[orbit[0] for orbit in orbits],
+                                points=[ms.position for ms in self.mol_generators],
+                                orientations=[ms.orientation.rotation_matrix for ms in self.mol_generators])
+                            self.lattice = self.record.lattice
+                            self.coordinates = self.record.coordinates
                             self.valid = True
+                            self.stop_reason = "success"
+                            if stats is not None:
+                                stats.count("successes")
+                            if budget is not None:
+                                budget.stop_reason = "success"
+                            if adaptive is not None:
+                                adaptive.succeed()
                             return
                         #else: print("Failed final distance check.")
+        if budget is not None and budget.stop_reason is not None:
+            self.stop_reason = budget.stop_reason
         print("Couldn't generate crystal after max attempts.")
         if degrees == 0:
             print("Note: Wyckoff positions have no degrees of freedom.")
@@ -784,6 +833,8 @@ class molecular_crystal():
 if __name__ == "__main__":
     #-------------------------------- Options -------------------------
     from os import mkdir
+    from crystallography.cif import formula
+    from crystallography.verify import symmetry_verifier
 
     parser = OptionParser()
     parser.add_option("-s", "--spacegroup", dest="sg", metavar='sg', default=36, type=int,
@@ -803,12 +854,15 @@ if __name__ == "__main__":
             help="Whether to check inter-atomic distances at each step: default True", metavar="outdir")
     parser.add_option("-i", "--allowinversion", dest="allowinversion", default="False", type=str, 
             help="Whether to allow inversion of chiral molecules: default False", metavar="outdir")
+    parser.add_option("-k", "--check", dest="check", default=1.0, type=float,
+            help="fraction of structures whose symmetry is checked by spglib in the background: default 1.0", metavar="check")
+    parser.add_option("-r", "--report", dest="report", default=None, type=str,
+            help="file for listing symmetry mismatches: default none", metavar="report")
 
     (options, args) = parser.parse_args()    
     molecule = options.molecule
     number = options.numMols
     verbosity = options.verbosity
-    attempts = options.attempts
     outdir = options.outdir
     if options.checkatoms == "True" or options.checkatoms == "False":
         checkatoms = eval(options.checkatoms)
@@ -833,7 +887,10 @@ if __name__ == "__main__":
         system = [get_ase_mol(molecule)]
         numMols = [int(number)]
     orientations = None
-    for i in range(attempts):
+    verifier = None
+    if options.check > 0:
+        verifier = symmetry_verifier(report=options.report, fraction=options.check, chunk=10)
+    for i in range(options.attempts):
         start = time()
         numMols0 = np.array(numMols)
         sg = options.sg
@@ -844,18 +901,20 @@ if __name__ == "__main__":
             written = False
             try:
                 mkdir(outdir)
-            except: pass
+            except FileExistsError: pass
+            comp = str(rand_crystal.struct.composition)
+            comp = comp.replace(" ", "")
+            cifpath = outdir + '/' + comp + "_" + str(i+1) + '.cif'
             try:
-                comp = str(rand_crystal.struct.composition)
-                comp = comp.replace(" ", "")
-                cifpath = outdir + '/' + comp + "_" + str(i+1) + '.cif'
                 CifWriter(rand_crystal.struct, symprec=0.1).write_file(filename = cifpath)
                 written = True
-            except: pass
+            except OSError as e:
+                print("Error: " + str(e))
 
-            #spglib style structure called cell
-            ans = get_symmetry_dataset(rand_crystal.spg_struct, symprec=1e-1)['number']
-            print('Space group requested: ', sg, 'generated', ans, 'vol: ', rand_crystal.volume)
+            #Check the symmetry in the background
+            if verifier is not None:
+                verifier.add(rand_crystal.record, formula(rand_crystal.record) + "_" + str(i+1))
+            print('Space group requested: ', sg, 'vol: ', rand_crystal.volume)
             if written is True:
                 print("    Output to "+cifpath)
             else:
@@ -874,3 +933,8 @@ if __name__ == "__main__":
         else: 
             print('something is wrong')
             print('Time spent during generation attempt: ' + str(timespent) + "s")
+    if verifier is not None:
+        verifier.close()
+        for name, requested, detected, error in verifier.mismatches:
+            print("Symmetry mismatch in " + name + ": requested " + str(requested) + ", generated " + str(detected) + " " + error)
+        print(verifier.summary())
@@ -0,0 +1,213 @@
+"""
+Module for timing the most frequently called functions during generation.
+When enabled, each function in hot_functions is replaced (in every loaded
+crystallography module) by a wrapper which records the latency of each call
+in a log2 histogram, and passes it to any registered hooks. When disabled,
+the original functions are restored, so there is no overhead.
+
+Profiling can be enabled with enable(), or by setting the environment variable
+CRYSTALLOGRAPHY_PROFILE before importing crystallography. If the variable is
+"1", the histograms are printed when Python exits. Any other value is used as
+the name of a JSON file to write the histograms to.
+
+Example:
+
+    import crystallography.profiling as profiling
+    profiling.enable()
+    random_crystal(225, ['C'], [4], 1.0)
+    profiling.print_report()
+"""
+import sys
+import os
+import json
+import atexit
+from math import frexp
+from time import perf_counter
+
+#The functions which may be profiled, and the modules which define them
+hot_functions = {
+    "check_distance": "crystallography.crystal",
+    "merge_coordinate": "crystallography.crystal",
+    "check_orbit_distance": "crystallography.crystal",
+    "check_wyckoff_position": "crystallography.crystal",
+    "site_symm": "crystallography.crystal",
+    "get_wyckoffs": "crystallography.crystal",
+    "generate_lattice": "crystallography.crystal",
+    "orientation_in_wyckoff_position": "crystallography.molecule",
+    }
+
+class latency_histogram():
+    """
+    Class for storing the latencies of calls to a single function. Calls are
+    counted in buckets by powers of 2: bucket n holds calls which took between
+    2**(n-1) and 2**n microseconds
+
+    Args:
+        name: the name of the function
+    """
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = {}
+
+    def add(self, seconds):
+        self.calls += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        n = max(frexp(seconds*1e6)[1], 0)
+        self.buckets[n] = self.buckets.get(n, 0) + 1
+
+    def percentile(self, q):
+        """
+        Returns an upper bound (in seconds) for the q-th percentile of the
+        latency, based on the histogram buckets
+        """
+        if self.calls == 0:
+            return 0.0
+        count = 0
+        for n in sorted(self.buckets):
+            count += self.buckets[n]
+            if count >= q/100.0*self.calls:
+                return 2.0**n*1e-6
+        return self.max
+
+    def to_dict(self):
+        return {"calls": self.calls, "total": self.total, "min": self.min,
+                "max": self.max, "p50": self.percentile(50),
+                "p95": self.percentile(95), "buckets": dict(self.buckets)}
+
+    def __str__(self):
+        if self.calls == 0:
+            return self.name + ": no calls"
+        lines = ["{}: {} calls, {:.4f} s total, {:.1f} us mean".format(
+            self.name, self.calls, self.total, self.total/self.calls*1e6)]
+        largest = max(self.buckets.values())
+        for n in sorted(self.buckets):
+            bar = "#"*max(1, int(40*self.buckets[n]/largest))
+            lines.append("  <{:>9d} us {:>8d} {}".format(2**n, self.buckets[n], bar))
+        return "\n".join(lines)
+
+histograms = {} #latency_histogram objects, keyed by function name
+hooks = [] #functions called as hook(name, seconds) after each timed call
+originals = {} #the unwrapped functions which are currently replaced
+
+def add_hook(hook):
+    """
+    Registers a function hook(name, seconds), which is called after each
+    timed call to a profiled function
+    """
+    hooks.append(hook)
+
+def remove_hook(hook):
+    if hook in hooks:
+        hooks.remove(hook)
+
+def wrap(name, function, every=1):
+    """
+    Returns a wrapper around function which times every n-th call
+    """
+    if name not in histograms:
+        histograms[name] = latency_histogram(name)
+    histogram = histograms[name]
+    counter = [0]
+    def wrapper(*args, **kwargs):
+        counter[0] += 1
+        if counter[0] % every != 0:
+            return function(*args, **kwargs)
+        t0 = perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            seconds = perf_counter() - t0
+            histogram.add(seconds)
+            for hook in hooks:
+                hook(name, seconds)
+    wrapper.__name__ = function.__name__
+    wrapper.__doc__ = function.__doc__
+    wrapper.__wrapped__ = function
+    return wrapper
+
+def replace(old, new):
+    """
+    Replaces every reference to old in the loaded crystallography modules.
+    Needed because modules such as molecular_crystal use star imports
+    """
+    for module_name, module in list(sys.modules.items()):
+        if module is None or not module_name.startswith("crystallography"):
+            continue
+        for attr, value in list(vars(module).items()):
+            if value is old:
+                setattr(module, attr, new)
+
+def enable(functions=None, every=1):
+    """
+    Starts profiling the given functions
+
+    Args:
+        functions: a list of names from hot_functions. Defaults to all
+        every: only time every n-th call, to reduce overhead
+    """
+    import crystallography.crystal
+    import crystallography.molecule
+    if functions is None:
+        functions = list(hot_functions)
+    for name in functions:
+        if name in originals:
+            continue
+        original = getattr(sys.modules[hot_functions[name]], name)
+        originals[name] = original
+        replace(original, wrap(name, original, every))
+
+def disable():
+    """
+    Stops profiling, and restores the original functions
+    """
+    for name in list(originals):
+        wrapper = getattr(sys.modules[hot_functions[name]], name)
+        replace(wrapper, originals.pop(name))
+
+def is_enabled():
+    return originals != {}
+
+def reset():
+    """
+    Clears the recorded histograms
+    """
+    #Wrappers keep a reference to their histogram, so clear it in place
+    for name in histograms:
+        histograms[name].__init__(name)
+
+def report():
+    """
+    Returns a dict with the histogram of each profiled function
+    """
+    return dict((name, histograms[name].to_dict()) for name in histograms)
+
+def print_report():
+    for name in sorted(histograms, key=lambda x: -histograms[x].total):
+        print(histograms[name])
+
+def write_report(filename):
+    with open(filename, "w") as f:
+        json.dump(report(), f, indent=2, sort_keys=True)
+
+def enable_from_environment(variable="CRYSTALLOGRAPHY_PROFILE"):
+    """
+    Enables profiling if the environment variable is set, and registers the
+    output of the histograms when Python exits
+    """
+    value = os.environ.get(variable)
+    if not value:
+        return False
+    enable()
+    if value.lower() in ["1", "true", "yes"]:
+        atexit.register(print_report)
+    else:
+        atexit.register(write_report, value)
+    return True
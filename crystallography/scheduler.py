@@ -0,0 +1,258 @@
+"""
+Module for scheduling composition sweeps (many space groups and
+compositions) on a pool of worker processes, when the cost of generation
+varies widely between tasks. A cost_model learns, for each task, the time
+per generation attempt and the success rate, from every chunk which
+finishes. run_scheduled uses these estimates to keep every process busy:
+
+    - tasks without any estimate first run a small pilot chunk
+
+    - chunks are sized to take about target_seconds, and shrink toward the
+    end of the sweep, so all processes finish at about the same time
+
+    - the task with the most expected remaining time is served first
+
+    - tasks whose success rate is below min_yield are deferred until no
+    other work is left, and abandoned if it falls below a tenth of that
+
+Pass a yield_cache (see yield_cache.py) to carry the estimates across runs.
+
+Chunks are generated with batch.generate_chunk, seeded with
+ledger.stream_seed. Chunk sizes depend on timing, so unlike batch.run_sweep,
+the structures of a scheduled run are not reproducible.
+
+Example:
+
+    from crystallography.scheduler import run_scheduled
+    tasks = [(sg, ['Si', 'O'], [4, 8], 1.0) for sg in range(1, 231)]
+    report = run_scheduled(tasks, "out", 100, processes=8)
+"""
+import os
+from time import time
+from queue import Queue
+from crystallography.batch import generate_chunk
+from crystallography.cif import formula
+from crystallography.ledger import task_key, stream_seed
+from crystallography.writers import open_writer
+
+class cost_model():
+    """
+    Online estimates of the cost and success rate of generation tasks.
+
+    Args:
+        prior_seconds: the time per attempt assumed before any task has
+            been observed
+    """
+    def __init__(self, prior_seconds=0.1):
+        self.prior_seconds = prior_seconds
+        self.entries = {}
+        """[seconds, attempts, successes] for each task key"""
+
+    def update(self, key, seconds, attempts, successes):
+        """
+        Adds the results of a finished chunk
+        """
+        entry = self.entries.setdefault(key, [0.0, 0, 0])
+        entry[0] += seconds
+        entry[1] += attempts
+        entry[2] += successes
+
+    def attempts(self, key):
+        return self.entries.get(key, [0.0, 0, 0])[1]
+
+    def seconds_per_attempt(self, key):
+        """
+        Returns the mean time per attempt. Tasks which have not been
+        observed get the mean over all observed tasks
+        """
+        seconds, attempts, successes = self.entries.get(key, [0.0, 0, 0])
+        if attempts > 0:
+            return seconds/attempts
+        total = sum(entry[0] for entry in self.entries.values())
+        count = sum(entry[1] for entry in self.entries.values())
+        return total/count if count > 0 else self.prior_seconds
+
+    def success_rate(self, key):
+        """
+        Returns the estimated probability that an attempt succeeds, with one
+        success and one failure added to the counts (Laplace's rule), so that
+        unobserved tasks get 1/2 and no estimate is ever 0
+        """
+        seconds, attempts, successes = self.entries.get(key, [0.0, 0, 0])
+        return (successes + 1.0)/(attempts + 2.0)
+
+    def cost(self, key):
+        """
+        Returns the expected time to generate one structure
+        """
+        return self.seconds_per_attempt(key)/self.success_rate(key)
+
+def run_scheduled(tasks, directory, number, seed=0, processes=1, format="bin", target_seconds=2.0,
+                  max_chunk=50, pilot=2, min_yield=0.01, min_attempts=20, max_failures=3,
+                  model=None, cache=None, molecular=False, verbose=False, **kwargs):
+    """
+    Generates structures for a list of tasks, scheduling chunks of work by
+    their estimated cost. Each task is written to its own output in
+    directory, as in batch.run_sweep
+
+    Args:
+        tasks: a list of (sg, species, numIons, factor) tuples
+        directory: the output directory
+        number: the number of structures to write for each task
+        seed: the base seed (see ledger.stream_seed)
+        processes: the number of worker processes
+        format: the output format (see writers.writer_formats)
+        target_seconds: the intended duration of a chunk
+        max_chunk: the largest number of structures in a chunk
+        pilot: the number of structures in the first chunk of a task
+        min_yield: tasks with a lower success rate are deferred
+        min_attempts: the number of attempts needed before a task can be
+            deferred or abandoned for a low success rate
+        max_failures: a task is abandoned after this many consecutive
+            chunks without a structure
+        model: an optional cost_model with earlier estimates. It is updated
+            as chunks finish
+        cache: an optional yield_cache (see yield_cache.py). Its counts are
+            added to the model before the run, tasks which it marks as
+            hopeless are abandoned without running, and every finished chunk
+            is recorded in it
+        molecular: if True, generates molecular crystals
+        verbose: if True, prints each finished chunk
+        kwargs: passed on to generate_batch
+
+    Returns:
+        a dictionary, keyed by task, of dictionaries with the number of
+        structures written, the attempts, the seconds spent, and the status
+        ("done", "abandoned", or "failed")
+    """
+    if model is None:
+        model = cost_model()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    extension = "" if format in ["bin", "cifs"] else "." + format
+    states = {}
+    for sg, species, numIons, factor in tasks:
+        key = task_key(sg, species, numIons, factor, molecular)
+        writer = open_writer(os.path.join(directory, key + extension), format)
+        if writer is None:
+            return None
+        states[key] = {"task": (sg, species, numIons, factor), "writer": writer, "written": 0,
+                       "requested": 0, "index": 0, "failures": 0, "attempts": 0, "seconds": 0.0,
+                       "status": "active"}
+        if cache is not None:
+            entry = cache.get(key)
+            if entry is not None and model.attempts(key) == 0:
+                model.update(key, entry["seconds"], entry["attempts"], entry["successes"])
+            if cache.hopeless(key):
+                states[key]["status"] = "abandoned"
+
+    def remaining(key):
+        state = states[key]
+        return number - state["written"] - state["requested"]
+
+    def low_yield(key, limit):
+        return model.attempts(key) >= min_attempts and model.success_rate(key) < limit
+
+    def next_chunk():
+        #Returns (key, size) for the next chunk to submit, or None
+        active = [key for key in states if states[key]["status"] == "active" and remaining(key) > 0]
+        if active == []:
+            return None
+        #Pilot chunks for tasks without estimates
+        for key in active:
+            if model.attempts(key) == 0 and states[key]["requested"] == 0:
+                return key, min(pilot, remaining(key))
+        normal = [key for key in active if not low_yield(key, min_yield)]
+        #Only run low yield tasks when nothing else is left
+        candidates = normal if normal != [] else active
+        expected = dict((key, remaining(key)*model.cost(key)) for key in candidates)
+        key = max(candidates, key=lambda k: expected[k])
+        #Shrink chunks near the end, so the last chunks finish together
+        target = min(target_seconds, sum(expected.values())/max(1, processes))
+        size = int(round(target/model.cost(key)))
+        return key, max(1, min(size, max_chunk, remaining(key)))
+
+    def finish_chunk(key, size, result):
+        state = states[key]
+        state["requested"] -= size
+        if isinstance(result, Exception):
+            print("Error in task " + key + ": " + str(result))
+            state["status"] = "failed"
+            return
+        records, stats, seconds = result
+        attempts = stats["counters"]["runs"]
+        incompatible = stats["counters"].get("incompatible", 0) > 0
+        model.update(key, seconds, attempts, len(records))
+        if cache is not None:
+            cache.record(key, attempts, len(records), seconds, incompatible)
+        state["attempts"] += attempts
+        state["seconds"] += seconds
+        for record in records[:max(0, number - state["written"])]:
+            state["written"] += 1
+            state["writer"].add(record, formula(record) + "_" + str(state["written"]))
+        state["failures"] = 0 if records != [] else state["failures"] + 1
+        if state["status"] == "active":
+            if state["written"] >= number:
+                state["status"] = "done"
+            elif incompatible:
+                state["status"] = "abandoned"
+            elif state["failures"] >= max_failures:
+                state["status"] = "failed"
+            elif low_yield(key, min_yield/10.0):
+                state["status"] = "abandoned"
+        if verbose:
+            print("{:s}: {:d} of {:d} structures in {:.2f} s, {:d}/{:d} written, {:.3f} s per structure".format(
+                key, len(records), size, seconds, state["written"], number, model.cost(key)))
+
+    pool = None
+    if processes > 1:
+        from multiprocessing import Pool
+        pool = Pool(processes)
+    finished = Queue()
+    in_flight = 0
+    try:
+        while True:
+            while in_flight < max(1, processes):
+                chunk = next_chunk()
+                if chunk is None:
+                    break
+                key, size = chunk
+                state = states[key]
+                state["requested"] += size
+                sg, species, numIons, factor = state["task"]
+                task = (stream_seed(seed, key, state["index"]), size, sg, species, numIons, factor, molecular, kwargs)
+                state["index"] += 1
+                in_flight += 1
+                if pool is None:
+                    finished.put((key, size, timed_chunk(task)))
+                else:
+                    pool.apply_async(timed_chunk, (task,),
+                        callback=lambda result, key=key, size=size: finished.put((key, size, result)),
+                        error_callback=lambda error, key=key, size=size: finished.put((key, size, error)))
+            if in_flight == 0:
+                break
+            key, size, result = finished.get()
+            in_flight -= 1
+            finish_chunk(key, size, result)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        for state in states.values():
+            state["writer"].close()
+
+    report = {}
+    for key, state in states.items():
+        status = state["status"] if state["status"] != "active" else "done"
+        report[key] = {"written": state["written"], "attempts": state["attempts"],
+                       "seconds": state["seconds"], "status": status}
+    return report
+
+def timed_chunk(task):
+    """
+    Runs batch.generate_chunk in a worker process, and also returns the time
+    it took
+    """
+    start = time()
+    records, stats = generate_chunk(task)
+    return records, stats, time() - start
@@ -0,0 +1,132 @@
+"""
+Module for collecting statistics about crystal generation. A generation_stats
+object may be passed to random_crystal, random_crystal_2D, or
+molecular_crystal via the stats keyword. The generator then counts lattice
+attempts, Wyckoff choices, overlap checks, and rejections, and records the
+time spent in each phase. If no object is passed, nothing is recorded. One
+object may be shared across many generators, or several objects may be
+combined afterwards with combine_stats. The results can be exported as JSON.
+"""
+import json
+
+#Counters recorded by the generators
+counter_names = [
+    "runs", #calls to generate_crystal
+    "successes", #calls which produced a structure
+    "lattice_attempts", #calls to generate_lattice
+    "lattice_failures", #calls to generate_lattice which returned None
+    "placement_attempts", #calls to place_orbits
+    "wyckoff_choices", #single attempts at placing a Wyckoff position
+    "overlap_checks", #orbits checked for overlapping points (and merged, for molecules)
+    "overlap_passes", #orbits which passed the overlap check
+    "distance_rejections", #orbits rejected by check_distance
+    "orientation_rejections", #molecular orientations rejected
+    "incompatible", #batches stopped by an incompatible composition (see batch.generate_batch)
+    ]
+
+#Phases for which the time is recorded
+phase_names = ["compatibility", "orientations", "lattice", "placement", "finalize"]
+
+class generation_stats():
+    """
+    Class for storing counters and timers for one or more generation runs.
+
+    Args:
+        label: an optional name, e.g. the space group number
+    """
+    def __init__(self, label=None):
+        self.label = label
+        self.counters = dict((name, 0) for name in counter_names)
+        """The number of times each event occurred"""
+        self.pair_rejections = {}
+        """The number of distance rejections for each pair of species,
+        keyed by a string such as 'O-Si' (sorted alphabetically)"""
+        self.times = dict((name, 0.0) for name in phase_names)
+        """The total time (in seconds) spent in each phase"""
+
+    def count(self, name, n=1):
+        """
+        Increments the counter name by n
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def reject_pair(self, specie1, specie2):
+        """
+        Records a distance rejection between two atomic species
+        """
+        key = "-".join(sorted([str(specie1), str(specie2)]))
+        self.pair_rejections[key] = self.pair_rejections.get(key, 0) + 1
+
+    def add_time(self, phase, seconds):
+        """
+        Adds seconds to the total time spent in phase
+        """
+        self.times[phase] = self.times.get(phase, 0.0) + seconds
+
+    def merge(self, other):
+        """
+        Adds the counters, rejections, and times of another generation_stats
+        object to this one
+        """
+        for name in other.counters:
+            self.count(name, other.counters[name])
+        for key in other.pair_rejections:
+            self.pair_rejections[key] = self.pair_rejections.get(key, 0) + other.pair_rejections[key]
+        for phase in other.times:
+            self.add_time(phase, other.times[phase])
+        return self
+
+    def success_rate(self):
+        if self.counters["runs"] == 0:
+            return 0.0
+        return self.counters["successes"]/self.counters["runs"]
+
+    def to_dict(self):
+        return {"label": self.label, "counters": dict(self.counters),
+                "pair_rejections": dict(self.pair_rejections),
+                "times": dict(self.times)}
+
+    def to_json(self, filename=None):
+        """
+        Returns the statistics as a JSON string. If filename is given, also
+        writes the string to that file
+        """
+        text = json.dumps(self.to_dict(), indent=2, sort_keys=True)
+        if filename is not None:
+            with open(filename, "w") as f:
+                f.write(text)
+        return text
+
+    @classmethod
+    def from_dict(cls, d):
+        stats = cls(d.get("label"))
+        for name in d["counters"]:
+            stats.counters[name] = d["counters"][name]
+        stats.pair_rejections = dict(d["pair_rejections"])
+        for phase in d["times"]:
+            stats.times[phase] = d["times"][phase]
+        return stats
+
+    @classmethod
+    def from_json(cls, filename):
+        with open(filename, "r") as f:
+            return cls.from_dict(json.load(f))
+
+    def __str__(self):
+        lines = ["Generation statistics" + ("" if self.label is None else " for "+str(self.label))]
+        for name in self.counters:
+            lines.append("  {:24s} {:d}".format(name, self.counters[name]))
+        for key in sorted(self.pair_rejections):
+            lines.append("  {:24s} {:d}".format("rejected "+key, self.pair_rejections[key]))
+        for phase in self.times:
+            lines.append("  {:24s} {:.4f} s".format("time "+phase, self.times[phase]))
+        return "\n".join(lines)
+
+def combine_stats(stats_list, label=None):
+    """
+    Combines a list of generation_stats objects into a new object
+    """
+    total = generation_stats(label)
+    for stats in stats_list:
+        total.merge(stats)
+    return total
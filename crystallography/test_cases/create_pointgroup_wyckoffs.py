@@ -0,0 +1,28 @@
+'''
+Create the Wyckoff position table for the 32 crystallographic point groups.
+For each point group, we take the symmorphic space group listed in
+database/pointgroup.py and keep the Wyckoff positions which pass through the
+origin, i.e., positions whose operations have no translational part. The
+result is written to wyckoff_list_pg.csv, in the same format as wyckoff_list.csv
+'''
+from crystallography.crystal import *
+from crystallography.database.pointgroup import Pointgroup
+from pandas import DataFrame
+
+wyckoffs_all = [None]
+print("-------------------Creating point group Wyckoff positions-------------------")
+for pg in range(1, 33):
+    sg = Pointgroup(pg).sgnumber
+    print("Calculating point group "+str(pg)+" from spacegroup "+str(sg))
+    wyckoffs_all.append([])
+    for wp in get_wyckoffs(sg):
+        origin = True
+        for op in wp:
+            if not np.allclose(op.translation_vector, np.zeros(3)):
+                origin = False
+        if origin is True:
+            wyckoffs_all[-1].append([op.as_xyz_string() for op in wp])
+
+print("-------------------Writing to database-------------------")
+df = DataFrame(data=wyckoffs_all)
+df.to_csv("wyckoff_list_pg.csv")
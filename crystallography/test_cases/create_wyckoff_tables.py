@@ -0,0 +1,33 @@
+'''
+Create the Wyckoff multiplicity and degree of freedom tables used by
+feasibility.py. For each space group, layer group, and point group, we store a
+list of [multiplicity, degrees of freedom] pairs, one for each Wyckoff
+position, in the same order as get_wyckoffs. The tables are written to
+wyckoff_table.csv, wyckoff_table_lg.csv, and wyckoff_table_pg.csv
+'''
+from crystallography.crystal import *
+from crystallography.cluster import get_wyckoffs_pg
+from crystallography.database.layergroup import Layergroup
+from pandas import DataFrame
+
+def table(wyckoffs):
+    return [[len(wp), wyckoff_degrees(wp)] for wp in wyckoffs]
+
+print("-------------------Creating space group tables-------------------")
+tables = [None]
+for sg in range(1, 231):
+    tables.append(str(table(get_wyckoffs(sg))))
+DataFrame(data=tables).to_csv("wyckoff_table.csv")
+
+print("-------------------Creating layer group tables-------------------")
+tables = [None]
+for lg in range(1, 81):
+    lgp = Layergroup(lg)
+    tables.append(str(table(get_wyckoffs(lgp.sgnumber, PB=lgp.permutation[3:6]))))
+DataFrame(data=tables).to_csv("wyckoff_table_lg.csv")
+
+print("-------------------Creating point group tables-------------------")
+tables = [None]
+for pg in range(1, 33):
+    tables.append(str(table(get_wyckoffs_pg(pg))))
+DataFrame(data=tables).to_csv("wyckoff_table_pg.csv")
@@ -0,0 +1,256 @@
+"""
+Module for checking the symmetry of generated structures with spglib, without
+slowing down generation. A symmetry_verifier behaves like a streaming writer
+(see writers.py): records are passed to add(), a fraction of them is sampled,
+and full batches are checked in a pool of worker processes while generation
+continues. Structures whose detected space group differs from the requested
+one are counted, and written to an optional tab-separated report file.
+
+When only the requested group needs to be confirmed, check_invariance is a
+much cheaper alternative to spglib: it applies a small set of general
+position operations which generate the group (see get_group_generators) to
+the coordinates at once, and matches each image to
+the nearest atom of the same species with a periodic k-d tree. Pass
+method="internal" to symmetry_verifier to use it.
+
+Example:
+
+    from crystallography.batch import generate_batch
+    from crystallography.verify import symmetry_verifier
+    with symmetry_verifier(report="mismatches.txt", fraction=0.1) as verifier:
+        for record in generate_batch(206, ['Li'], [16], 2.0, 1000, writers=[verifier]):
+            pass
+    print(verifier.summary())
+"""
+import numpy as np
+from threading import Lock
+from multiprocessing import Pool
+from scipy.spatial import cKDTree
+from crystallography.writers import structure_writer
+from crystallography.genome import get_wyckoff_info
+
+group_generator_cache = {}
+
+def get_group_generators(sg, tol=1e-6):
+    """
+    Returns a small subset of the general position operations of a space
+    group which generates the whole group (modulo lattice translations). A
+    structure invariant under these operations is invariant under the group.
+    The operations are chosen greedily, in the order of get_wyckoffs, and
+    cached
+
+    Returns:
+        an array of 4x4 affine matrices
+    """
+    if sg in group_generator_cache:
+        return group_generator_cache[sg]
+    ops = get_wyckoff_info(sg)[0][0]
+    def key(op):
+        t = np.round(op[:3,3] % 1.0, 6) % 1.0
+        return np.round(op[:3,:3]).astype(int).tobytes() + (t + 0.0).tobytes()
+    generators = []
+    group = {key(np.eye(4)): np.eye(4)}
+    for op in ops:
+        if key(op) in group:
+            continue
+        generators.append(op)
+        #Close the group under multiplication by the generators
+        new = list(group.values())
+        while new != []:
+            found = []
+            for a in new:
+                for g in generators:
+                    product = np.dot(g, a)
+                    product[:3,3] %= 1.0
+                    k = key(product)
+                    if k not in group:
+                        group[k] = product
+                        found.append(product)
+            new = found
+        if len(group) >= len(ops):
+            break
+    group_generator_cache[sg] = np.array(generators).reshape(-1, 4, 4)
+    return group_generator_cache[sg]
+
+def check_invariance(sg, lattice, coordinates, numbers, tol=1e-3):
+    """
+    Checks that a structure is invariant under the general position
+    operations of a space group, in the setting used for generation. Only
+    the generators of the group (see get_group_generators) are applied. Only 3D
+    structures are supported (2D crystals are permuted and padded with vacuum
+    after generation)
+
+    Args:
+        sg: the space group number
+        lattice: a 3x3 array of lattice vectors
+        coordinates: an Nx3 array of fractional coordinates
+        numbers: the atomic number (or any species label) of each atom
+        tol: the largest allowed distance, in Angstroms, between an image of
+            an atom and the matching atom
+
+    Returns:
+        True if every operation maps the atoms onto themselves (each image
+        matching a different atom of the same species within tol), and the
+        largest distance between an image and its matching atom, over the
+        generators
+    """
+    lattice = np.asarray(lattice, dtype=float)
+    coordinates = np.asarray(coordinates, dtype=float)
+    numbers = np.asarray(numbers)
+    ops = get_group_generators(sg)
+    #Images of every atom under every generator, shape (operations, atoms, 3)
+    images = np.einsum('oij,nj->oni', ops[:,:3,:3], coordinates) + ops[:,None,:3,3]
+    #Species are a fourth, non-periodic coordinate, far enough apart that an
+    #image is never matched to an atom of another species
+    labels = np.unique(numbers, return_inverse=True)[1]*10.0
+    def wrap(x):
+        x = x % 1.0
+        return np.where(x >= 1.0, 0.0, x)
+    points = np.column_stack([wrap(coordinates), labels])
+    tree = cKDTree(points, boxsize=[1, 1, 1, 10.0*(len(numbers)+1)])
+    queries = np.concatenate([wrap(images), np.broadcast_to(labels[None,:,None], images.shape[:2]+(1,))], axis=2)
+    distances, indices = tree.query(queries.reshape(-1, 4))
+    indices = indices.reshape(len(ops), len(numbers))
+    #Cartesian distance between each image and its match
+    d = images.reshape(-1, 3) - coordinates[indices.flatten()]
+    d -= np.round(d)
+    deviation = np.sqrt(np.max(np.sum(np.dot(d, lattice)**2, axis=1))) if len(d) > 0 else 0.0
+    #Each operation must map the atoms one-to-one
+    ordered = np.sort(indices, axis=1)
+    bijective = np.all(ordered[:,1:] != ordered[:,:-1])
+    return bool(deviation <= tol and bijective), float(deviation)
+
+def check_batch(items, symprec=1e-1, method="spglib"):
+    """
+    Detects the space group of each structure in a batch. Runs in the worker
+    processes, so it only receives plain arrays
+
+    Args:
+        items: a list of (name, requested space group, (lattice, coordinates,
+            numbers)) tuples
+        symprec: the tolerance passed to spglib, or to check_invariance
+        method: "spglib" to detect the space group, or "internal" to only
+            check invariance under the requested group (see check_invariance)
+
+    Returns:
+        a list of (name, requested space group, detected space group, error)
+        tuples. The detected space group is None if spglib failed (or the
+        internal check failed), in which case error holds the reason
+    """
+    from spglib import get_symmetry_dataset
+    results = []
+    for name, sg, cell in items:
+        detected = None
+        error = ""
+        if method == "internal":
+            passed, deviation = check_invariance(sg, cell[0], cell[1], cell[2], tol=symprec)
+            if passed:
+                detected = sg
+            else:
+                error = "not invariant, largest deviation {:.4f}".format(deviation)
+            results.append((name, sg, detected, error))
+            continue
+        try:
+            dataset = get_symmetry_dataset(cell, symprec=symprec)
+            if dataset is None:
+                error = "spglib found no symmetry"
+            else:
+                detected = int(dataset['number'])
+        except Exception as e:
+            error = str(e)
+        results.append((name, sg, detected, error))
+    return results
+
+class symmetry_verifier(structure_writer):
+    """
+    Checks the space group of generated structures in the background.
+
+    Args:
+        report: an optional file to which mismatches are appended, one line
+            per structure (name, requested, detected, error)
+        fraction: the fraction of structures to check, chosen at random
+        symprec: the tolerance passed to spglib, or to check_invariance
+        method: "spglib" to detect the space group of each structure, or
+            "internal" to only check invariance under the requested group
+        processes: the number of worker processes. Defaults to the number of
+            CPUs. If 0, batches are checked in the calling process
+        chunk: the number of sampled structures sent to a worker at once
+        seed: an optional seed for the sampling
+    """
+    def __init__(self, report=None, fraction=1.0, symprec=1e-1, method="spglib", processes=None, chunk=50, seed=None):
+        structure_writer.__init__(self, report, chunk)
+        self.fraction = fraction
+        self.symprec = symprec
+        self.method = method
+        self.random = np.random.RandomState(seed)
+        self.pool = None if processes == 0 else Pool(processes)
+        self.lock = Lock()
+        self.pending = []
+        self.seen = 0
+        """The number of structures passed to add()"""
+        self.checked = 0
+        """The number of structures whose symmetry has been checked"""
+        self.mismatches = []
+        """(name, requested, detected, error) for each mismatched structure"""
+
+    def add(self, record, name=None):
+        """
+        Adds a crystal_record. It is checked with probability fraction
+        """
+        self.seen += 1
+        if self.fraction < 1.0 and self.random.random_sample() >= self.fraction:
+            return
+        if name is None:
+            name = str(self.seen)
+        structure_writer.add(self, record, name)
+
+    def write_chunk(self, chunk):
+        #Only send plain arrays to the workers
+        items = [(name, int(record.sg), tuple(np.array(x) for x in record.spg_struct)) for record, name in chunk]
+        if self.pool is None:
+            self.collect(check_batch(items, self.symprec, self.method))
+        else:
+            self.pending.append(self.pool.apply_async(check_batch, (items, self.symprec, self.method), callback=self.collect))
+
+    def collect(self, results):
+        """
+        Records the results of a checked batch. Called by the pool when a
+        batch finishes
+        """
+        mismatches = [result for result in results if result[1] != result[2]]
+        with self.lock:
+            self.checked += len(results)
+            self.mismatches += mismatches
+            if self.filename is not None and mismatches != []:
+                with open(self.filename, "a") as f:
+                    for name, sg, detected, error in mismatches:
+                        f.write("{:s}\t{:d}\t{:s}\t{:s}\n".format(str(name), sg, str(detected), error))
+
+    def wait(self):
+        """
+        Blocks until all submitted batches have been checked
+        """
+        for result in self.pending:
+            #get() re-raises any error from the worker
+            result.get()
+        self.pending = []
+
+    def close(self):
+        """
+        Checks any buffered structures, waits for the workers, and shuts down
+        the pool
+        """
+        self.flush()
+        self.wait()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def summary(self):
+        """
+        Returns a one-line summary of the checks so far
+        """
+        with self.lock:
+            checked, mismatched = self.checked, len(self.mismatches)
+        return "Checked {:d} of {:d} structures, {:d} mismatched".format(checked, self.seen, mismatched)
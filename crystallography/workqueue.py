@@ -0,0 +1,442 @@
+"""
+Module for sharing a generation sweep between independent processes, on one
+machine or on several hosts with a shared (e.g. NFS) directory, without a
+message broker. The queue is a directory with one JSON file per task, and the
+state of a task is the subdirectory holding its file:
+
+    pending/: tasks waiting for a worker
+
+    claimed/: tasks being worked on, named task@worker.json
+
+    done/: finished tasks, with their results
+
+    failed/: tasks which were abandoned too many times, or raised an error
+
+    heartbeats/: one file per worker, touched at regular intervals
+
+A worker claims a task by renaming its file from pending/ to claimed/. The
+rename is atomic, so only one worker can win. While it works, a background
+thread touches its heartbeat file. Any worker may return the tasks of a
+worker whose heartbeat is older than the lease timeout to pending/ (again by
+renaming). Times are compared with the modification time of a freshly
+touched file on the shared file system, so clocks on different hosts do not
+need to agree.
+
+Each task is run with batch.run_sweep in its own output directory, with its
+own progress ledger (see ledger.py), so a reclaimed task continues from the
+last chunk completed by the previous worker instead of starting over.
+
+Example (submit a sweep, then start any number of workers):
+
+    python -m crystallography.workqueue -q queue -s sweep.json
+    python -m crystallography.workqueue -q queue -o out
+
+where sweep.json holds, for example,
+{"space_groups": [225, 229], "compositions": [[["C"], [8]], [["Si", "O"], [4, 8]]],
+ "factor": 1.0, "number": 100}
+
+To check the queue locally with several worker processes, one of which is
+killed while it works:
+
+    python -m crystallography.workqueue --test 4
+"""
+import os
+import json
+import socket
+import threading
+from time import time, sleep
+from optparse import OptionParser
+from crystallography.ledger import task_key
+from crystallography.batch import run_sweep
+
+queue_states = ["pending", "claimed", "done", "failed", "heartbeats"]
+
+def write_json(path, data):
+    #Write to a temporary file first, so readers never see a partial file
+    with open(path+".tmp", "w") as f:
+        json.dump(data, f, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path+".tmp", path)
+
+def read_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def sweep_tasks(space_groups, compositions, number, factor=1.0, molecular=False):
+    """
+    Returns the tasks of a sweep over space groups and compositions
+
+    Args:
+        space_groups: a list of space group numbers
+        compositions: a list of (species, numIons) pairs
+        number: the number of structures to generate for each task
+        factor: the volume factor
+        molecular: if True, species are molecule names
+
+    Returns:
+        a list of task dictionaries
+    """
+    tasks = []
+    for sg in space_groups:
+        for species, numIons in compositions:
+            tasks.append({"sg": int(sg), "species": list(species), "numIons": [int(n) for n in numIons],
+                          "factor": float(factor), "number": int(number), "molecular": bool(molecular),
+                          "attempts": 0})
+    return tasks
+
+def load_sweep(filename):
+    """
+    Reads the tasks of a sweep from a JSON file with the keys space_groups,
+    compositions, and number (and optionally factor and molecular)
+    """
+    spec = read_json(filename)
+    return sweep_tasks(spec["space_groups"], spec["compositions"], spec["number"],
+                       spec.get("factor", 1.0), spec.get("molecular", False))
+
+class work_queue():
+    """
+    A task queue stored in a shared directory.
+
+    Args:
+        directory: the queue directory. It is created if needed
+        worker: a name for this worker, unique across hosts. Defaults to
+            hostname-pid
+        timeout: the number of seconds after the last heartbeat at which a
+            worker's tasks may be reclaimed
+        max_attempts: a task is moved to failed/ instead of pending/ after
+            it has been reclaimed this many times
+    """
+    def __init__(self, directory, worker=None, timeout=120.0, max_attempts=3):
+        self.directory = directory
+        self.worker = worker if worker is not None else socket.gethostname() + "-" + str(os.getpid())
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        for state in queue_states:
+            if not os.path.isdir(self.path(state)):
+                os.makedirs(self.path(state), exist_ok=True)
+        self.stop_event = None
+
+    def path(self, state, name=""):
+        return os.path.join(self.directory, state, name)
+
+    def submit(self, tasks):
+        """
+        Adds tasks to pending/. Tasks which are already in the queue (in any
+        state) are skipped, so a sweep can be submitted again safely
+
+        Returns:
+            the number of tasks added
+        """
+        existing = set()
+        for state in ["pending", "claimed", "done", "failed"]:
+            for name in os.listdir(self.path(state)):
+                existing.add(name.split("@")[0].replace(".json", ""))
+        added = 0
+        for task in tasks:
+            id = task_key(task["sg"], task["species"], task["numIons"], task["factor"], task["molecular"])
+            if id in existing:
+                continue
+            write_json(self.path("pending", id+".json"), dict(task, id=id))
+            existing.add(id)
+            added += 1
+        return added
+
+    def claim(self):
+        """
+        Claims a pending task
+
+        Returns:
+            the task dictionary, or None if no task is pending
+        """
+        for name in sorted(os.listdir(self.path("pending"))):
+            if not name.endswith(".json"):
+                continue
+            claimed = self.path("claimed", name[:-5] + "@" + self.worker + ".json")
+            try:
+                os.rename(self.path("pending", name), claimed)
+            except FileNotFoundError:
+                #Another worker claimed it first
+                continue
+            return read_json(claimed)
+        return None
+
+    def release(self, task, state, **fields):
+        """
+        Moves a task claimed by this worker to another state, adding fields
+        to its file
+
+        Returns:
+            True on success, or False if the lease was lost (the task was
+            reclaimed by another worker)
+        """
+        claimed = self.path("claimed", task["id"] + "@" + self.worker + ".json")
+        #Move the file out of claimed/ first, so a worker reclaiming the task
+        #at the same time either gets it before the move or not at all. The
+        #temporary name is ignored by claim and status
+        moving = self.path(state, task["id"] + "@" + self.worker + ".tmp")
+        try:
+            os.rename(claimed, moving)
+        except FileNotFoundError:
+            print("Error: the lease on task " + task["id"] + " was lost.")
+            return False
+        task = dict(task, **fields)
+        write_json(moving, task)
+        os.replace(moving, self.path(state, task["id"] + ".json"))
+        return True
+
+    def holds(self, task):
+        """
+        Returns True if this worker still holds the lease on a claimed task,
+        and False if it was reclaimed by another worker
+        """
+        return os.path.exists(self.path("claimed", task["id"] + "@" + self.worker + ".json"))
+
+    def complete(self, task, result=None):
+        """
+        Moves a claimed task to done/, with its result
+        """
+        return self.release(task, "done", result=result, worker=self.worker)
+
+    def fail(self, task, error):
+        """
+        Moves a claimed task to failed/, with an error message
+        """
+        return self.release(task, "failed", error=str(error), worker=self.worker)
+
+    def heartbeat(self):
+        """
+        Touches this worker's heartbeat file, and returns its modification
+        time (the current time of the shared file system)
+        """
+        path = self.path("heartbeats", self.worker)
+        with open(path, "a"):
+            os.utime(path, None)
+        return os.path.getmtime(path)
+
+    def start_heartbeat(self, interval=None):
+        """
+        Starts a background thread which calls heartbeat every interval
+        seconds (by default, a quarter of the timeout)
+        """
+        if interval is None:
+            interval = self.timeout/4.0
+        self.stop_event = threading.Event()
+        stop = self.stop_event
+        def beat():
+            wait = interval
+            while not stop.wait(wait):
+                try:
+                    self.heartbeat()
+                    wait = interval
+                except OSError as e:
+                    #A transient error of the shared file system must not end
+                    #the heartbeats while the worker goes on, so retry soon
+                    print("Error: heartbeat of " + self.worker + " failed: " + str(e))
+                    wait = min(interval, 1.0)
+        self.heartbeat()
+        thread = threading.Thread(target=beat)
+        thread.daemon = True
+        thread.start()
+
+    def stop_heartbeat(self):
+        if self.stop_event is not None:
+            self.stop_event.set()
+            self.stop_event = None
+        path = self.path("heartbeats", self.worker)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def reclaim(self):
+        """
+        Returns the tasks of workers whose heartbeat is older than the
+        timeout to pending/ (or to failed/, once a task has been reclaimed
+        max_attempts times)
+
+        Returns:
+            the number of tasks reclaimed
+        """
+        now = self.heartbeat()
+        count = 0
+        for name in os.listdir(self.path("claimed")):
+            if "@" not in name or not name.endswith(".json"):
+                continue
+            id, worker = name[:-5].split("@", 1)
+            if worker == self.worker:
+                continue
+            try:
+                beat = self.path("heartbeats", worker)
+                last = os.path.getmtime(beat) if os.path.exists(beat) else os.path.getmtime(self.path("claimed", name))
+                if now - last <= self.timeout:
+                    continue
+                #Take over the lease first, so only one worker reclaims it
+                stolen = self.path("claimed", id + "@" + self.worker + ".json")
+                os.rename(self.path("claimed", name), stolen)
+            except FileNotFoundError:
+                continue
+            task = read_json(stolen)
+            task["attempts"] = task.get("attempts", 0) + 1
+            if task["attempts"] >= self.max_attempts:
+                self.release(task, "failed", error="abandoned by " + str(task["attempts"]) + " workers")
+            else:
+                self.release(task, "pending")
+            count += 1
+        return count
+
+    def status(self):
+        """
+        Returns the number of tasks in each state
+        """
+        return dict((state, len([n for n in os.listdir(self.path(state)) if n.endswith(".json")]))
+                    for state in ["pending", "claimed", "done", "failed"])
+
+    def empty(self):
+        """
+        Returns True if no task is pending or claimed
+        """
+        status = self.status()
+        return status["pending"] == 0 and status["claimed"] == 0
+
+def run_worker(queue, output, seed=0, chunk=10, format="bin", processes=1, poll=5.0, **kwargs):
+    """
+    Claims and runs tasks until the queue is drained
+
+    Args:
+        queue: a work_queue
+        output: the output directory. Each task is written to its own
+            subdirectory, with its own progress ledger
+        seed, chunk, format, processes: passed on to batch.run_sweep
+        poll: the number of seconds to wait when no task is pending, but
+            other workers still hold tasks (which may need reclaiming)
+        kwargs: passed on to generate_batch
+
+    Returns:
+        the number of tasks completed by this worker
+    """
+    completed = 0
+    queue.start_heartbeat()
+    try:
+        while True:
+            queue.reclaim()
+            task = queue.claim()
+            if task is None:
+                if queue.empty():
+                    break
+                sleep(poll)
+                continue
+            try:
+                #Stop before writing any chunk once the lease is lost, so a
+                #stalled worker cannot write over the output of its successor
+                results = run_sweep([(task["sg"], task["species"], task["numIons"], task["factor"])],
+                                    os.path.join(output, task["id"]), task["number"], seed=seed, chunk=chunk,
+                                    format=format, processes=processes, molecular=task["molecular"],
+                                    proceed=lambda task=task: queue.holds(task), **kwargs)
+            except Exception as e:
+                queue.fail(task, e)
+                continue
+            if not queue.holds(task):
+                print("Error: the lease on task " + task["id"] + " was lost.")
+                continue
+            if results is None:
+                queue.fail(task, "could not open the output")
+                continue
+            written = list(results.values())[0]
+            if queue.complete(task, {"written": written}):
+                completed += 1
+    finally:
+        queue.stop_heartbeat()
+    return completed
+
+def test_worker(directory, output, timeout, completed):
+    #Runs one worker of self_test in its own process
+    queue = work_queue(directory, timeout=timeout)
+    completed.put(run_worker(queue, output, seed=0, chunk=5, poll=timeout/4.0))
+
+def self_test(workers=4, number=20, timeout=3.0):
+    """
+    Runs a small sweep with several worker processes sharing a queue in a
+    temporary directory. The first worker is killed while it works, so its
+    task must be reclaimed by another worker. Checks that every task ends in
+    done/ exactly once, with all of its structures
+
+    Args:
+        workers: the number of worker processes
+        number: the number of structures for each task
+        timeout: the lease timeout, in seconds
+
+    Returns:
+        True if the check passed, and False otherwise
+    """
+    import shutil
+    import tempfile
+    from multiprocessing import Process, Queue
+    directory = tempfile.mkdtemp()
+    try:
+        queue = work_queue(os.path.join(directory, "queue"), worker="submit", timeout=timeout)
+        tasks = sweep_tasks([195, 198, 200, 207, 215, 221, 225, 229], [(["C"], [4])], number)
+        queue.submit(tasks)
+        completed = Queue()
+        processes = [Process(target=test_worker, args=(queue.directory, os.path.join(directory, "out"), timeout, completed))
+                     for i in range(workers)]
+        for process in processes:
+            process.start()
+        #Stop the first worker without any cleanup, as a crash would
+        while queue.status()["claimed"] == 0 and processes[0].is_alive():
+            sleep(0.05)
+        processes[0].terminate()
+        for process in processes:
+            process.join(60*timeout)
+        counts = [completed.get(timeout=60*timeout) for process in processes[1:]]
+        status = queue.status()
+        print("Workers completed " + str(counts) + " tasks; queue status " + str(status))
+        passed = True
+        if sum(counts) != len(tasks) or status != {"pending": 0, "claimed": 0, "done": len(tasks), "failed": 0}:
+            print("Error: tasks were lost or completed more than once.")
+            passed = False
+        for name in os.listdir(queue.path("done")):
+            task = read_json(queue.path("done", name))
+            if task["result"]["written"] != number:
+                print("Error: task " + task["id"] + " has " + str(task["result"]["written"]) + " structures.")
+                passed = False
+        return passed
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    #-------------------------------- Options -------------------------
+    parser = OptionParser()
+    parser.add_option("-q", "--queue", dest="queue", default="queue", type=str,
+            help="queue directory: default 'queue'", metavar="queue")
+    parser.add_option("-s", "--submit", dest="submit", default=None, type=str,
+            help="submit the tasks of a sweep specification (JSON) instead of working", metavar="submit")
+    parser.add_option("-o", "--output", dest="output", default="out", type=str,
+            help="output directory: default 'out'", metavar="output")
+    parser.add_option("-F", "--format", dest="format", default="bin", type=str,
+            help="output format: cif, cifs, xyz, or bin. Default: bin", metavar="format")
+    parser.add_option("-c", "--chunk", dest="chunk", default=10, type=int,
+            help="number of structures per chunk: default 10", metavar="chunk")
+    parser.add_option("-j", "--processes", dest="processes", default=1, type=int,
+            help="number of processes for each task: default 1", metavar="processes")
+    parser.add_option("--seed", dest="seed", default=0, type=int,
+            help="base random seed, shared by all workers: default 0", metavar="seed")
+    parser.add_option("-t", "--timeout", dest="timeout", default=120.0, type=float,
+            help="seconds without a heartbeat before a worker's tasks are reclaimed: default 120", metavar="timeout")
+    parser.add_option("-w", "--worker", dest="worker", default=None, type=str,
+            help="worker name: default hostname-pid", metavar="worker")
+    parser.add_option("--test", dest="test", default=0, type=int,
+            help="run a local check with this many worker processes, then exit", metavar="test")
+    (options, args) = parser.parse_args()
+
+    if options.test > 0:
+        exit(0 if self_test(options.test) else 1)
+
+    queue = work_queue(options.queue, options.worker, options.timeout)
+    if options.submit is not None:
+        added = queue.submit(load_sweep(options.submit))
+        print("Submitted " + str(added) + " tasks.")
+    else:
+        start = time()
+        completed = run_worker(queue, options.output, options.seed, options.chunk, options.format,
+                               options.processes, poll=min(5.0, options.timeout/4.0))
+        print("Worker " + queue.worker + " completed " + str(completed) + " tasks in " + str(round(time()-start, 2)) + "s")
+    print(queue.status())
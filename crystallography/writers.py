@@ -0,0 +1,305 @@
+"""
+Module for writing many generated structures into a few container files,
+instead of one file per structure (or, with cif_directory_writer, into one
+CIF file per structure, as written by the scripts). Each writer accepts
+crystal_record objects (see crystal.py) one at a time through add(), keeps
+them in memory, and appends them to disk once chunk structures have
+accumulated (or on flush() and close()). Writers can be used as context
+managers. The formats are:
+
+    cif_writer: a single CIF file with one data block per structure, using the
+    symmetrized writer in cif.py where possible
+
+    cif_directory_writer: a directory with a separate CIF file per structure
+
+    xyz_writer: an extended XYZ file, readable by ASE
+
+    binary_writer: a directory of flat binary arrays (lattices, coordinates,
+    atomic numbers, and an index of offsets), which can be memory-mapped by
+    dataset.py without parsing
+
+Use open_writer to choose a writer from a file name.
+"""
+import os
+import json
+from abc import ABC, abstractmethod
+import numpy as np
+from crystallography.crystal import CifWriter
+from crystallography.cif import cif_block, formula, asymmetric_unit
+
+class structure_writer(ABC):
+    """
+    Base class for the streaming writers. Subclasses implement write_chunk,
+    which receives a list of (record, name) pairs
+
+    Args:
+        filename: the file (or directory) to append to
+        chunk: the number of structures to keep in memory before writing
+    """
+    def __init__(self, filename, chunk=100):
+        self.filename = filename
+        self.chunk = chunk
+        self.buffer = []
+        self.written = 0
+        """The number of structures written to disk"""
+
+    def add(self, record, name=None):
+        """
+        Adds a crystal_record. It is written once the buffer is full
+        """
+        self.buffer.append((record, name))
+        if len(self.buffer) >= self.chunk:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes any buffered structures to disk
+        """
+        if self.buffer == []:
+            return
+        self.write_chunk(self.buffer)
+        self.written += len(self.buffer)
+        self.buffer = []
+
+    @abstractmethod
+    def write_chunk(self, chunk):
+        """
+        Appends a list of (record, name) pairs to the output
+        """
+
+    def position(self):
+        """
+        Returns the position reached in the output, as a JSON-compatible
+        value which can be passed to rewind_output. Buffered structures are
+        not included. For single files, this is the size in bytes. Directories
+        of CIF files return None (see cif_directory_writer.position)
+        """
+        if not os.path.exists(self.filename):
+            return 0
+        return os.path.getsize(self.filename)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def record_block(record, name):
+    """
+    Returns the CIF data block of a record. Atomic 3D crystals are written
+    with their symmetry (see cif.py). Other records are written by pymatgen's
+    CifWriter in P1
+    """
+    if asymmetric_unit(record) is not None:
+        return cif_block(record, name)
+    #Replace the data block name chosen by CifWriter
+    block = str(CifWriter(record.struct))
+    start = block.index("data_")
+    return "data_" + str(name) + block[block.index("\n", start):]
+
+class cif_writer(structure_writer):
+    """
+    Writes structures as data blocks of a single CIF file (see record_block)
+    """
+    def write_chunk(self, chunk):
+        blocks = []
+        for i, (record, name) in enumerate(chunk):
+            if name is None:
+                name = formula(record) + "_" + str(self.written+i+1)
+            blocks.append(record_block(record, name))
+        with open(self.filename, "a") as f:
+            f.write("\n".join(blocks) + "\n")
+
+class cif_directory_writer(structure_writer):
+    """
+    Writes each structure to its own CIF file, named after the structure,
+    in a directory. Files are written as soon as they are added
+    """
+    def __init__(self, filename, chunk=1):
+        structure_writer.__init__(self, filename, chunk)
+        if not os.path.isdir(filename):
+            os.makedirs(filename)
+
+    def write_chunk(self, chunk):
+        for i, (record, name) in enumerate(chunk):
+            if name is None:
+                name = formula(record) + "_" + str(self.written+i+1)
+            with open(os.path.join(self.filename, str(name)+".cif"), "w") as f:
+                f.write(record_block(record, name) + "\n")
+
+    def position(self):
+        """
+        Returns None: a directory has no rewind position. Each file is named
+        after its structure, so a resumed run which writes the same
+        structures again overwrites the files written after the interruption
+        """
+        return None
+
+class xyz_writer(structure_writer):
+    """
+    Writes structures to a single extended XYZ file. The lattice, the space
+    group, and the name of each structure are stored in the comment line
+    """
+    def write_chunk(self, chunk):
+        lines = []
+        for i, (record, name) in enumerate(chunk):
+            if name is None:
+                name = formula(record) + "_" + str(self.written+i+1)
+            lattice = " ".join("{:.8f}".format(x) for x in record.lattice.flatten())
+            cart = np.dot(record.coordinates, record.lattice)
+            lines.append(str(len(record)))
+            lines.append(('Lattice="{:s}" Properties=species:S:1:pos:R:3 spacegroup={:d} name={:s} '
+                          'pbc="T T T"').format(lattice, int(record.sg), str(name).replace(" ", "_")))
+            sites = record.sites
+            for specie, xyz in zip(sites, cart):
+                lines.append("{:s} {:.8f} {:.8f} {:.8f}".format(specie, xyz[0], xyz[1], xyz[2]))
+        with open(self.filename, "a") as f:
+            f.write("\n".join(lines) + "\n")
+
+#The files of a binary dataset, with their dtype and the shape of one row
+binary_columns = {
+    "lattices": ("<f8", (3, 3)), #one row per structure
+    "index": ("<i8", (3,)), #one row per structure: first atom, number of atoms, space group
+    "coordinates": ("<f8", (3,)), #one row per atom: fractional coordinates
+    "numbers": ("<u1", ()), #one row per atom: atomic number
+    }
+per_atom_columns = ["coordinates", "numbers"]
+
+def row_size(name):
+    """
+    Returns the number of bytes in one row of a binary column
+    """
+    dtype, shape = binary_columns[name]
+    return np.dtype(dtype).itemsize*int(np.prod(shape))
+
+class binary_writer(structure_writer):
+    """
+    Writes structures to a directory of flat little-endian binary arrays, one
+    file per column (see binary_columns). Rows are appended to each file, so
+    the arrays can be memory-mapped directly (see dataset.py). A small
+    metadata.json file stores the number of structures and atoms, and is
+    rewritten after each chunk, so a partially written dataset stays readable
+    """
+    def __init__(self, filename, chunk=1000):
+        structure_writer.__init__(self, filename, chunk)
+        if not os.path.isdir(filename):
+            os.makedirs(filename)
+        self.metadata = read_metadata(filename)
+        self.written = self.metadata["structures"]
+        #Remove any rows written after the last metadata update (for example,
+        #if a previous run was interrupted), so new rows line up with the index
+        for name in binary_columns:
+            path = os.path.join(filename, name+".bin")
+            if os.path.exists(path):
+                rows = self.metadata["structures"]
+                if name in per_atom_columns:
+                    rows = self.metadata["atoms"]
+                with open(path, "r+b") as f:
+                    f.truncate(rows*row_size(name))
+
+    def write_chunk(self, chunk):
+        records = [record for record, name in chunk]
+        sizes = np.array([len(record) for record in records], dtype=np.int64)
+        index = np.zeros((len(records), 3), dtype=np.int64)
+        index[:,0] = self.metadata["atoms"] + np.cumsum(sizes) - sizes
+        index[:,1] = sizes
+        index[:,2] = [record.sg for record in records]
+        columns = {
+            "lattices": np.array([record.lattice for record in records]),
+            "index": index,
+            "coordinates": np.concatenate([record.coordinates for record in records]),
+            "numbers": np.concatenate([record.atomic_numbers for record in records]),
+            }
+        for name in binary_columns:
+            dtype = binary_columns[name][0]
+            with open(os.path.join(self.filename, name+".bin"), "ab") as f:
+                f.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+        self.metadata["structures"] += len(records)
+        self.metadata["atoms"] += int(sizes.sum())
+        write_metadata(self.filename, self.metadata)
+
+    def position(self):
+        return {"structures": self.metadata["structures"], "atoms": self.metadata["atoms"]}
+
+def read_metadata(directory):
+    """
+    Returns the metadata of a binary dataset, or empty metadata if the
+    directory does not contain a dataset yet
+    """
+    path = os.path.join(directory, "metadata.json")
+    if not os.path.exists(path):
+        return {"version": 1, "structures": 0, "atoms": 0,
+                "columns": dict((name, [binary_columns[name][0], list(binary_columns[name][1])])
+                                for name in binary_columns)}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def write_metadata(directory, metadata):
+    #Write to a temporary file first, so readers never see a partial file
+    path = os.path.join(directory, "metadata.json")
+    with open(path+".tmp", "w") as f:
+        json.dump(metadata, f, indent=2, sort_keys=True)
+    os.replace(path+".tmp", path)
+
+def rewind_output(filename, format, position):
+    """
+    Discards everything written to an output after a position returned by
+    the position() method of its writer, for example after an interrupted
+    run. The output can then be reopened with open_writer. Directories of
+    CIF files ("cifs") are left as they are, since files written again are
+    overwritten by name
+
+    Args:
+        filename: the output file or directory
+        format: the output format (see writer_formats)
+        position: the position to return to
+    """
+    if not os.path.exists(filename):
+        return
+    if format == "bin":
+        #binary_writer truncates the column files to the metadata when opened
+        metadata = read_metadata(filename)
+        metadata["structures"] = position["structures"]
+        metadata["atoms"] = position["atoms"]
+        write_metadata(filename, metadata)
+    elif format != "cifs":
+        with open(filename, "r+b") as f:
+            f.truncate(position)
+
+#Writer classes for each output format
+writer_formats = {"cif": cif_writer, "cifs": cif_directory_writer, "xyz": xyz_writer,
+                  "extxyz": xyz_writer, "bin": binary_writer}
+
+def writer_format(filename, default="bin"):
+    """
+    Returns the output format for a file name, from its extension. Names
+    without an extension get the default format
+    """
+    extension = os.path.splitext(filename)[1]
+    return extension[1:].lower() if extension != "" else default
+
+def open_writer(filename, format=None, chunk=None):
+    """
+    Returns a writer for a file name
+
+    Args:
+        filename: the output file, or directory for the binary format
+        format: "cif", "cifs" (a directory of CIF files), "xyz", or "bin".
+            By default, the extension of filename is used, and names without
+            an extension are treated as binary datasets
+        chunk: the number of structures to buffer before writing
+
+    Returns:
+        a structure_writer object, or None if the format is unknown
+    """
+    if format is None:
+        format = writer_format(filename)
+    if format not in writer_formats:
+        print("Error: unknown output format "+str(format))
+        return None
+    if chunk is None:
+        return writer_formats[format](filename)
+    return writer_formats[format](filename, chunk)
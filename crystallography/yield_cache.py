@@ -0,0 +1,186 @@
+"""
+Module for remembering, across runs, how hard each generation task is. A
+yield_cache is a small SQLite database with one row per (space group,
+composition, volume factor): the number of attempts, the number of
+successes, the total time spent, and whether the composition was found to
+be incompatible with the space group. Generators and schedulers can then
+skip hopeless tasks before spending any time on them, and choose a time
+budget for each attempt from the measured mean time (with
+generate_batch(..., cache_budget=True)).
+
+The database has a size bound: rows which have not been updated for max_age
+seconds are removed, and beyond max_entries rows, the least recently
+updated rows are removed.
+
+Example:
+
+    from crystallography.yield_cache import yield_cache
+    from crystallography.batch import generate_batch
+    with yield_cache("yields.sqlite") as cache:
+        for record in generate_batch(225, ['C'], [8], 1.0, 100, cache=cache):
+            pass
+        print(cache.lookup(225, ['C'], [8], 1.0))
+"""
+import os
+import sqlite3
+from time import time
+from crystallography.ledger import task_key
+
+#Used when no file name is given
+default_cache_file = os.path.join(os.path.expanduser("~"), ".crystallography", "yield_cache.sqlite")
+
+class yield_cache():
+    """
+    Persistent attempt, success, and timing counts for generation tasks.
+
+    Args:
+        filename: the SQLite database file. Created if needed
+        max_entries: the largest number of rows kept
+        max_age: rows not updated for this many seconds are removed.
+            Defaults to 90 days
+        min_attempts: the number of attempts needed before a task can be
+            called hopeless
+        min_yield: tasks with a lower success rate are hopeless
+    """
+    def __init__(self, filename=None, max_entries=100000, max_age=90*86400.0, min_attempts=100, min_yield=0.001):
+        if filename is None:
+            filename = default_cache_file
+        directory = os.path.dirname(filename)
+        if directory != "" and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.filename = filename
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.min_attempts = min_attempts
+        self.min_yield = min_yield
+        #Several processes may share the file, so wait for locks
+        self.connection = sqlite3.connect(filename, timeout=60.0)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS yields (
+            key TEXT PRIMARY KEY, attempts INTEGER NOT NULL, successes INTEGER NOT NULL,
+            seconds REAL NOT NULL, incompatible INTEGER NOT NULL, updated REAL NOT NULL)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS yields_updated ON yields (updated)")
+        self.connection.commit()
+        self.evict()
+
+    def record(self, key, attempts, successes, seconds, incompatible=False):
+        """
+        Adds the results of some generation attempts for a task
+
+        Args:
+            key: the task key (see cache_key)
+            attempts: the number of attempts
+            successes: the number of attempts which produced a structure
+            seconds: the total time spent
+            incompatible: True if the composition cannot be placed on the
+                Wyckoff positions of the space group
+        """
+        with self.connection:
+            self.connection.execute("""INSERT INTO yields VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET attempts = attempts + excluded.attempts,
+                successes = successes + excluded.successes, seconds = seconds + excluded.seconds,
+                incompatible = MAX(incompatible, excluded.incompatible), updated = excluded.updated""",
+                (key, int(attempts), int(successes), float(seconds), int(bool(incompatible)), time()))
+        if self.max_entries is not None and self.count() > self.max_entries:
+            self.evict()
+
+    def get(self, key):
+        """
+        Returns the counts for a task key as a dictionary, or None if the
+        task is not in the cache (or has expired)
+        """
+        row = self.connection.execute("SELECT attempts, successes, seconds, incompatible, updated FROM yields WHERE key = ?",
+                                      (key,)).fetchone()
+        if row is None or (self.max_age is not None and row[4] < time() - self.max_age):
+            return None
+        return {"attempts": row[0], "successes": row[1], "seconds": row[2], "incompatible": bool(row[3])}
+
+    def lookup(self, sg, species, numIons, factor, molecular=False):
+        """
+        Returns the counts for a task, as get() does
+        """
+        return self.get(cache_key(sg, species, numIons, factor, molecular))
+
+    def success_rate(self, key):
+        """
+        Returns the success rate of a task with Laplace's rule (see
+        scheduler.cost_model), or None if it is not in the cache
+        """
+        entry = self.get(key)
+        if entry is None:
+            return None
+        return (entry["successes"] + 1.0)/(entry["attempts"] + 2.0)
+
+    def seconds_per_attempt(self, key):
+        """
+        Returns the mean time per attempt, or None if it is not known
+        """
+        entry = self.get(key)
+        if entry is None or entry["attempts"] == 0:
+            return None
+        return entry["seconds"]/entry["attempts"]
+
+    def hopeless(self, key):
+        """
+        Returns True if a task is known to be incompatible, or if its
+        observed success rate (without Laplace's rule, which would keep it
+        above min_yield for roughly 1/min_yield attempts) is below min_yield
+        after min_attempts attempts
+        """
+        entry = self.get(key)
+        if entry is None:
+            return False
+        if entry["incompatible"]:
+            return True
+        return entry["attempts"] >= self.min_attempts and entry["successes"] < self.min_yield*entry["attempts"]
+
+    def budget(self, key, factor=10.0, minimum=1.0):
+        """
+        Returns a time budget for one attempt: factor times the mean time per
+        attempt, and at least minimum seconds. Returns None if the task is
+        not in the cache
+        """
+        seconds = self.seconds_per_attempt(key)
+        if seconds is None:
+            return None
+        return max(minimum, factor*seconds)
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM yields").fetchone()[0]
+
+    def evict(self):
+        """
+        Removes rows older than max_age, then the least recently updated rows
+        beyond max_entries
+
+        Returns:
+            the number of rows removed
+        """
+        removed = 0
+        with self.connection:
+            if self.max_age is not None:
+                removed += self.connection.execute("DELETE FROM yields WHERE updated < ?",
+                                                   (time() - self.max_age,)).rowcount
+            if self.max_entries is not None:
+                removed += self.connection.execute("""DELETE FROM yields WHERE key IN (SELECT key FROM yields
+                    ORDER BY updated DESC LIMIT -1 OFFSET ?)""", (int(self.max_entries),)).rowcount
+        return removed
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        return self.count()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def cache_key(sg, species, numIons, factor, molecular=False):
+    """
+    Returns the cache key of a task. Molecules may be given as names or as
+    pymatgen Molecule objects
+    """
+    names = [s if type(s) == str else str(s.composition.reduced_formula) for s in species]
+    return task_key(sg, names, numIons, factor, molecular)
@@ -1,4 +1,4 @@
-from distutils.core import setup
+from setuptools import setup
 
 with open("README.md", "r") as fh:
     long_description = fh.read()
@@ -14,11 +14,14 @@ setup(
     long_description_content_type="text/markdown",
     url="https://github.com/qzhu2017/crystallography",
     packages=['crystallography', 'crystallography.database'],
-    package_data={'crystallography': ['crystallography.database/*.csv']},
+    package_data={'crystallography': ['crystallography.database/*.csv', 'bench_baseline.json']},
     classifiers=(
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ),
-    requires=['spglib', 'pymatgen', 'numpy', 'scipy', 'ase'],
+    install_requires=['spglib', 'pymatgen', 'numpy', 'scipy', 'pandas', 'ase'],
+    entry_points={
+        'console_scripts': ['crystallography=crystallography.cli:main'],
+    },
 )